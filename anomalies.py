@@ -0,0 +1,127 @@
+# Overview: Finds the days a station's ridership was far from normal, across every station
+# The daily ridership of the whole network is laid out as a station x day matrix from the
+# columnar snapshot. Each day is compared with a baseline made of the same station's days of
+# the same type (weekday, Saturday, Sunday/holiday) in the window before it. The baselines
+# come from running sums along the day axis, one pass per type of day for every station at
+# once, so there is no loop over stations or days in Python. A day is an anomaly when it is
+# more than a number of standard deviations (z-score) or a percentage away from its baseline
+
+import numpy as np
+
+import engines
+import columnar
+import resolver
+
+# calendar days before a day that make up its baseline
+WINDOW_DAYS = 56
+
+# fewest days of the same type a baseline is made from
+MIN_DAYS = 4
+
+# default threshold, in standard deviations (or percent)
+THRESHOLD = 3.0
+
+# code -> Type_Of_Day letter
+day_type_letters = {code: letter for letter, code in columnar.day_type_codes.items()}
+
+##################################################################
+#
+# window_sums
+#
+# Given a station x day matrix, returns for each day the sum of the window
+# days before it, [d - window, d), from one running sum along the days
+# (riders are whole numbers, so the sums stay exact in float64)
+#
+def window_sums(values, window):
+    running = np.zeros(values.shape)
+    np.cumsum(values[:, :-1], axis=1, out=running[:, 1:])
+
+    sums = running.copy()
+    sums[:, window:] -= running[:, :-window]
+    return sums
+
+##################################################################
+#
+# rolling_baseline
+#
+# Given station x day matrices of riders (NaN without data) and type of day
+# codes, returns matrices of the mean and standard deviation of each day's
+# baseline: the days of the same type in the window days before it.
+# Days with fewer than min_days in their baseline are NaN
+#
+def rolling_baseline(riders, day_types, window=WINDOW_DAYS, min_days=MIN_DAYS):
+    mean = np.full(riders.shape, np.nan)
+    deviation = np.full(riders.shape, np.nan)
+    present = ~np.isnan(riders)
+
+    for code in day_type_letters:
+        same = present & (day_types == code)
+        values = np.where(same, riders, 0.0)
+        count = window_sums(same.astype(np.float64), window)
+        total = window_sums(values, window)
+        squares = window_sums(values * values, window)
+
+        usable = same & (count >= min_days)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            average = total / count
+            variance = np.maximum(squares / count - average * average, 0.0)
+        mean[usable] = average[usable]
+        deviation[usable] = np.sqrt(variance[usable])
+
+    return mean, deviation
+
+##################################################################
+#
+# find_anomalies
+#
+# Given a connection, a half-open range of days and a threshold, returns
+# (date, station id, station name, type of day, riders, baseline, z-score,
+# percent change) for every day in the range further from its baseline than
+# threshold standard deviations, or threshold percent when percent is True,
+# the largest first
+#
+def find_anomalies(dbConn, start, end, threshold=THRESHOLD, percent=False, window=WINDOW_DAYS, min_days=MIN_DAYS):
+    names = resolver.get_resolver(dbConn).names
+
+    # the matrix starts window days early, so the first days have their baseline
+    first = columnar.epoch_day(start) - window
+    warmup = str(np.datetime64(first, "D"))
+    station_ids, riders, day_types = engines.snapshot(dbConn).network_matrix(warmup, end)
+    if not riders.size:
+        return []
+
+    mean, deviation = rolling_baseline(riders, day_types, window, min_days)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = (riders - mean) / deviation
+        change = (riders - mean) / mean * 100
+    score = np.abs(change if percent else z)
+
+    # NaN (no data or no baseline) and inf (a flat baseline) are never flagged
+    flagged = np.isfinite(score) & (score >= threshold)
+    flagged[:, :window] = False
+    rows, days = np.nonzero(flagged)
+    order = np.argsort(-score[rows, days], kind="stable")
+    rows, days = rows[order], days[order]
+
+    dates = np.datetime_as_string((days + first).astype("datetime64[D]")).tolist()
+    ids = station_ids[rows].tolist()
+    letters = [day_type_letters[code] for code in day_types[rows, days].tolist()]
+    return [(date, station_id, names.get(station_id, ""), letter, int(value), baseline, score_z, score_change)
+            for date, station_id, letter, value, baseline, score_z, score_change
+            in zip(dates, ids, letters, riders[rows, days].tolist(), mean[rows, days].tolist(), z[rows, days].tolist(), change[rows, days].tolist())]
+
+##################################################################
+#
+# parse_threshold
+#
+# Given a threshold as typed, "3" for standard deviations or "50%" for a
+# percentage (blank for the default), returns (threshold, percent)
+# Raises ValueError when it is not a positive number
+#
+def parse_threshold(text):
+    text = str(text or "").strip()
+    percent = text.endswith("%")
+    threshold = float(text.rstrip("%")) if text.rstrip("%") else THRESHOLD
+    if threshold <= 0:
+        raise ValueError("threshold must be above 0")
+    return threshold, percent
@@ -0,0 +1,144 @@
+# Overview: Runs the queries of the interactive commands on a background thread
+# The worker thread owns a connection of its own to the database. A command hands it a query
+# function and waits for the rows, and while the user is still answering a command's prompts
+# the command can start the query it expects to come next speculatively, e.g. every year of a
+# station once the station is known. Waiting queries go before speculative ones, and a query
+# that was already started speculatively is not run again: the command waits for that run.
+# Speculative runs nobody asked for are dropped, oldest first, past MAX_SPECULATIVE
+
+import queue
+import sqlite3
+import itertools
+import threading
+import collections
+import concurrent.futures
+
+import instrument
+
+# order the worker takes jobs in
+FOREGROUND = 0
+SPECULATIVE = 1
+STOP = 2
+
+# speculative results kept for a command to pick up
+MAX_SPECULATIVE = 32
+
+# seconds close() waits for the job the worker is on
+CLOSE_SECONDS = 5.0
+
+##################################################################
+#
+# QueryWorker
+#
+# One background thread and its connection to the database at db_path,
+# opened with the given connection factory
+#
+class QueryWorker:
+    def __init__(self, db_path, factory=sqlite3.Connection):
+        self.jobs = queue.PriorityQueue()
+        self.numbers = itertools.count()
+        self.speculative = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.connection = None
+        self.speculating = False
+
+        self.thread = threading.Thread(target=self.loop, args=(db_path, factory), name="query-worker", daemon=True)
+        self.thread.start()
+
+    ##################################################################
+    #
+    # loop
+    #
+    # The worker thread: runs jobs on its own connection, in priority order,
+    # until it is stopped
+    #
+    def loop(self, db_path, factory):
+        self.connection = sqlite3.connect(db_path, uri=True, factory=factory)
+        while True:
+            priority, number, job = self.jobs.get()
+            if job is None:
+                break
+            future, function, args, phases = job
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            # a waiting command's phases count the work done for it
+            self.speculating = priority == SPECULATIVE
+            try:
+                with instrument.working_for(phases):
+                    result = function(self.connection, *args)
+            except Exception as error:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+            finally:
+                self.speculating = False
+        self.connection.close()
+
+    ##################################################################
+    #
+    # submit
+    #
+    # Queues function(connection, *args) with a priority and returns its future
+    #
+    def submit(self, priority, function, args, phases=None):
+        future = concurrent.futures.Future()
+        self.jobs.put((priority, next(self.numbers), (future, function, args, phases)))
+        return future
+
+    ##################################################################
+    #
+    # run
+    #
+    # Runs function(connection, *args) on the worker and returns its result,
+    # raising what it raised. Uses the speculative run of the same call when
+    # there is one, waiting for it if it has not finished
+    #
+    def run(self, function, *args):
+        with self.lock:
+            future = self.speculative.pop((function, repr(args)), None)
+        if future is not None and not future.cancelled():
+            with instrument.phase("sql"):
+                return future.result()
+
+        return self.submit(FOREGROUND, function, args, instrument.current_phases()).result()
+
+    ##################################################################
+    #
+    # speculate
+    #
+    # Starts function(connection, *args) when the worker has nothing else to
+    # do, for a later run() of the same call. then(result) is called on the
+    # worker when it succeeds, e.g. to speculate on what follows from it
+    #
+    def speculate(self, function, *args, then=None):
+        key = (function, repr(args))
+        with self.lock:
+            if key in self.speculative:
+                return
+            future = self.submit(SPECULATIVE, function, args)
+            self.speculative[key] = future
+
+            # forget the oldest, not started ones are never run
+            while len(self.speculative) > MAX_SPECULATIVE:
+                self.speculative.popitem(last=False)[1].cancel()
+
+        if then:
+            future.add_done_callback(lambda done: then(done.result()) if not done.cancelled() and done.exception() is None else None)
+
+    ##################################################################
+    #
+    # close
+    #
+    # Drops the speculative runs, interrupts the one running and stops the worker
+    #
+    def close(self):
+        with self.lock:
+            for future in self.speculative.values():
+                future.cancel()
+            self.speculative.clear()
+        if self.speculating and self.connection is not None:
+            self.connection.interrupt()
+
+        self.jobs.put((STOP, next(self.numbers), None))
+        self.thread.join(CLOSE_SECONDS)
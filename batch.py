@@ -0,0 +1,374 @@
+# Overview: Non-interactive batch mode
+# Reads one command per line from a file or stdin, with its arguments in the order the
+# interactive prompts ask for them and key=value options, for example
+#
+#     6 "Clark/Lake" plot=png
+#     7 Belmont 2019
+#     9 41.88 -87.63 radius=2
+#     11 "line:Red" Belmont first=2019-01-01 last=2019-12-31
+#     3 limit=10 offset=20
+#     13 Red Brown
+#     12 first=2019-01-01 last=2019-12-31 threshold=40% window=56
+#     15 "line:Blue" sort=sunday reverse=y limit=10
+#     16 as_of=2019-12-31 baseline=2015 rank=mom order=declining limit=5
+#
+# Every command runs on one shared connection and its results are written as
+# JSON Lines (one object per command) or CSV (one row per result row)
+
+import os
+import csv
+import json
+import shlex
+import sqlite3
+import itertools
+
+import main
+import dates
+import plotting
+import instrument
+import trends
+import comparison
+
+# columns of the CSV output, each command fills the ones it has
+csv_fields = ["line", "command", "error", "station_id", "station", "day_type", "year", "month", "date",
+              "color", "direction", "ada", "latitude", "longitude", "distance", "riders", "count", "percent", "plot", "baseline", "z",
+              "weekday", "saturday", "sunday_holiday", "weekday_percent", "saturday_percent", "sunday_holiday_percent",
+              "rank", "month_riders", "mom", "month_yoy", "year_riders", "yoy", "avg_7", "avg_28", "avg_365", "recovery"]
+
+# plot formats that can be asked for with plot=
+plot_formats = ["png", "svg"]
+
+##################################################################
+#
+# BatchError
+#
+# A command in the batch that cannot run, e.g. a station that was not found
+# The message is reported in that command's result
+#
+class BatchError(Exception):
+    pass
+
+##################################################################
+#
+# argument
+#
+# Returns the positional argument at index, or raises a BatchError naming it
+#
+def argument(args, index, name):
+    if index >= len(args):
+        raise BatchError("missing %s" % name)
+    return args[index]
+
+##################################################################
+#
+# page
+#
+# Returns the limit= (None for all) and offset= options of a listing
+#
+def page(options):
+    try:
+        limit = int(options["limit"]) if "limit" in options else None
+        offset = int(options.get("offset", 0))
+    except ValueError:
+        raise BatchError("limit and offset must be whole numbers")
+    if (limit is not None and limit < 0) or offset < 0:
+        raise BatchError("limit and offset cannot be negative")
+    return limit, offset
+
+##################################################################
+#
+# one_station
+#
+# Given a connection and a station name pattern, returns the single
+# (station id, station name) it matches, like the interactive commands require
+#
+def one_station(dbConn, pattern):
+    result = main.find_stations(dbConn, pattern)
+    if not result:
+        raise BatchError("No station found")
+    if len(result) > 1:
+        raise BatchError("Multiple stations found")
+    return result[0]
+
+##################################################################
+#
+# plot_file
+#
+# Returns the file a command's plot= option asks to be written, or None
+# when no plot was asked for
+#
+def plot_file(options, plot_dir, number, command, label):
+    kind = options.get("plot")
+    if not kind or kind == "n":
+        return None
+    if kind not in plot_formats:
+        raise BatchError("plot must be one of %s" % ", ".join(plot_formats))
+
+    os.makedirs(plot_dir, exist_ok=True)
+
+    # keep the file name to letters, digits and dashes
+    slug = "".join(c if c.isalnum() else "-" for c in label).strip("-")
+    return os.path.join(plot_dir, "%05d-%s-%s.%s" % (number, command, slug, kind))
+
+##################################################################
+#
+# Command runners
+#
+# Each one takes the connection, positional arguments, options and the
+# plot file (or None) and returns the result rows as dictionaries
+#
+
+def run_one(dbConn, args, options, plot):
+    limit, offset = page(options)
+    return [{"station_id": row[0], "station": row[1]} for row in main.iter_stations(dbConn, argument(args, 0, "station name"), limit, offset)]
+
+def run_two(dbConn, args, options, plot):
+    station = argument(args, 0, "station name")
+    a, b, c, d = main.day_type_totals(dbConn, station)
+    if not d:
+        raise BatchError("No data found")
+    return [{"station": station, "day_type": day_type, "riders": riders, "percent": riders / d * 100}
+            for day_type, riders in [("W", a), ("A", b), ("U", c), ("total", d)]]
+
+def run_three(dbConn, args, options, plot):
+    limit, offset = page(options)
+    total = main.weekday_total(dbConn)
+    return [{"station": row[0], "riders": row[1], "percent": row[1] / total * 100 if total else 0} for row in main.iter_weekday_ranking(dbConn, limit, offset)]
+
+def run_four(dbConn, args, options, plot):
+    color = argument(args, 0, "line color")
+    if not main.line_exists(dbConn, color):
+        raise BatchError("No such line")
+    result = main.line_stops(dbConn, color, argument(args, 1, "direction"))
+    if not result:
+        raise BatchError("That line does not run in the direction chosen")
+    return [{"color": color, "station": row[0], "direction": row[1], "ada": row[2] == 1} for row in result]
+
+def run_five(dbConn, args, options, plot):
+    stops, total = main.stops_by_color(dbConn)
+    return [{"color": row[0], "direction": row[1], "count": row[2], "percent": row[2] / total * 100 if total else 0} for row in stops]
+
+def run_six(dbConn, args, options, plot):
+    station = one_station(dbConn, argument(args, 0, "station name"))
+    yearly = main.yearly_ridership(dbConn, station[0])
+    if plot:
+        plotting.plot_yearly(station[1], [row[0] for row in yearly], [row[1] for row in yearly], plot)
+    return [{"station_id": station[0], "station": station[1], "year": row[0], "riders": row[1]} for row in yearly]
+
+def run_seven(dbConn, args, options, plot):
+    station = one_station(dbConn, argument(args, 0, "station name"))
+    year = argument(args, 1, "year")
+    monthly = main.monthly_ridership(dbConn, station[0], year)
+    if plot:
+        plotting.plot_monthly(station[1], year, [row[0] for row in monthly], [row[2] for row in monthly], plot)
+    return [{"station_id": station[0], "station": station[1], "year": year, "month": row[0], "riders": row[2]} for row in monthly]
+
+def run_eight(dbConn, args, options, plot):
+    year = argument(args, 0, "year")
+    station_one = one_station(dbConn, argument(args, 1, "station 1"))
+    station_two = one_station(dbConn, argument(args, 2, "station 2"))
+    days, columns = comparison.daily_matrix(dbConn, [station_one[0], station_two[0]], *dates.year_range(year))
+    if plot:
+        plotting.plot_daily(year, list(range(1, len(days) + 1)), station_one[1], columns[0], station_two[1], columns[1], plot)
+    return [{"station_id": station[0], "station": station[1], "date": day, "riders": riders}
+            for station, column in [(station_one, columns[0]), (station_two, columns[1])] for day, riders in zip(days, column) if riders is not None]
+
+def run_nine(dbConn, args, options, plot):
+    lat = float(argument(args, 0, "latitude"))
+    long = float(argument(args, 1, "longitude"))
+    result = main.stations_within(dbConn, lat, long, float(options.get("radius", 1)))
+    if plot:
+        plotting.plot_nearby(result, plot)
+    return [{"station": row[0], "latitude": row[1], "longitude": row[2], "distance": row[3]} for row in result]
+
+def run_ten(dbConn, args, options, plot):
+    lat = float(argument(args, 0, "latitude"))
+    long = float(argument(args, 1, "longitude"))
+    result = main.nearest_stations(dbConn, lat, long, int(argument(args, 2, "number of stations")))
+    return [{"station": row[1], "latitude": row[2], "longitude": row[3], "distance": row[0]} for row in result]
+
+def run_eleven(dbConn, args, options, plot):
+    if not args:
+        raise BatchError("missing stations")
+    stations, unmatched = comparison.select_stations(dbConn, args)
+    if unmatched:
+        raise BatchError("No station found for %s" % ", ".join(unmatched))
+    start, end = comparison.date_span(dbConn, options.get("first", ""), options.get("last", ""))
+    if not start:
+        raise BatchError("Invalid range of days")
+    days, columns = comparison.daily_matrix(dbConn, [row[0] for row in stations], start, end)
+    if plot:
+        plotting.plot_compare(days, [row[1] for row in stations], columns, plot)
+    # every day of every station, riders null on the days without data
+    return [{"station_id": station[0], "station": station[1], "date": day, "riders": riders}
+            for station, column in zip(stations, columns) for day, riders in zip(days, column)]
+
+def run_twelve(dbConn, args, options, plot):
+    try:
+        import anomalies
+    except ImportError:
+        raise BatchError("NumPy is needed to look for anomalies")
+    start, end = comparison.date_span(dbConn, options.get("first", ""), options.get("last", ""))
+    if not start:
+        raise BatchError("Invalid range of days")
+    threshold, percent = anomalies.parse_threshold(options.get("threshold", ""))
+    window = int(options.get("window", anomalies.WINDOW_DAYS))
+    if window < 1:
+        raise BatchError("window must be at least 1 day")
+    limit, offset = page(options)
+    result = anomalies.find_anomalies(dbConn, start, end, threshold, percent, window)
+    return [{"date": row[0], "station_id": row[1], "station": row[2], "day_type": row[3], "riders": row[4], "baseline": row[5], "z": row[6], "percent": row[7]}
+            for row in itertools.islice(result, offset, None if limit is None else offset + limit)]
+
+def run_thirteen(dbConn, args, options, plot):
+    colors = [argument(args, 0, "line color"), argument(args, 1, "second line color")]
+    for color in colors:
+        if not main.line_exists(dbConn, color):
+            raise BatchError("No such line")
+    return [{"station_id": row[0], "station": row[1]} for row in main.shared_stations(dbConn, colors[0], colors[1])]
+
+def run_fourteen(dbConn, args, options, plot):
+    return [{"color": row[0], "ada": row[1], "count": row[2], "percent": row[1] / row[2] * 100 if row[2] else 0} for row in main.ada_by_line(dbConn)]
+
+def run_fifteen(dbConn, args, options, plot):
+    station_ids = None
+    if args:
+        stations, unmatched = comparison.select_stations(dbConn, args)
+        if unmatched:
+            raise BatchError("No station found for %s" % ", ".join(unmatched))
+        station_ids = [row[0] for row in stations]
+    limit, offset = page(options)
+    result = main.day_type_profile(dbConn, station_ids, options.get("sort", "weekday"), options.get("reverse", "n") == "y")
+    return [{"station_id": row[0], "station": row[1], "weekday": row[2], "saturday": row[3], "sunday_holiday": row[4], "riders": row[5],
+             "weekday_percent": main.profile_share(row, 2), "saturday_percent": main.profile_share(row, 3), "sunday_holiday_percent": main.profile_share(row, 4)}
+            for row in itertools.islice(result, offset, None if limit is None else offset + limit)]
+
+def run_sixteen(dbConn, args, options, plot):
+    result = trends.station_trends(dbConn, options.get("as_of", ""), options.get("baseline", trends.BASELINE_YEAR))
+    growing, declining = trends.rank(result, options.get("rank", "yoy"))
+    order = options.get("order", "growing")
+    if order not in ("growing", "declining"):
+        raise BatchError("order must be growing or declining")
+    limit, offset = page(options)
+    ranked = growing if order == "growing" else declining
+    return [dict(row._asdict(), rank=position)
+            for position, row in itertools.islice(enumerate(ranked, 1), offset, None if limit is None else offset + limit)]
+
+# command number -> runner
+runners = {
+    "1": run_one,
+    "2": run_two,
+    "3": run_three,
+    "4": run_four,
+    "5": run_five,
+    "6": run_six,
+    "7": run_seven,
+    "8": run_eight,
+    "9": run_nine,
+    "10": run_ten,
+    "11": run_eleven,
+    "12": run_twelve,
+    "13": run_thirteen,
+    "14": run_fourteen,
+    "15": run_fifteen,
+    "16": run_sixteen,
+}
+
+##################################################################
+#
+# parse_line
+#
+# Given one line of a batch, returns (command, positional args, options),
+# or None for blank lines and # comments
+#
+def parse_line(line):
+    words = shlex.split(line, comments=True)
+    if not words:
+        return None
+
+    args = []
+    options = {}
+    for word in words[1:]:
+        if "=" in word:
+            key, value = word.split("=", 1)
+            options[key] = value
+        else:
+            args.append(word)
+
+    return words[0], args, options
+
+##################################################################
+#
+# run_line
+#
+# Given a connection, the line number and one line of a batch, runs it
+# and returns its result as a dictionary with the rows or the error,
+# or None for blank lines and comments
+#
+def run_line(dbConn, number, line, plot_dir="."):
+    try:
+        parsed = parse_line(line)
+    except ValueError as error:
+        # e.g. unbalanced quotes
+        return {"line": number, "command": "", "args": [], "options": {}, "ok": False, "error": str(error)}
+    if parsed is None:
+        return None
+
+    command, args, options = parsed
+    result = {"line": number, "command": command, "args": args, "options": options}
+
+    try:
+        if command not in runners:
+            raise BatchError("unknown command")
+        plot = plot_file(options, plot_dir, number, command, " ".join(args))
+        with instrument.command(command):
+            result["rows"] = runners[command](dbConn, args, options, plot)
+        if plot:
+            result["plot"] = plot
+        result["ok"] = True
+    except (BatchError, ValueError, OSError) as error:
+        result["ok"] = False
+        result["error"] = str(error)
+    except (sqlite3.Error, TypeError, ZeroDivisionError) as error:
+        # a failing command is reported on its line, the rest of the batch still runs
+        result["ok"] = False
+        result["error"] = "%s: %s" % (type(error).__name__, error)
+
+    return result
+
+##################################################################
+#
+# run_batch
+#
+# Given a connection, a stream of batch lines and an output stream, runs
+# every command and writes the results as "jsonl" or "csv"
+# Returns the number of commands that failed
+#
+def run_batch(dbConn, lines, out, format="jsonl", plot_dir="."):
+    failed = 0
+    writer = None
+
+    if format == "csv":
+        writer = csv.DictWriter(out, fieldnames=csv_fields, extrasaction="ignore")
+        writer.writeheader()
+
+    for number, line in enumerate(lines, 1):
+        result = run_line(dbConn, number, line, plot_dir)
+        if result is None:
+            continue
+        if not result["ok"]:
+            failed += 1
+
+        # one json object per command
+        if writer is None:
+            out.write(json.dumps(result) + "\n")
+            continue
+
+        # one csv row per result row, or one row holding the error
+        base = {"line": number, "command": result["command"], "plot": result.get("plot", "")}
+        if not result["ok"]:
+            writer.writerow(dict(base, error=result["error"]))
+        for row in result.get("rows", []):
+            writer.writerow(dict(base, **row))
+
+    return failed
@@ -0,0 +1,225 @@
+# Overview: Benchmark suite for the query path of every command
+# Each case calls the same query function the command uses, once on a fresh connection
+# with the in-memory caches emptied (cold) and then repeatedly (warm), recording the
+# times, calls per second, peak Python memory and a digest of the result.
+# Results can be saved as a baseline, and a later run checked against it fails when a
+# case got slower than the tolerance allows or returns a different result. A baseline is
+# only checked against runs on the engine it was saved with
+#
+# Usage: python bench.py --db synthetic_cta.db [--engine numpy] [--save-baseline | --check]
+#
+# The OS file cache cannot be dropped from here, so "cold" means a new SQLite connection
+# and empty app caches; for a truly cold disk, drop the OS cache before the run
+
+import sys
+import json
+import time
+import hashlib
+import sqlite3
+import argparse
+import statistics
+import tracemalloc
+
+import main
+import dates
+import stats
+import engines
+import rollups
+import spatial
+import resolver
+import trends
+import topology
+import comparison
+import resultcache
+
+##################################################################
+#
+# startup
+#
+# Given a connection, does the work the app does when it starts, so the
+# summary and rollup tables are current before anything is timed
+#
+def startup(dbConn):
+    try:
+        rollups.refresh_rollups(dbConn)
+    except sqlite3.OperationalError:
+        # read only database, the commands use the raw tables
+        pass
+    stats.load_stats(dbConn)
+
+##################################################################
+#
+# reset_caches
+#
+# Empties every cache the app keeps in memory between commands
+#
+def reset_caches():
+    resolver._resolvers.clear()
+    spatial._indexes.clear()
+    engines._snapshots.clear()
+    resultcache._caches.clear()
+    topology._topologies.clear()
+
+##################################################################
+#
+# cases
+#
+# Given a connection, returns (name, function, arguments) for the query
+# path of every command, with a station, year and location from the database
+#
+def cases(dbConn):
+    dbCursor = dbConn.cursor()
+
+    # a station whose name is not shared, as commands 6-8 require
+    station_id, station_name = dbCursor.execute("SELECT MIN(Station_ID), Station_Name FROM Stations GROUP BY Station_Name HAVING count(*) = 1 ORDER BY 1 LIMIT 1;").fetchone()
+    other_id = dbCursor.execute("SELECT MAX(Station_ID) FROM Stations GROUP BY Station_Name HAVING count(*) = 1 ORDER BY 1 DESC LIMIT 1;").fetchone()[0]
+    first, last = dbCursor.execute("SELECT strftime('%Y', MIN(Ride_Date)), strftime('%Y', MAX(Ride_Date)) FROM Ridership;").fetchone()
+    year = str((int(first) + int(last)) // 2)
+    lat, long = dbCursor.execute("SELECT Latitude, Longitude FROM Stops WHERE Station_ID = ? LIMIT 1;", (station_id,)).fetchone()
+    color, direction = dbCursor.execute("SELECT Color, Direction FROM Lines JOIN StopDetails ON Lines.Line_ID = StopDetails.Line_ID JOIN Stops ON Stops.Stop_ID = StopDetails.Stop_ID LIMIT 1;").fetchone()
+    colors = [row[0] for row in dbCursor.execute("SELECT Color FROM Lines ORDER BY Line_ID LIMIT 2;").fetchall()]
+    other_color = colors[-1] if colors else color
+    start, end = dates.year_range(year)
+
+    case_list = [
+        ("stats", lambda dbConn: stats.load_stats(dbConn), ()),
+        ("1 find stations", main.find_stations, ("%a%",)),
+        ("2 day types", main.day_type_totals, (station_name,)),
+        ("3 weekday ranking", main.weekday_ranking, ()),
+        ("4 line stops", main.line_stops, (color, direction)),
+        ("5 stops by color", main.stops_by_color, ()),
+        ("6 yearly", main.yearly_ridership, (station_id,)),
+        ("7 monthly", main.monthly_ridership, (station_id, year)),
+        ("8 daily x2", lambda dbConn, a, b, y: (main.daily_ridership(dbConn, a, y), main.daily_ridership(dbConn, b, y)), (station_id, other_id, year)),
+        ("9 within a mile", main.stations_within, (lat, long, 1.0)),
+        ("10 nearest 5", main.nearest_stations, (lat, long, 5)),
+        ("11 compare x2", comparison.daily_matrix, ([station_id, other_id], start, end)),
+        ("13 shared stations", main.shared_stations, (color, other_color)),
+        ("14 ada by line", main.ada_by_line, ()),
+        ("15 day-type profile", main.day_type_profile, ()),
+        ("16 trends", trends.station_trends, ()),
+    ]
+
+    # anomalies need NumPy, with either engine
+    try:
+        import anomalies
+        case_list.insert(12, ("12 anomalies", anomalies.find_anomalies, (start, end)))
+    except ImportError:
+        pass
+    return case_list
+
+##################################################################
+#
+# digest
+#
+# Returns a short hash of a result, to tell whether two runs agree
+#
+def digest(result):
+    return hashlib.sha1(repr(result).encode("utf-8")).hexdigest()[:16]
+
+##################################################################
+#
+# run_case
+#
+# Given the database path, a case and the number of warm runs, returns the
+# case's measurements
+#
+def run_case(db_path, function, args, repeat):
+    # cold, new connection and empty caches
+    reset_caches()
+    dbConn = sqlite3.connect(db_path, uri=True)
+    start = time.perf_counter()
+    result = function(dbConn, *args)
+    cold = time.perf_counter() - start
+
+    # warm, repeated on the same connection
+    times = []
+    tracemalloc.start()
+    for i in range(repeat):
+        start = time.perf_counter()
+        function(dbConn, *args)
+        times.append(time.perf_counter() - start)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    dbConn.close()
+
+    warm = statistics.median(times)
+    return {
+        "cold_ms": round(cold * 1000, 3),
+        "warm_ms": round(warm * 1000, 3),
+        "per_sec": round(1 / warm, 1) if warm else None,
+        "peak_kb": round(peak / 1024, 1),
+        "digest": digest(result),
+    }
+
+##################################################################
+#
+# compare
+#
+# Given this run's and the baseline's measurements, returns a list of
+# problems: results that changed and cases slower than the tolerance
+# (a fraction of the baseline time) plus slack milliseconds
+#
+def compare(results, baseline, tolerance, slack):
+    problems = []
+    for name, measured in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        if measured["digest"] != expected["digest"]:
+            problems.append("%s: result changed" % name)
+        if measured["warm_ms"] > expected["warm_ms"] * (1 + tolerance) + slack:
+            problems.append("%s: %.3f ms warm, baseline %.3f ms" % (name, measured["warm_ms"], expected["warm_ms"]))
+    return problems
+
+##################################################################
+#
+# main
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the query path of every command")
+    parser.add_argument("--db", default="CTA2_L_daily_ridership.db", help="path to the CTA database")
+    parser.add_argument("--engine", choices=engines.names, default="sqlite", help="backend the ridership aggregations run on")
+    parser.add_argument("--repeat", type=int, default=20, help="warm runs per case")
+    parser.add_argument("--baseline", default="bench_baseline.json", help="baseline file")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--check", action="store_true", help="fail if this run regressed against the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before --check fails, 0.25 = 25%%")
+    parser.add_argument("--slack", type=float, default=0.1, help="milliseconds of timing noise allowed on top of the tolerance")
+    args = parser.parse_args()
+
+    # a baseline of the other engine times other code
+    baseline = None
+    if args.check:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get("engine") != args.engine:
+            print("**%s was saved with the %s engine, check it with --engine %s" % (args.baseline, baseline.get("engine"), baseline.get("engine")))
+            sys.exit(2)
+
+    engines.set_engine(args.engine)
+    dbConn = sqlite3.connect(args.db, uri=True)
+    startup(dbConn)
+    case_list = cases(dbConn)
+    dbConn.close()
+
+    # run and print every case
+    results = {}
+    print("%-20s %10s %10s %10s %10s  %s" % ("case", "cold ms", "warm ms", "per sec", "peak KB", "digest"))
+    for name, function, case_args in case_list:
+        measured = run_case(args.db, function, case_args, args.repeat)
+        results[name] = measured
+        print("%-20s %10.3f %10.3f %10s %10.1f  %s" % (name, measured["cold_ms"], measured["warm_ms"], measured["per_sec"], measured["peak_kb"], measured["digest"]))
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump({"engine": args.engine, "cases": results}, baseline_file, indent=2)
+        print("Saved baseline to %s" % args.baseline)
+
+    if args.check:
+        problems = compare(results, baseline["cases"], args.tolerance, args.slack)
+        for problem in problems:
+            print("**Regression: %s" % problem)
+        if problems:
+            sys.exit(1)
+        print("No regressions against %s" % args.baseline)
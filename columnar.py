@@ -0,0 +1,507 @@
+# Overview: Columnar snapshot of Ridership for the NumPy engine
+# Ridership is exported once to flat binary column files next to the database (station id
+# as int32, date as days since 1970-01-01 as int32, type of day as uint8, riders as int32)
+# that are memory-mapped on load. A refresh appends only the rows added since the last
+# export and falls back to a full export, into a new generation of column files, when
+# rows were changed or deleted, as counted by triggers on Ridership, or a year was rolled
+# into or out of a partition. Either way it returns a new snapshot and leaves the one
+# it refreshed, which other threads may still be reading, as it was.
+# The aggregations of commands 2, 3, 6, 7, 8 and 15 and the station comparison run as
+# vectorized group-bys over the columns and return the same rows as the SQL queries
+
+import os
+import json
+import sqlite3
+
+import numpy as np
+
+import dates
+import partitions
+
+# SQL queries as global constants so that they are not changed
+# every row is exported so the row count matches the stats summary, missing values become 0
+query_export = "SELECT rowid, COALESCE(Station_ID, 0), COALESCE(CAST(julianday(Ride_Date) - 2440587.5 AS INTEGER), 0), Type_Of_Day, COALESCE(Num_Riders, 0) FROM Ridership WHERE rowid > ? ORDER BY rowid;"
+query_signature = "SELECT Num_Entries, Total_Riders FROM Stats_Summary WHERE Id = 1;"
+query_max_rowid = "SELECT MAX(rowid) FROM Ridership;"
+query_changes = "SELECT Inserts, Changes FROM Ridership_Changes WHERE Id = 1;"
+
+# the rows inserted into Ridership and the rows updated or deleted, counted by triggers so a
+# refresh can tell rows that were only appended from any other change, every statement is
+# idempotent so the script can be run when the counts are first needed
+changes_schema = """
+CREATE TABLE IF NOT EXISTS Ridership_Changes (
+    Id INTEGER PRIMARY KEY CHECK (Id = 1),
+    Inserts INTEGER NOT NULL,
+    Changes INTEGER NOT NULL
+);
+
+INSERT OR IGNORE INTO Ridership_Changes (Id, Inserts, Changes) VALUES (1, 0, 0);
+
+CREATE TRIGGER IF NOT EXISTS Changes_Ridership_Insert AFTER INSERT ON Ridership
+BEGIN
+    UPDATE Ridership_Changes SET Inserts = Inserts + 1 WHERE Id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS Changes_Ridership_Delete AFTER DELETE ON Ridership
+BEGIN
+    UPDATE Ridership_Changes SET Changes = Changes + 1 WHERE Id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS Changes_Ridership_Update AFTER UPDATE ON Ridership
+BEGIN
+    UPDATE Ridership_Changes SET Changes = Changes + 1 WHERE Id = 1;
+END;
+"""
+
+# column name -> dtype, in file order
+columns = [("station", np.int32), ("day", np.int32), ("day_type", np.uint8), ("riders", np.int32)]
+
+# Type_Of_Day letters and their codes, anything else is OTHER
+day_type_codes = {"W": 0, "A": 1, "U": 2}
+OTHER = 3
+
+# rows read from SQLite at a time during an export
+CHUNK_ROWS = 200000
+
+##################################################################
+#
+# epoch_day
+#
+# Given a 'YYYY-MM-DD' date, returns it as days since 1970-01-01
+#
+def epoch_day(date):
+    return int(np.datetime64(date[0:10], "D").astype(np.int64))
+
+##################################################################
+#
+# change_counts
+#
+# Given a connection to the CTA database, returns the (inserts, changes)
+# the triggers of changes_schema counted, creating them the first time,
+# or None when they are not there and the database cannot be written
+#
+def change_counts(dbConn):
+    dbCursor = dbConn.cursor()
+    try:
+        dbCursor.execute(query_changes)
+        return dbCursor.fetchone()
+    except sqlite3.OperationalError:
+        # not created yet
+        pass
+
+    try:
+        with dbConn:
+            dbConn.executescript(changes_schema)
+    except sqlite3.OperationalError:
+        # a read-only database
+        return None
+    dbCursor.execute(query_changes)
+    return dbCursor.fetchone()
+
+##################################################################
+#
+# ColumnSnapshot
+#
+# Memory-mapped Ridership columns for one database, kept in the directory
+# path (or only in memory when path is None)
+#
+class ColumnSnapshot:
+    def __init__(self, path=None):
+        self.path = path
+        self.meta = {"rows": 0, "last_rowid": 0, "entries": None, "total": None}
+        self.station = np.zeros(0, np.int32)
+        self.day = np.zeros(0, np.int32)
+        self.day_type = np.zeros(0, np.uint8)
+        self.riders = np.zeros(0, np.int32)
+        self.order = None
+
+        # pick up an earlier export
+        if self.path and os.path.exists(os.path.join(self.path, "meta.json")):
+            with open(os.path.join(self.path, "meta.json")) as meta_file:
+                self.meta = json.load(meta_file)
+            self.map_columns()
+
+    # file holding one column, of the snapshot's generation
+    def column_file(self, name):
+        generation = self.meta.get("generation", 0)
+        if generation:
+            return os.path.join(self.path, "%s.%d.bin" % (name, generation))
+        return os.path.join(self.path, name + ".bin")
+
+    ##################################################################
+    #
+    # map_columns
+    #
+    # Memory-maps the first meta["rows"] values of every column file
+    #
+    def map_columns(self):
+        self.order = None
+        for name, dtype in columns:
+            if self.meta["rows"]:
+                setattr(self, name, np.memmap(self.column_file(name), dtype=dtype, mode="r", shape=(self.meta["rows"],)))
+            else:
+                setattr(self, name, np.zeros(0, dtype))
+
+    ##################################################################
+    #
+    # signature
+    #
+    # Given a connection to the CTA database, returns what the snapshot of
+    # its current rows records: the max rowid, the ride entries and total
+    # riders from the stats summary table, the inserts and changes from
+    # change_counts (each None without them) and the rolled years
+    #
+    def signature(self, dbConn):
+        dbCursor = dbConn.cursor()
+        dbCursor.execute(query_max_rowid)
+        signature = {"last_rowid": dbCursor.fetchone()[0] or 0, "entries": None, "total": None, "inserts": None, "changes": None}
+        try:
+            dbCursor.execute(query_signature)
+            row = dbCursor.fetchone()
+            if row:
+                signature["entries"], signature["total"] = row
+        except sqlite3.OperationalError:
+            # no summary table
+            pass
+
+        counts = change_counts(dbConn)
+        if counts:
+            signature["inserts"], signature["changes"] = counts
+        signature["partitions"] = sorted(partitions.partition_files(dbConn))
+        return signature
+
+    ##################################################################
+    #
+    # refresh
+    #
+    # Given a connection to the CTA database, returns the snapshot up to date:
+    # this one when it is current, one with the new rows appended when
+    # Ridership only grew, and a full re-export otherwise
+    #
+    def refresh(self, dbConn):
+        signature = self.signature(dbConn)
+
+        # already current
+        if all(self.meta.get(key) == value for key, value in signature.items()):
+            return self
+
+        # rows only appended, none changed or deleted and no year rolled or unrolled,
+        # add them past the end of the files this one maps
+        if signature["last_rowid"] > self.meta["last_rowid"] and all(self.meta.get(key) == signature[key] for key in ("changes", "partitions")):
+            snapshot = self.successor()
+            snapshot.export(dbConn, self.meta["last_rowid"])
+
+            # every insert was one of the appended rows, and they add up to the stats summary
+            counted = signature["changes"] is None or snapshot.meta["rows"] - self.meta["rows"] == signature["inserts"] - self.meta["inserts"]
+            summed = signature["entries"] is None or (snapshot.meta["rows"] == signature["entries"] and int(snapshot.riders.sum(dtype=np.int64)) == (signature["total"] or 0))
+            if counted and summed:
+                snapshot.save_meta(signature)
+                return snapshot
+
+        # rows were changed or deleted, start over in new files, with the partitioned
+        # years first (their rowids are not Ridership's, so they are not tracked)
+        snapshot = self.successor(reset=True)
+        for year, sql in partitions.each_partition(dbConn, query_export):
+            snapshot.export(dbConn, 0, sql, False)
+        snapshot.export(dbConn, 0)
+        snapshot.save_meta(signature)
+        snapshot.remove_stale()
+        return snapshot
+
+    ##################################################################
+    #
+    # successor
+    #
+    # Returns a new snapshot to refresh in place of this one: holding the
+    # same rows, or with reset none, in the next generation of column files
+    #
+    def successor(self, reset=False):
+        snapshot = ColumnSnapshot()
+        snapshot.path = self.path
+        if reset:
+            snapshot.meta["generation"] = self.meta.get("generation", 0) + 1
+        else:
+            snapshot.meta = dict(self.meta)
+            for name, dtype in columns:
+                setattr(snapshot, name, getattr(self, name))
+        return snapshot
+
+    ##################################################################
+    #
+    # remove_stale
+    #
+    # Removes the column files of earlier generations. A file still mapped
+    # where that cannot be removed (Windows) is left for the next re-export
+    #
+    def remove_stale(self):
+        if not self.path:
+            return
+        current = set(os.path.basename(self.column_file(name)) for name, dtype in columns)
+        for file_name in os.listdir(self.path):
+            if file_name.endswith(".bin") and file_name not in current:
+                try:
+                    os.remove(os.path.join(self.path, file_name))
+                except OSError:
+                    pass
+
+    ##################################################################
+    #
+    # export
+    #
+    # Given a connection to the CTA database, appends every Ridership row
+    # after the given rowid to the columns. A query reading a partition can
+    # be given, whose rowids are not recorded
+    #
+    def export(self, dbConn, after_rowid, sql=query_export, track=True):
+        dbCursor = dbConn.cursor()
+        dbCursor.execute(sql, (after_rowid,))
+        chunks = {name: [] for name, dtype in columns}
+
+        # drop anything past the last complete export, e.g. from an interrupted one
+        if self.path:
+            os.makedirs(self.path, exist_ok=True)
+            for name, dtype in columns:
+                with open(self.column_file(name), "ab") as column:
+                    column.truncate(self.meta["rows"] * np.dtype(dtype).itemsize)
+
+        rows = dbCursor.fetchmany(CHUNK_ROWS)
+        while rows:
+            rowids, stations, days, day_types, riders = zip(*rows)
+            chunk = {
+                "station": np.array(stations, np.int32),
+                "day": np.array(days, np.int32),
+                "day_type": np.array([day_type_codes.get(day_type, OTHER) for day_type in day_types], np.uint8),
+                "riders": np.array(riders, np.int32),
+            }
+
+            # files are appended to, memory keeps the chunks to join at the end
+            for name, dtype in columns:
+                if self.path:
+                    with open(self.column_file(name), "ab") as column:
+                        column.write(chunk[name].tobytes())
+                else:
+                    chunks[name].append(chunk[name])
+
+            self.meta["rows"] += len(rows)
+            if track:
+                self.meta["last_rowid"] = rowids[-1]
+            rows = dbCursor.fetchmany(CHUNK_ROWS)
+
+        if self.path:
+            self.map_columns()
+        else:
+            for name, dtype in columns:
+                setattr(self, name, np.concatenate([getattr(self, name)] + chunks[name]))
+            self.order = None
+
+    ##################################################################
+    #
+    # save_meta
+    #
+    # Records what the snapshot holds, its signature, so a later run can pick it up
+    #
+    def save_meta(self, signature):
+        self.meta.update(signature)
+        if self.path:
+            # replaced whole, so a reader never loads half of it
+            os.makedirs(self.path, exist_ok=True)
+            with open(os.path.join(self.path, "meta.json.tmp"), "w") as meta_file:
+                json.dump(self.meta, meta_file)
+            os.replace(os.path.join(self.path, "meta.json.tmp"), os.path.join(self.path, "meta.json"))
+
+    ##################################################################
+    #
+    # station_rows
+    #
+    # Given a list of station ids, returns the positions of their rows
+    # Uses an index of the rows sorted by station, built the first time it
+    # is needed after each refresh, so one station does not scan every row
+    #
+    def station_rows(self, station_ids):
+        if self.order is None:
+            self.order = np.argsort(self.station, kind="stable")
+            self.sorted_stations = self.station[self.order]
+
+        # search with the column's own type, a Python int would convert the whole column
+        keys = np.asarray(station_ids, np.int32)
+        starts = np.searchsorted(self.sorted_stations, keys, "left")
+        ends = np.searchsorted(self.sorted_stations, keys, "right")
+        parts = [self.order[start:end] for start, end in zip(starts.tolist(), ends.tolist())]
+        return np.concatenate(parts) if parts else self.order[:0]
+
+    ##################################################################
+    #
+    # day_type_totals
+    #
+    # Given the station ids sharing a name, returns the (weekday, saturday,
+    # sunday/holiday, total) ridership, the total None if there is no data
+    #
+    def day_type_totals(self, station_ids):
+        mask = self.station_rows(station_ids)
+        sums = np.bincount(self.day_type[mask], weights=self.riders[mask], minlength=OTHER + 1)
+        counts = np.bincount(self.day_type[mask], minlength=OTHER + 1)
+
+        # a type of day without rows is 0, the total None when there are no rows at all
+        totals = [int(sums[code]) for code in range(3)]
+        return tuple(totals) + (int(sums.sum()) if counts.sum() else None,)
+
+    ##################################################################
+    #
+    # day_type_profile
+    #
+    # Given the station id -> station name mapping, returns (station id,
+    # station name, weekday, saturday, sunday/holiday, total) ridership for
+    # every station with data, by station id, from one bincount over
+    # station x type of day
+    #
+    def day_type_profile(self, names):
+        if not self.station.size:
+            return []
+
+        # one cell per station and type of day, a row of OTHER + 1 cells per station
+        cells = self.station.astype(np.int64) * (OTHER + 1) + self.day_type
+        size = (int(self.station.max()) + 1) * (OTHER + 1)
+        sums = np.bincount(cells, weights=self.riders, minlength=size).reshape(-1, OTHER + 1)
+        counts = np.bincount(cells, minlength=size).reshape(-1, OTHER + 1)
+
+        result = []
+        for station_id in np.flatnonzero(counts.sum(axis=1)).tolist():
+            if station_id in names:
+                row = [int(value) for value in sums[station_id].tolist()]
+                result.append((station_id, names[station_id], row[0], row[1], row[2], sum(row)))
+        return result
+
+    ##################################################################
+    #
+    # weekday_ranking
+    #
+    # Given the station id -> station name mapping, returns the (station name,
+    # riders) weekday totals from busiest to quietest and the weekday total of
+    # all stations
+    #
+    def weekday_ranking(self, names):
+        mask = self.day_type == day_type_codes["W"]
+        if not mask.any():
+            return [], None
+
+        # weekday riders per station id
+        sums = np.bincount(self.station[mask], weights=self.riders[mask])
+        counts = np.bincount(self.station[mask])
+
+        # stations sharing a name are reported together
+        by_name = {}
+        for station_id in np.flatnonzero(counts).tolist():
+            if station_id in names:
+                by_name[names[station_id]] = by_name.get(names[station_id], 0) + int(sums[station_id])
+
+        result = sorted(by_name.items(), key=lambda row: (-row[1], row[0]))
+        return result, int(self.riders[mask].sum(dtype=np.int64))
+
+    ##################################################################
+    #
+    # yearly_ridership
+    #
+    # Given a station id, returns (year, riders) for every year
+    #
+    def yearly_ridership(self, station_id):
+        mask = self.station_rows([station_id])
+        years = self.day[mask].astype("datetime64[D]").astype("datetime64[Y]").astype(np.int64) + 1970
+
+        keys, groups = np.unique(years, return_inverse=True)
+        sums = np.bincount(groups, weights=self.riders[mask])
+        return [("%04d" % year, int(total)) for year, total in zip(keys.tolist(), sums.tolist())]
+
+    ##################################################################
+    #
+    # days_in
+    #
+    # Given a station id and a year, returns the positions of its rows in that year
+    #
+    def days_in(self, station_id, year):
+        start, end = dates.year_range(year)
+        rows = self.station_rows([station_id])
+        if not start:
+            return rows[:0]
+        days = self.day[rows]
+        return rows[(days >= epoch_day(start)) & (days < epoch_day(end))]
+
+    ##################################################################
+    #
+    # monthly_ridership
+    #
+    # Given a station id and a year, returns (month, 'mm/yyyy', riders)
+    # for every month of that year
+    #
+    def monthly_ridership(self, station_id, year):
+        mask = self.days_in(station_id, year)
+        months = self.day[mask].astype("datetime64[D]").astype("datetime64[M]").astype(np.int64) % 12 + 1
+
+        keys, groups = np.unique(months, return_inverse=True)
+        sums = np.bincount(groups, weights=self.riders[mask])
+        return [("%02d" % month, "%02d/%s" % (month, str(year).strip()), int(total)) for month, total in zip(keys.tolist(), sums.tolist())]
+
+    ##################################################################
+    #
+    # daily_ridership
+    #
+    # Given a station id and a year, returns ('yyyy-mm-dd', riders) for
+    # every day of that year with data
+    #
+    def daily_ridership(self, station_id, year):
+        mask = self.days_in(station_id, year)
+
+        keys, groups = np.unique(self.day[mask], return_inverse=True)
+        sums = np.bincount(groups, weights=self.riders[mask])
+        days = np.datetime_as_string(keys.astype("datetime64[D]"))
+        return [(day, int(total)) for day, total in zip(days.tolist(), sums.tolist())]
+
+    ##################################################################
+    #
+    # daily_matrix
+    #
+    # Given station ids and a half-open range of days, returns every day of
+    # the range and for each station its riders on each day, None without data
+    #
+    def daily_matrix(self, station_ids, start, end):
+        days = dates.days_of(start, end)
+        if not days:
+            return days, [[] for station_id in station_ids]
+        first = epoch_day(start)
+
+        columns = {}
+        for station_id in station_ids:
+            if station_id in columns:
+                continue
+            rows = self.station_rows([station_id])
+            offsets = self.day[rows] - first
+            keep = (offsets >= 0) & (offsets < len(days))
+            sums = np.bincount(offsets[keep], weights=self.riders[rows][keep], minlength=len(days))
+            counts = np.bincount(offsets[keep], minlength=len(days))
+            columns[station_id] = [int(total) if count else None for total, count in zip(sums.tolist(), counts.tolist())]
+
+        return days, [columns[station_id] for station_id in station_ids]
+
+    ##################################################################
+    #
+    # network_matrix
+    #
+    # Given a half-open range of days, returns the stations with data in it
+    # (sorted ids), and station x day matrices of their riders (NaN without
+    # data) and type of day codes (OTHER without data)
+    #
+    def network_matrix(self, start, end):
+        first, last = epoch_day(start), epoch_day(end)
+        rows = np.flatnonzero((self.day >= first) & (self.day < last))
+
+        station_ids, station_index = np.unique(self.station[rows], return_inverse=True)
+        cells = station_index * (last - first) + (self.day[rows] - first)
+        shape = (len(station_ids), last - first)
+
+        # a station can have more than one row a day, they are added up
+        sums = np.bincount(cells, weights=self.riders[rows], minlength=shape[0] * shape[1])
+        counts = np.bincount(cells, minlength=shape[0] * shape[1])
+        riders = np.where(counts > 0, sums, np.nan).reshape(shape)
+
+        day_types = np.full(shape[0] * shape[1], OTHER, np.uint8)
+        day_types[cells] = self.day_type[rows]
+        return station_ids, riders, day_types.reshape(shape)
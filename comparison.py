@@ -0,0 +1,103 @@
+# Overview: Daily ridership of any number of stations side by side
+# Stations are picked by name, wildcard pattern or line, and their daily totals over a
+# date range are read with one grouped query and streamed into a matrix with a column per
+# station and a row per calendar day. Days a station has no data for are filled with None,
+# so the stations stay aligned by date (and plots show a gap) instead of sliding together
+
+import json
+
+import dates
+import stats
+import engines
+import resolver
+import partitions
+
+# SQL queries as global constants so that they are not changed
+# the station ids are passed as one JSON array, so any number of stations use the same statement
+query_compare = "SELECT strftime('%Y-%m-%d', Ride_Date) AS Date, Station_ID, SUM(Num_Riders) FROM Ridership WHERE Station_ID IN (SELECT value FROM json_each(?)) AND Ride_Date >= ? AND Ride_Date < ? GROUP BY Date, Station_ID ORDER BY Date;"
+query_line_stations = "SELECT DISTINCT Stations.Station_ID, Stations.Station_Name FROM Stations JOIN Stops ON Stops.Station_ID = Stations.Station_ID JOIN StopDetails ON StopDetails.Stop_ID = Stops.Stop_ID JOIN Lines ON Lines.Line_ID = StopDetails.Line_ID WHERE LOWER(Lines.Color) = ? ORDER BY Stations.Station_Name ASC, Stations.Station_ID ASC;"
+
+# a station list entry starting with this picks every station on a line, e.g. line:Red
+LINE_PREFIX = "line:"
+
+# rows read from the comparison query at a time
+FETCH_ROWS = 5000
+
+##################################################################
+#
+# select_stations
+#
+# Given a connection and a list of station names, wildcard patterns and
+# line:color entries, returns the (station id, station name) they pick in
+# the order given without repeats, and the entries that matched nothing
+#
+def select_stations(dbConn, entries):
+    stations = {}
+    unmatched = []
+
+    for entry in entries:
+        entry = entry.strip()
+        if not entry:
+            continue
+
+        if entry.lower().startswith(LINE_PREFIX):
+            dbCursor = dbConn.cursor()
+            dbCursor.execute(query_line_stations, (entry[len(LINE_PREFIX):].strip().lower(),))
+            result = dbCursor.fetchall()
+        else:
+            result = resolver.get_resolver(dbConn).lookup(entry)
+
+        if not result:
+            unmatched.append(entry)
+        for row in result:
+            stations.setdefault(row[0], row[1])
+
+    return list(stations.items()), unmatched
+
+##################################################################
+#
+# date_span
+#
+# Given a connection and the first and last day to compare ('YYYY-MM-DD',
+# blank for the first or last day with data), returns the half-open range
+# of days, empty when the dates are not valid
+#
+def date_span(dbConn, first="", last=""):
+    first = str(first).strip()
+    last = str(last).strip()
+    if not first or not last:
+        earliest, latest = stats.load_stats(dbConn)[3:5]
+        first = first or earliest
+        last = last or latest
+    return dates.day_range(first, last)
+
+##################################################################
+#
+# daily_matrix
+#
+# Given a connection, station ids and a half-open range of days, returns
+# (days, columns): every day of the range, and for each station id its
+# riders on each of those days, None where it has no data
+#
+def daily_matrix(dbConn, station_ids, start, end):
+    # columnar engine
+    if engines.use_numpy():
+        return engines.snapshot(dbConn).daily_matrix(station_ids, start, end)
+
+    days = dates.days_of(start, end)
+    position = {day: index for index, day in enumerate(days)}
+    columns = {station_id: [None] * len(days) for station_id in station_ids}
+    if not days or not columns:
+        return days, [columns[station_id] for station_id in station_ids]
+
+    # one query for every station (per partition of the range), streamed into place
+    for sql, piece_start, piece_end in partitions.segments(dbConn, query_compare, start, end):
+        dbCursor = dbConn.cursor()
+        dbCursor.execute(sql, (json.dumps(list(columns)), piece_start, piece_end))
+        rows = dbCursor.fetchmany(FETCH_ROWS)
+        while rows:
+            for day, station_id, riders in rows:
+                columns[station_id][position[day]] = riders
+            rows = dbCursor.fetchmany(FETCH_ROWS)
+
+    return days, [columns[station_id] for station_id in station_ids]
@@ -0,0 +1,75 @@
+# Overview: Turns the year and month filters the commands take into half-open
+# Ride_Date ranges, so queries compare the raw column and SQLite can use an index
+# on it instead of evaluating strftime on every row
+
+import datetime
+
+##################################################################
+#
+# year_range
+#
+# Given a year as entered by the user, returns the half-open range
+# ('YYYY-01-01', 'YYYY+1-01-01') to compare Ride_Date against
+# Anything that is not a year gives an empty range, matching no rows
+#
+def year_range(year):
+    year = str(year).strip()
+
+    # not a four digit year, nothing can match
+    if len(year) != 4 or not year.isdigit():
+        return ("", "")
+
+    return ("%04d-01-01" % int(year), "%04d-01-01" % (int(year) + 1))
+
+##################################################################
+#
+# month_range
+#
+# Given a year and a month, returns the half-open range
+# ('YYYY-MM-01', first day of the next month) to compare Ride_Date against
+# Anything that is not a valid year and month gives an empty range
+#
+def month_range(year, month):
+    year = str(year).strip()
+    month = str(month).strip()
+
+    # not a four digit year or a month from 1 to 12, nothing can match
+    if len(year) != 4 or not year.isdigit() or not month.isdigit() or not 1 <= int(month) <= 12:
+        return ("", "")
+
+    if int(month) == 12:
+        return ("%04d-12-01" % int(year), "%04d-01-01" % (int(year) + 1))
+    return ("%04d-%02d-01" % (int(year), int(month)), "%04d-%02d-01" % (int(year), int(month) + 1))
+
+##################################################################
+#
+# day_range
+#
+# Given a first and last day 'YYYY-MM-DD' (both included), returns the
+# half-open range (first day, the day after the last) to compare Ride_Date
+# against. Anything that is not a valid date, or a last day before the
+# first, gives an empty range
+#
+def day_range(first, last):
+    try:
+        first = datetime.date.fromisoformat(str(first).strip()[0:10])
+        last = datetime.date.fromisoformat(str(last).strip()[0:10])
+    except ValueError:
+        return ("", "")
+
+    if last < first:
+        return ("", "")
+    return (first.isoformat(), (last + datetime.timedelta(days=1)).isoformat())
+
+##################################################################
+#
+# days_of
+#
+# Given a half-open range of 'YYYY-MM-DD' days, returns every day in it
+#
+def days_of(start, end):
+    if not start:
+        return []
+    first = datetime.date.fromisoformat(start)
+    count = (datetime.date.fromisoformat(end) - first).days
+    return [(first + datetime.timedelta(days=offset)).isoformat() for offset in range(count)]
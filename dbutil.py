@@ -0,0 +1,18 @@
+# Overview: Small helpers shared by the modules that keep per-database state in memory
+
+##################################################################
+#
+# database_key
+#
+# Given a connection to the CTA database, returns a key naming the main
+# database file, so data loaded once can be shared by every connection to
+# the same file
+# In-memory databases have no file and are keyed by the connection itself
+#
+def database_key(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("PRAGMA database_list;")
+    for row in dbCursor.fetchall():
+        if row[1] == "main" and row[2]:
+            return row[2]
+    return id(dbConn)
@@ -0,0 +1,64 @@
+# Overview: Chooses the backend the ridership aggregations run on
+# "sqlite" runs the SQL queries in main.py, "numpy" runs the vectorized group-bys in
+# columnar.py over a memory-mapped snapshot of Ridership. NumPy is only imported when
+# the numpy engine is used
+
+import os
+import threading
+
+import dbutil
+
+# backends that can be chosen
+names = ["sqlite", "numpy"]
+
+# backend in use
+current = "sqlite"
+
+# one snapshot per database file, refreshed by one thread at a time
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+##################################################################
+#
+# set_engine
+#
+# Switches every command to the named backend
+#
+def set_engine(name):
+    global current
+    if name not in names:
+        raise ValueError("unknown engine %s" % name)
+    current = name
+
+##################################################################
+#
+# use_numpy
+#
+# Returns True if the numpy engine is in use
+#
+def use_numpy():
+    return current == "numpy"
+
+##################################################################
+#
+# snapshot
+#
+# Given a connection to the CTA database, returns its columnar snapshot,
+# brought up to date with the database
+# The snapshot is stored next to the database file as <file>.columns,
+# or kept in memory when that cannot be written
+#
+def snapshot(dbConn):
+    import columnar
+
+    key = dbutil.database_key(dbConn)
+    with _snapshots_lock:
+        if key not in _snapshots:
+            path = key + ".columns" if isinstance(key, str) else None
+            if path and not os.access(os.path.dirname(path) or ".", os.W_OK):
+                path = None
+            _snapshots[key] = columnar.ColumnSnapshot(path)
+        # a refresh returns a new snapshot, the old one stays readable for the
+        # threads still using it
+        _snapshots[key] = _snapshots[key].refresh(dbConn)
+        return _snapshots[key]
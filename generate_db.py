@@ -0,0 +1,238 @@
+# Overview: Builds a synthetic CTA database with the same schema as CTA2_L_daily_ridership.db
+# Stations, Stops, StopDetails, Lines and daily Ridership are generated from a seed, so
+# the commands and the benchmark suite can run at any scale without the real data.
+# Ridership follows the real patterns closely enough to be useful: weekday/saturday/
+# sunday-holiday levels, seasonality, a yearly trend, noise and a few missing days
+#
+# Usage: python generate_db.py --out synthetic.db --stations 150 --years 20
+#
+# Rows in Ridership are stations x days, e.g. 150 stations x 20 years is about 1.1M rows
+# and 5,000 stations x 55 years about 100M
+
+import os
+import math
+import random
+import sqlite3
+import argparse
+import datetime
+
+# schema of the tables the app reads
+schema = """
+CREATE TABLE Stations (
+    Station_ID INTEGER PRIMARY KEY,
+    Station_Name TEXT NOT NULL
+);
+
+CREATE TABLE Lines (
+    Line_ID INTEGER PRIMARY KEY,
+    Color TEXT NOT NULL
+);
+
+CREATE TABLE Stops (
+    Stop_ID INTEGER PRIMARY KEY,
+    Station_ID INTEGER NOT NULL,
+    Stop_Name TEXT NOT NULL,
+    Direction TEXT NOT NULL,
+    ADA INTEGER NOT NULL,
+    Latitude REAL NOT NULL,
+    Longitude REAL NOT NULL
+);
+
+CREATE TABLE StopDetails (
+    Stop_ID INTEGER NOT NULL,
+    Line_ID INTEGER NOT NULL
+);
+
+CREATE TABLE Ridership (
+    Station_ID INTEGER NOT NULL,
+    Ride_Date TEXT NOT NULL,
+    Type_Of_Day TEXT NOT NULL,
+    Num_Riders INTEGER NOT NULL
+);
+"""
+
+# line colors, in Line_ID order
+colors = ["Red", "Blue", "Green", "Brown", "Purple", "Yellow", "Pink", "Orange"]
+
+# pieces station names are made from
+streets = ["Clark", "Lake", "State", "Jackson", "Belmont", "Fullerton", "Howard", "Addison", "Damen", "Western",
+           "Harlem", "Cicero", "Pulaski", "Kedzie", "Ashland", "Halsted", "Racine", "Division", "Chicago", "Grand",
+           "Madison", "Roosevelt", "Cermak", "Garfield", "Irving Park", "Montrose", "Lawrence", "Argyle", "Wilson",
+           "Sheridan", "Diversey", "Wellington", "Armitage", "Sedgwick", "Monroe", "Adams", "Randolph", "Washington"]
+
+# every DUPLICATE_EVERY-th station reuses an earlier name, like Western on several lines
+DUPLICATE_EVERY = 25
+
+# rows per executemany call
+CHUNK_ROWS = 50000
+
+##################################################################
+#
+# station_names
+#
+# Returns count station names, unique except for the deliberate duplicates
+#
+def station_names(count, rng):
+    names = []
+    seen = set()
+    for i in range(count):
+        if i and i % DUPLICATE_EVERY == 0:
+            names.append(names[rng.randrange(len(names))])
+            continue
+
+        # street, then street/street, then numbered
+        name = streets[i % len(streets)]
+        if i >= len(streets):
+            name = "%s/%s" % (streets[i % len(streets)], streets[(i // len(streets)) % len(streets)])
+        if name in seen:
+            name = "%s %d" % (name, i)
+        seen.add(name)
+        names.append(name)
+
+    return names
+
+##################################################################
+#
+# day_type
+#
+# Given a date, returns W for weekdays, A for saturdays and U for sundays
+# and the holidays the CTA runs a sunday schedule on
+#
+def day_type(day):
+    month_day = (day.month, day.day)
+
+    # fixed holidays
+    if month_day in [(1, 1), (7, 4), (12, 25)]:
+        return "U"
+    # memorial day, last monday of may
+    if day.month == 5 and day.weekday() == 0 and day.day > 24:
+        return "U"
+    # labor day, first monday of september
+    if day.month == 9 and day.weekday() == 0 and day.day <= 7:
+        return "U"
+    # thanksgiving, fourth thursday of november
+    if day.month == 11 and day.weekday() == 3 and 21 < day.day <= 28:
+        return "U"
+
+    if day.weekday() == 5:
+        return "A"
+    if day.weekday() == 6:
+        return "U"
+    return "W"
+
+##################################################################
+#
+# ridership_rows
+#
+# Yields (station id, ride date, type of day, riders) for every station and
+# day, leaving out a fraction of days as missing data
+#
+def ridership_rows(station_ids, start, days, missing, rng):
+    # each station gets its own level and trend
+    levels = {station_id: rng.lognormvariate(7.5, 0.8) for station_id in station_ids}
+    trends = {station_id: rng.uniform(-0.03, 0.04) for station_id in station_ids}
+    factors = {"W": 1.0, "A": 0.55, "U": 0.4}
+
+    for offset in range(days):
+        day = start + datetime.timedelta(days=offset)
+        kind = day_type(day)
+        ride_date = day.isoformat() + " 00:00:00.000"
+        season = 1.0 + 0.12 * math.sin(2 * math.pi * (day.timetuple().tm_yday - 100) / 365.25)
+        years = offset / 365.25
+
+        for station_id in station_ids:
+            if rng.random() < missing:
+                continue
+            riders = levels[station_id] * factors[kind] * season * (1 + trends[station_id]) ** years
+            yield (station_id, ride_date, kind, max(0, int(rng.gauss(riders, riders * 0.08))))
+
+##################################################################
+#
+# chunks
+#
+# Yields lists of up to size items from rows
+#
+def chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+##################################################################
+#
+# generate
+#
+# Writes a synthetic CTA database to path, replacing any file there
+# Returns the number of Ridership rows written
+#
+def generate(path, stations=150, years=20, start_year=2001, seed=341, missing=0.002, progress=None):
+    if os.path.exists(path):
+        os.remove(path)
+
+    rng = random.Random(seed)
+    dbConn = sqlite3.connect(path)
+
+    # nothing to recover if the generator is interrupted, skip the journal
+    dbConn.execute("PRAGMA journal_mode = OFF;")
+    dbConn.execute("PRAGMA synchronous = OFF;")
+    dbConn.executescript(schema)
+
+    # stations spread over the city, 1 or 2 stops each (one per direction)
+    station_ids = [40000 + 10 * i for i in range(stations)]
+    dbConn.executemany("INSERT INTO Stations VALUES (?, ?);", zip(station_ids, station_names(stations, rng)))
+    dbConn.executemany("INSERT INTO Lines VALUES (?, ?);", [(i + 1, color) for i, color in enumerate(colors)])
+
+    stop_id = 30000
+    for station_id, name in dbConn.execute("SELECT Station_ID, Station_Name FROM Stations;").fetchall():
+        lat = round(rng.uniform(41.72, 42.07), 6)
+        long = round(rng.uniform(-87.91, -87.60), 6)
+        lines = rng.sample(range(1, len(colors) + 1), rng.choice([1, 1, 1, 2, 3]))
+        directions = rng.choice([["N", "S"], ["E", "W"], ["N", "S"], ["W"]])
+        ada = rng.random() < 0.7
+
+        for direction in directions:
+            dbConn.execute("INSERT INTO Stops VALUES (?, ?, ?, ?, ?, ?, ?);",
+                           (stop_id, station_id, "%s (%s)" % (name, direction), direction, int(ada), lat, long))
+            dbConn.executemany("INSERT INTO StopDetails VALUES (?, ?);", [(stop_id, line) for line in lines])
+            stop_id += 1
+    dbConn.commit()
+
+    # daily ridership in chunks, one transaction for the whole table
+    start = datetime.date(start_year, 1, 1)
+    days = (datetime.date(start_year + years, 1, 1) - start).days
+    written = 0
+    for chunk in chunks(ridership_rows(station_ids, start, days, missing, rng), CHUNK_ROWS):
+        dbConn.executemany("INSERT INTO Ridership VALUES (?, ?, ?, ?);", chunk)
+        written += len(chunk)
+        if progress:
+            progress(written, stations * days)
+    dbConn.commit()
+    dbConn.close()
+
+    return written
+
+##################################################################
+#
+# main
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a synthetic CTA database")
+    parser.add_argument("--out", default="synthetic_cta.db", help="database file to write")
+    parser.add_argument("--stations", type=int, default=150, help="number of stations")
+    parser.add_argument("--years", type=int, default=20, help="years of daily ridership")
+    parser.add_argument("--start-year", type=int, default=2001, help="first year of ridership")
+    parser.add_argument("--seed", type=int, default=341, help="random seed, the same seed gives the same database")
+    parser.add_argument("--missing", type=float, default=0.002, help="fraction of station days left out")
+    args = parser.parse_args()
+
+    def report(done, total):
+        print("\r  %s / ~%s ridership rows" % (f"{done:,}", f"{total:,}"), end="", flush=True)
+
+    print("Generating %s" % args.out)
+    rows = generate(args.out, args.stations, args.years, args.start_year, args.seed, args.missing, report)
+    print()
+    print("Done, %s ridership rows" % f"{rows:,}")
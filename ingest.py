@@ -0,0 +1,429 @@
+# Overview: Bulk ingest of the public CTA CSV feeds into the CTA database
+# The daily ridership feed (station_id, stationname, date, daytype, rides) is streamed in
+# chunks, each chunk written with executemany in a single transaction. Rows are upserted
+# by station and date, so loading a file twice changes nothing and a new month can be
+# appended by loading the latest feed. Loading into an empty Ridership table (or with
+# --rebuild) drops its indexes and triggers first and rebuilds them, the rollups and the
+# stats once at the end, instead of updating them for every row; a station's day the feed
+# repeats keeps its last row, as the upserts do. The stops feed (the "L" stops list)
+# upserts Stations, Stops, Lines and StopDetails.
+# During a load synchronous is OFF and the journal is a write-ahead log, both put back
+# afterwards, so an OS crash or power loss can damage the file;
+# the database should be backed up before a full rebuild
+#
+# Usage: python ingest.py --db CTA2_L_daily_ridership.db [--stops stops.csv] [--ridership daily.csv] [--rebuild]
+
+import csv
+import time
+import sqlite3
+import argparse
+import datetime
+
+import stats
+import migrate
+import rollups
+import spatial
+import resolver
+import topology
+
+# SQL queries as global constants so that they are not changed
+# ?1 station id, ?2 ride date, ?3 type of day, ?4 riders; the update only touches rows that differ
+query_ride_update = "UPDATE Ridership SET Type_Of_Day = ?3, Num_Riders = ?4 WHERE Station_ID = ?1 AND Ride_Date = ?2 AND (Type_Of_Day IS NOT ?3 OR Num_Riders IS NOT ?4);"
+query_ride_insert = "INSERT INTO Ridership (Station_ID, Ride_Date, Type_Of_Day, Num_Riders) SELECT ?1, ?2, ?3, ?4 WHERE NOT EXISTS (SELECT 1 FROM Ridership WHERE Station_ID = ?1 AND Ride_Date = ?2);"
+query_ride_insert_new = "INSERT INTO Ridership (Station_ID, Ride_Date, Type_Of_Day, Num_Riders) VALUES (?, ?, ?, ?);"
+query_ride_sample = "SELECT Ride_Date FROM Ridership LIMIT 1;"
+query_ride_empty = "SELECT NOT EXISTS (SELECT 1 FROM Ridership);"
+query_ride_dedupe = """
+DELETE FROM Ridership WHERE rowid IN (
+    SELECT Ridership.rowid FROM Ridership
+    JOIN (SELECT Station_ID, Ride_Date, MAX(rowid) AS Last_Row FROM Ridership GROUP BY Station_ID, Ride_Date HAVING count(*) > 1) AS Repeated
+    ON Ridership.Station_ID = Repeated.Station_ID AND Ridership.Ride_Date = Repeated.Ride_Date AND Ridership.rowid < Repeated.Last_Row
+);
+"""
+query_station_update = "UPDATE Stations SET Station_Name = ?2 WHERE Station_ID = ?1 AND Station_Name IS NOT ?2;"
+query_station_insert = "INSERT INTO Stations (Station_ID, Station_Name) SELECT ?1, ?2 WHERE NOT EXISTS (SELECT 1 FROM Stations WHERE Station_ID = ?1);"
+query_stop_update = "UPDATE Stops SET Station_ID = ?2, Stop_Name = ?3, Direction = ?4, ADA = ?5, Latitude = ?6, Longitude = ?7 WHERE Stop_ID = ?1;"
+query_stop_insert = "INSERT INTO Stops (Stop_ID, Station_ID, Stop_Name, Direction, ADA, Latitude, Longitude) SELECT ?1, ?2, ?3, ?4, ?5, ?6, ?7 WHERE NOT EXISTS (SELECT 1 FROM Stops WHERE Stop_ID = ?1);"
+query_stop_lines_clear = "DELETE FROM StopDetails WHERE Stop_ID = ?;"
+query_stop_lines_add = "INSERT INTO StopDetails (Stop_ID, Line_ID) VALUES (?, ?);"
+query_line_lookup = "SELECT Line_ID FROM Lines WHERE LOWER(Color) = LOWER(?);"
+query_line_insert = "INSERT INTO Lines (Color) VALUES (?);"
+query_deferrable = "SELECT type, name, sql FROM sqlite_master WHERE tbl_name = 'Ridership' AND type IN ('index', 'trigger') AND sql IS NOT NULL;"
+query_deferred = "SELECT Name, Sql FROM Ingest_Deferred;"
+query_defer = "INSERT OR REPLACE INTO Ingest_Deferred (Name, Sql) VALUES (?, ?);"
+query_note_changes = "UPDATE Ridership_Changes SET Changes = Changes + 1 WHERE Id = 1;"
+query_run_record = "INSERT INTO Ingest_Runs (Finished, Source, Rows_Inserted, Rows_Updated) VALUES (?, ?, ?, ?);"
+
+# rows written per transaction
+CHUNK_ROWS = 50000
+
+# line columns of the stops feed -> Lines.Color
+line_columns = {"red": "Red", "blue": "Blue", "g": "Green", "brn": "Brown", "p": "Purple",
+                "pexp": "Purple", "y": "Yellow", "pnk": "Pink", "o": "Orange"}
+
+# time of day the database's Ride_Date values carry after the date, when it has none yet
+DEFAULT_TIME = " 00:00:00.000"
+
+##################################################################
+#
+# IngestError
+#
+# A feed that cannot be loaded, with the line of the file that is wrong
+#
+class IngestError(Exception):
+    pass
+
+##################################################################
+#
+# feed_columns
+#
+# Given a csv reader at the start of a file, reads the header and returns
+# the position of each column by its lowercased name
+#
+def feed_columns(reader, required):
+    header = next(reader, [])
+    columns = {name.strip().lower(): position for position, name in enumerate(header)}
+
+    missing = [name for name in required if name not in columns]
+    if missing:
+        raise IngestError("missing columns %s" % ", ".join(missing))
+    return columns
+
+##################################################################
+#
+# ride_date
+#
+# Given a feed date (MM/DD/YYYY or YYYY-MM-DD) and the time the database's
+# dates carry, returns it as stored in Ride_Date
+#
+def ride_date(text, time_part):
+    text = text.strip()
+    if "/" in text:
+        month, day, year = text.split("/")
+        return "%04d-%02d-%02d%s" % (int(year), int(month), int(day), time_part)
+    return datetime.date.fromisoformat(text[0:10]).isoformat() + time_part
+
+##################################################################
+#
+# ridership_rows
+#
+# Given the lines of the daily ridership feed and the time part of Ride_Date,
+# yields (station id, ride date, type of day, riders) and records each
+# station's name in names. Dates in a sealed (partitioned) year are refused
+#
+def ridership_rows(lines, time_part, names, sealed=()):
+    reader = csv.reader(lines)
+    columns = feed_columns(reader, ["station_id", "date", "daytype", "rides"])
+    station_column, date_column, type_column, rides_column = (columns[name] for name in ["station_id", "date", "daytype", "rides"])
+    name_column = columns.get("stationname")
+
+    # every station repeats the same dates, each one is converted once
+    converted = {}
+
+    for row in reader:
+        try:
+            station_id = int(row[station_column])
+            if station_id not in names and name_column is not None:
+                names[station_id] = row[name_column].strip()
+
+            day = converted.get(row[date_column])
+            if day is None:
+                day = converted[row[date_column]] = ride_date(row[date_column], time_part)
+                if day[0:4] in sealed:
+                    raise IngestError("line %d: %s is rolled into a partition, unroll it first to load it" % (reader.line_num, day[0:4]))
+
+            yield (station_id, day, row[type_column].strip().upper(), int(row[rides_column].replace(",", "")))
+        except (ValueError, IndexError) as error:
+            raise IngestError("line %d: %s" % (reader.line_num, error))
+
+##################################################################
+#
+# stop_rows
+#
+# Given the lines of the stops feed, yields (stop id, station id, stop name,
+# direction, ADA, latitude, longitude, station name, colors of its lines)
+#
+def stop_rows(lines):
+    reader = csv.reader(lines)
+    columns = feed_columns(reader, ["stop_id", "direction_id", "stop_name", "station_name", "map_id", "ada", "location"])
+    line_positions = [(columns[column], color) for column, color in line_columns.items() if column in columns]
+
+    for row in reader:
+        try:
+            field = lambda name: row[columns[name]].strip()
+            lat, long = field("location").strip("()").split(",")
+            colors = sorted(set(color for position, color in line_positions if row[position].strip().lower() in ("true", "1", "y")))
+            yield (int(field("stop_id")), int(field("map_id")), field("stop_name"), field("direction_id").upper(),
+                   int(field("ada").lower() in ("true", "1", "y")), float(lat), float(long), field("station_name"), colors)
+        except (ValueError, IndexError) as error:
+            raise IngestError("line %d: %s" % (reader.line_num, error))
+
+##################################################################
+#
+# chunks
+#
+# Yields lists of up to size items from rows
+#
+def chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+##################################################################
+#
+# load_pragmas
+#
+# Given a connection, switches it to the settings used during a load and
+# returns the settings to put back afterwards
+#
+def load_pragmas(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("PRAGMA synchronous;")
+    previous = {"synchronous": dbCursor.fetchone()[0]}
+    dbCursor.execute("PRAGMA cache_size;")
+    previous["cache_size"] = dbCursor.fetchone()[0]
+    dbCursor.execute("PRAGMA temp_store;")
+    previous["temp_store"] = dbCursor.fetchone()[0]
+    dbCursor.execute("PRAGMA journal_mode;")
+    previous["journal_mode"] = dbCursor.fetchone()[0]
+
+    # no fsync per transaction, a large page cache and temporary b-trees in memory
+    dbCursor.execute("PRAGMA synchronous = OFF;")
+    dbCursor.execute("PRAGMA cache_size = -262144;")
+    dbCursor.execute("PRAGMA temp_store = MEMORY;")
+
+    # changed pages are appended to a write-ahead log instead of being copied to a
+    # rollback journal first, a failed chunk still rolls back
+    dbCursor.execute("PRAGMA journal_mode = WAL;")
+    return previous
+
+##################################################################
+#
+# restore_pragmas
+#
+# Puts back the settings load_pragmas returned
+#
+def restore_pragmas(dbConn, previous):
+    for name, value in previous.items():
+        dbConn.execute("PRAGMA %s = %s;" % (name, value))
+
+##################################################################
+#
+# defer_ridership
+#
+# Given a connection, drops the indexes and triggers of Ridership, recording
+# them in Ingest_Deferred so restore_ridership (or the next ingest, if this
+# one is interrupted) can put them back
+#
+def defer_ridership(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("BEGIN;")
+    dbCursor.execute(query_deferrable)
+    for kind, name, sql in dbCursor.fetchall():
+        dbCursor.execute(query_defer, (name, sql))
+        dbCursor.execute('DROP %s "%s";' % (kind.upper(), name))
+    dbConn.commit()
+
+##################################################################
+#
+# restore_ridership
+#
+# Given a connection, rebuilds the indexes defer_ridership dropped, removes
+# the rows the load repeated and rebuilds the triggers, then the rollups,
+# the stats, the change counts (columnar.py) and the planner statistics the
+# triggers did not keep up. Returns False if nothing was deferred
+#
+def restore_ridership(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute(query_deferred)
+    deferred = dbCursor.fetchall()
+    if not deferred:
+        return False
+
+    # indexes before triggers, the station and date index finds the repeated rows
+    triggers = [sql for name, sql in deferred if sql.lstrip().upper().startswith("CREATE TRIGGER")]
+    dbCursor.execute("BEGIN;")
+    for name, sql in deferred:
+        if sql not in triggers:
+            dbCursor.execute(sql)
+
+    # a feed repeating a station's day keeps its last row, as the upserts do
+    dbCursor.execute(query_ride_dedupe)
+    for sql in triggers:
+        dbCursor.execute(sql)
+    dbCursor.execute("DELETE FROM Ingest_Deferred;")
+    try:
+        # the load was not counted, a columnar snapshot has to be exported again
+        dbCursor.execute(query_note_changes)
+    except sqlite3.OperationalError:
+        # no snapshot has counted changes on this database
+        pass
+    dbConn.commit()
+
+    rollups.refresh_rollups(dbConn, rebuild=True)
+    stats.refresh_stats(dbConn)
+    dbConn.execute("ANALYZE;")
+    return True
+
+##################################################################
+#
+# ingest_ridership
+#
+# Given a connection and the lines of the daily ridership feed, upserts
+# every row, chunk by chunk. Returns (rows inserted, rows updated)
+# rebuild=True replaces all of Ridership with the feed
+#
+def ingest_ridership(dbConn, lines, rebuild=False, progress=None):
+    dbCursor = dbConn.cursor()
+
+    # keep the time part the database's dates already have
+    dbCursor.execute(query_ride_sample)
+    sample = dbCursor.fetchone()
+    time_part = sample[0][10:] if sample else DEFAULT_TIME
+
+    # an empty table is loaded without indexes and triggers
+    dbCursor.execute(query_ride_empty)
+    empty = dbCursor.fetchone()[0]
+    bulk = rebuild or empty
+    if bulk:
+        defer_ridership(dbConn)
+        if rebuild:
+            with dbConn:
+                dbCursor.execute("DELETE FROM Ridership;")
+
+    names = {}
+    inserted = 0
+    updated = 0
+    sealed = rollups.sealed_years(dbConn)
+    for chunk in chunks(ridership_rows(lines, time_part, names, sealed), CHUNK_ROWS):
+        with dbConn:
+            if bulk:
+                dbCursor.executemany(query_ride_insert_new, chunk)
+                inserted += len(chunk)
+            else:
+                dbCursor.executemany(query_ride_update, chunk)
+                updated += dbCursor.rowcount
+                dbCursor.executemany(query_ride_insert, chunk)
+                inserted += dbCursor.rowcount
+        if progress:
+            progress(inserted + updated)
+
+    # stations the stops feed has not brought in yet, by their ridership name
+    with dbConn:
+        dbCursor.executemany(query_station_insert, [(station_id, name) for station_id, name in names.items() if name])
+
+    return inserted, updated
+
+##################################################################
+#
+# ingest_stops
+#
+# Given a connection and the lines of the stops feed, upserts the stations,
+# stops, lines and the lines each stop is on in one transaction
+# Returns the number of stops read
+#
+def ingest_stops(dbConn, lines):
+    rows = list(stop_rows(lines))
+    dbCursor = dbConn.cursor()
+
+    with dbConn:
+        # line ids by color, adding the colors that are new
+        line_ids = {}
+        for color in sorted(set(color for row in rows for color in row[8])):
+            dbCursor.execute(query_line_lookup, (color,))
+            found = dbCursor.fetchone()
+            if found is None:
+                dbCursor.execute(query_line_insert, (color,))
+                found = (dbCursor.lastrowid,)
+            line_ids[color] = found[0]
+
+        stations = {row[1]: row[7] for row in rows}
+        dbCursor.executemany(query_station_update, list(stations.items()))
+        dbCursor.executemany(query_station_insert, list(stations.items()))
+        dbCursor.executemany(query_stop_update, [row[0:7] for row in rows])
+        dbCursor.executemany(query_stop_insert, [row[0:7] for row in rows])
+        dbCursor.executemany(query_stop_lines_clear, [(row[0],) for row in rows])
+        dbCursor.executemany(query_stop_lines_add, [(row[0], line_ids[color]) for row in rows for color in row[8]])
+
+    return len(rows)
+
+##################################################################
+#
+# ingest
+#
+# Given a connection and the paths of the feeds to load (None to skip one),
+# loads them and brings everything derived from the data up to date: the
+# rollups, the stats and the in-memory station caches. Returns
+# (stops read, ridership rows inserted, ridership rows updated)
+#
+def ingest(dbConn, stops_path=None, ridership_path=None, rebuild=False, progress=None):
+    migrate.migrate(dbConn)
+
+    # finish a bulk load that was interrupted before its indexes were rebuilt
+    restore_ridership(dbConn)
+
+    previous = load_pragmas(dbConn)
+    stops = inserted = updated = 0
+    try:
+        if stops_path:
+            with open(stops_path, newline="", encoding="utf-8-sig") as feed:
+                stops = ingest_stops(dbConn, feed)
+
+        if ridership_path:
+            with open(ridership_path, newline="", encoding="utf-8-sig") as feed:
+                inserted, updated = ingest_ridership(dbConn, feed, rebuild, progress)
+    finally:
+        # a failed bulk load keeps its indexes deferred until the next ingest finishes it
+        if dbConn.in_transaction:
+            dbConn.rollback()
+        restore_pragmas(dbConn, previous)
+
+    # derived data, a bulk load rebuilds it all, an append only the changed months
+    if not restore_ridership(dbConn):
+        rollups.refresh_rollups(dbConn)
+        stats.load_stats(dbConn)
+    resolver.forget_resolver(dbConn)
+    spatial.forget_station_index(dbConn)
+    topology.forget_topology(dbConn)
+
+    with dbConn:
+        dbConn.execute(query_run_record, (datetime.datetime.now().isoformat(sep=" ", timespec="seconds"),
+                                          ", ".join(path for path in [stops_path, ridership_path] if path), inserted, updated))
+
+    return stops, inserted, updated
+
+##################################################################
+#
+# main
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load the CTA CSV feeds into the CTA database")
+    parser.add_argument("--db", default="CTA2_L_daily_ridership.db", help="path to the CTA database")
+    parser.add_argument("--stops", metavar="FILE", help="\"L\" stops feed (stop_id, direction_id, stop_name, station_name, map_id, ada, line columns, location)")
+    parser.add_argument("--ridership", metavar="FILE", help="daily ridership feed (station_id, stationname, date, daytype, rides)")
+    parser.add_argument("--rebuild", action="store_true", help="replace all ridership with the feed instead of upserting into it")
+    args = parser.parse_args()
+
+    if not args.stops and not args.ridership:
+        parser.error("nothing to load, give --stops and/or --ridership")
+
+    def report(done):
+        print("\r  %s ridership rows" % f"{done:,}", end="", flush=True)
+
+    dbConn = sqlite3.connect(args.db, uri=True)
+    start = time.perf_counter()
+    try:
+        stops, inserted, updated = ingest(dbConn, args.stops, args.ridership, args.rebuild, report)
+    except (IngestError, OSError) as error:
+        print()
+        print("**Ingest failed: %s" % error)
+        raise SystemExit(1)
+
+    print()
+    print("Loaded %s stops, inserted %s and updated %s ridership rows in %.1f seconds"
+          % (f"{stops:,}", f"{inserted:,}", f"{updated:,}", time.perf_counter() - start))
@@ -0,0 +1,403 @@
+# Overview: Query instrumentation, to tell where the time of a session goes
+# Connections opened with factory=InstrumentedConnection time every statement and count
+# the rows and bytes it returns, capture its EXPLAIN QUERY PLAN the first time it runs
+# and write statements slower than a threshold to a slow-query log.
+# Commands run inside command(), which splits their time into SQL, plotting, waiting
+# for the user's input and the rest (Python formatting), and keeps a latency histogram
+# per command. The figures are printed by the "stats" command or dumped as JSON
+
+import json
+import time
+import sqlite3
+import datetime
+import threading
+import contextlib
+
+# upper bounds of the latency histogram buckets, in milliseconds
+buckets = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+# statements slower than this many milliseconds go to the slow-query log
+slow_ms = 100.0
+
+# file the slow queries are appended to, None to keep no log
+slow_log = None
+
+# sql -> timings, rows, bytes and plan of that statement
+_statements = {}
+
+# command name -> timings and histogram of that command
+_commands = {}
+
+_lock = threading.Lock()
+
+# the phases of the command running on each thread
+_local = threading.local()
+
+##################################################################
+#
+# configure
+#
+# Sets the slow-query threshold in milliseconds and the log file
+#
+def configure(threshold=None, log=None):
+    global slow_ms, slow_log
+    if threshold is not None:
+        slow_ms = float(threshold)
+    slow_log = log
+
+##################################################################
+#
+# value_bytes
+#
+# Returns the size in bytes of a fetched row's values, text and blobs by
+# their length and numbers as 8
+#
+def value_bytes(row):
+    size = 0
+    for value in row:
+        if isinstance(value, (str, bytes)):
+            size += len(value)
+        elif value is not None:
+            size += 8
+    return size
+
+##################################################################
+#
+# query_plan
+#
+# Given a connection, a statement and its parameters, returns the lines of
+# its EXPLAIN QUERY PLAN, or [] for statements that are not queries
+#
+def query_plan(dbConn, sql, parameters):
+    if not sql.lstrip().upper().startswith(("SELECT", "WITH")):
+        return []
+    try:
+        # a plain cursor, so the plan itself is not instrumented
+        dbCursor = sqlite3.Cursor(dbConn)
+        dbCursor.execute("EXPLAIN QUERY PLAN " + sql, parameters)
+        return [row[3] for row in dbCursor.fetchall()]
+    except sqlite3.Error:
+        return []
+
+##################################################################
+#
+# add_phase
+#
+# Adds milliseconds to a phase of the command running on this thread
+#
+def add_phase(name, milliseconds):
+    phases = getattr(_local, "phases", None)
+    if phases is not None:
+        phases[name] = phases.get(name, 0.0) + milliseconds
+
+##################################################################
+#
+# InstrumentedCursor
+#
+# Cursor that times its statements and counts what they return
+# A statement's time is its execute plus every fetch of its rows
+#
+class InstrumentedCursor(sqlite3.Cursor):
+    running = None
+
+    def execute(self, sql, parameters=()):
+        # the plan is captured before the first run, outside its timing
+        with _lock:
+            seen = sql in _statements
+        if not seen:
+            plan = query_plan(self.connection, sql, parameters)
+            with _lock:
+                _statements.setdefault(sql, {"calls": 0, "total_ms": 0.0, "max_ms": 0.0, "rows": 0, "bytes": 0, "plan": plan})
+
+        self.finish()
+        self.running = {"sql": sql, "parameters": parameters, "ms": 0.0, "rows": 0, "bytes": 0}
+        with _lock:
+            _statements[sql]["calls"] += 1
+
+        start = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        finally:
+            self.record(start, [])
+        return self
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self.record(start, [row] if row is not None else [])
+        if row is None:
+            self.finish()
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        start = time.perf_counter()
+        rows = super().fetchmany(size)
+        self.record(start, rows)
+        if len(rows) < size:
+            self.finish()
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self.record(start, rows)
+        self.finish()
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self.record(start, [])
+            self.finish()
+            raise
+        self.record(start, [row])
+        return row
+
+    def close(self):
+        self.finish()
+        super().close()
+
+    def __del__(self):
+        self.finish()
+
+    ##################################################################
+    #
+    # record
+    #
+    # Adds the time since start and the fetched rows to the running statement
+    #
+    def record(self, start, rows):
+        milliseconds = (time.perf_counter() - start) * 1000
+        running = self.running
+        if running is None:
+            return
+        size = sum(value_bytes(row) for row in rows)
+
+        running["ms"] += milliseconds
+        running["rows"] += len(rows)
+        running["bytes"] += size
+        add_phase("sql", milliseconds)
+
+        with _lock:
+            statement = _statements[running["sql"]]
+            statement["total_ms"] += milliseconds
+            statement["max_ms"] = max(statement["max_ms"], running["ms"])
+            statement["rows"] += len(rows)
+            statement["bytes"] += size
+
+    ##################################################################
+    #
+    # finish
+    #
+    # Ends the running statement, when its rows ran out, the cursor runs
+    # another one or goes away, and logs it if it took longer than slow_ms
+    # (a statement whose rows were not all fetched is logged with those that were)
+    #
+    def finish(self):
+        running = self.running
+        self.running = None
+        if running is None or not slow_log or running["ms"] < slow_ms:
+            return
+        with _lock:
+            plan = _statements[running["sql"]]["plan"]
+        log_slow(running, plan)
+
+##################################################################
+#
+# InstrumentedConnection
+#
+# Connection whose cursors are InstrumentedCursors, for sqlite3.connect(factory=...)
+#
+class InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # Connection.execute does not go through cursor()
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+##################################################################
+#
+# log_slow
+#
+# Appends a slow statement, with the rows fetched by then and its plan,
+# to the slow-query log
+#
+def log_slow(running, plan):
+    lines = ["%s %.1f ms, %d rows, %d bytes: %s %r" % (datetime.datetime.now().isoformat(sep=" ", timespec="seconds"),
+             running["ms"], running["rows"], running["bytes"], " ".join(running["sql"].split()), tuple(running["parameters"]))]
+    lines += ["    plan: %s" % detail for detail in plan]
+    with _lock:
+        with open(slow_log, "a") as log_file:
+            log_file.write("\n".join(lines) + "\n")
+
+##################################################################
+#
+# phase
+#
+# Context manager timing a phase ("plot", "input", ...) of the command
+# running on this thread
+#
+@contextlib.contextmanager
+def phase(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_phase(name, (time.perf_counter() - start) * 1000)
+
+##################################################################
+#
+# current_phases
+#
+# Returns the phases of the command running on this thread, None outside
+# a command, to hand to another thread working for it
+#
+def current_phases():
+    return getattr(_local, "phases", None)
+
+##################################################################
+#
+# working_for
+#
+# Context manager counting the phases of this thread towards another
+# thread's command, given its current_phases(), while that thread waits
+#
+@contextlib.contextmanager
+def working_for(phases):
+    outer = getattr(_local, "phases", None)
+    _local.phases = phases
+    try:
+        yield
+    finally:
+        _local.phases = outer
+
+##################################################################
+#
+# timed
+#
+# Decorator timing every call of a function as the named phase
+#
+def timed(name):
+    def decorate(function):
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return function(*args, **kwargs)
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        return wrapper
+    return decorate
+
+##################################################################
+#
+# command
+#
+# Context manager timing one run of a command and adding it to the
+# command's figures. Its latency is the time not spent waiting for input
+#
+@contextlib.contextmanager
+def command(name):
+    outer = getattr(_local, "phases", None)
+    phases = _local.phases = {}
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        wall = (time.perf_counter() - start) * 1000
+        _local.phases = outer
+        record_command(name, wall, phases)
+
+##################################################################
+#
+# record_command
+#
+# Adds one run of a command, its wall time and phases in milliseconds,
+# to the command's figures
+#
+def record_command(name, wall, phases):
+    latency = wall - phases.get("input", 0.0)
+    phases = dict(phases, python=max(0.0, wall - sum(phases.values())))
+
+    with _lock:
+        figures = _commands.setdefault(name, {"runs": 0, "total_ms": 0.0, "max_ms": 0.0, "phases": {}, "histogram": [0] * (len(buckets) + 1)})
+        figures["runs"] += 1
+        figures["total_ms"] += latency
+        figures["max_ms"] = max(figures["max_ms"], latency)
+        for key, milliseconds in phases.items():
+            figures["phases"][key] = figures["phases"].get(key, 0.0) + milliseconds
+        figures["histogram"][sum(1 for bound in buckets if latency > bound)] += 1
+
+##################################################################
+#
+# bucket_labels
+#
+# Returns the names of the histogram buckets, "<=1ms" ... ">5000ms"
+#
+def bucket_labels():
+    return ["<=%dms" % bound for bound in buckets] + [">%dms" % buckets[-1]]
+
+##################################################################
+#
+# report
+#
+# Returns every figure collected so far as a JSON-ready dictionary,
+# statements listed by total time, slowest first
+#
+def report():
+    with _lock:
+        commands = {}
+        for name, figures in _commands.items():
+            commands[name] = {
+                "runs": figures["runs"],
+                "total_ms": round(figures["total_ms"], 3),
+                "mean_ms": round(figures["total_ms"] / figures["runs"], 3),
+                "max_ms": round(figures["max_ms"], 3),
+                "phases_ms": {key: round(value, 3) for key, value in figures["phases"].items()},
+                "histogram": dict(zip(bucket_labels(), figures["histogram"])),
+            }
+        statements = [dict(statement, sql=sql, total_ms=round(statement["total_ms"], 3), max_ms=round(statement["max_ms"], 3))
+                      for sql, statement in _statements.items()]
+
+    statements.sort(key=lambda statement: -statement["total_ms"])
+    return {"commands": commands, "statements": statements}
+
+##################################################################
+#
+# dump
+#
+# Writes the report as JSON to the file at path
+#
+def dump(path):
+    with open(path, "w") as out:
+        json.dump(report(), out, indent=2)
+
+##################################################################
+#
+# print_report
+#
+# Outputs the per-command latencies and where they went, and the
+# statements that took the most time with their plans
+#
+def print_report(top=10):
+    figures = report()
+
+    print("Command Latency (time not spent waiting for input)")
+    if not figures["commands"]:
+        print("  no commands run yet")
+    for name, command in sorted(figures["commands"].items(), key=lambda item: (len(item[0]), item[0])):
+        print("  %s : %d runs, mean %.1f ms, max %.1f ms" % (name, command["runs"], command["mean_ms"], command["max_ms"]))
+        print("    " + ", ".join("%s %.1f ms" % (key, value) for key, value in sorted(command["phases_ms"].items()) if key != "input"))
+        print("    " + " ".join("%s:%d" % (label, count) for label, count in command["histogram"].items() if count))
+    print()
+
+    print("Slowest Statements (total time)")
+    for statement in figures["statements"][:top]:
+        print("  %.1f ms, %d calls, max %.1f ms, %s rows, %s bytes" % (statement["total_ms"], statement["calls"], statement["max_ms"],
+                                                                     f"{statement['rows']:,}", f"{statement['bytes']:,}"))
+        print("    %s" % " ".join(statement["sql"].split()))
+        for detail in statement["plan"]:
+            print("      plan: %s" % detail)
+    print()
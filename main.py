@@ -2,171 +2,495 @@
 # Sami Abushamat
 # 1/31/2024
 
+import sys
+import csv
 import sqlite3
-import matplotlib.pyplot as plt
+import argparse
+import itertools
 import math
 
+import dates
+import stats
+import dbutil
+import rollups
+import spatial
+import partitions
+import resolver
+import topology
+import plotting
+import engines
+import instrument
+import trends
+import background
+import comparison
+import resultcache
+
 # SQL queries as global constants so that they are not changed
 # Also cleans up functions to store all together
-query_one = "SELECT DISTINCT Stations.Station_ID, Stations.Station_Name FROM Stations WHERE Stations.Station_Name LIKE ? ORDER BY Stations.Station_Name ASC;"
-query_two_a = "SELECT SUM(Num_Riders) FROM Stations Join Ridership WHERE Station_Name = ? AND Ridership.Station_ID = Stations.Station_ID AND Ridership.Type_Of_Day = 'W';"
-query_two_b = "SELECT SUM(Num_Riders) FROM Stations Join Ridership WHERE Station_Name = ? AND Ridership.Station_ID = Stations.Station_ID AND Ridership.Type_Of_Day = 'A';"
-query_two_c = "SELECT SUM(Num_Riders) FROM Stations Join Ridership WHERE Station_Name = ? AND Ridership.Station_ID = Stations.Station_ID AND Ridership.Type_Of_Day = 'U';"
-query_two_d = "SELECT SUM(Num_Riders) FROM Stations Join Ridership WHERE Station_Name = ? AND Ridership.Station_ID = Stations.Station_ID;"
+query_two = "SELECT SUM(CASE WHEN Ridership.Type_Of_Day = 'W' THEN Num_Riders ELSE 0 END), SUM(CASE WHEN Ridership.Type_Of_Day = 'A' THEN Num_Riders ELSE 0 END), SUM(CASE WHEN Ridership.Type_Of_Day = 'U' THEN Num_Riders ELSE 0 END), SUM(Num_Riders) FROM Stations JOIN Ridership ON Ridership.Station_ID = Stations.Station_ID WHERE Station_Name = ?;"
 query_three_a = "SELECT Stations.Station_Name, SUM(Ridership.Num_Riders) AS Total_Riders FROM Stations JOIN Ridership ON Stations.Station_ID = Ridership.Station_ID WHERE Ridership.Type_Of_Day = 'W' GROUP BY Stations.Station_Name ORDER BY Total_Riders DESC;"
 query_three_b = "SELECT SUM(Num_Riders) AS Total_Riders FROM Ridership  WHERE Type_Of_Day = 'W';"
-query_four_a = "SELECT Line_ID FROM Lines WHERE LOWER(Color) = ?"
-query_four_b = "SELECT Stops.Stop_Name, Stops.Direction, Stops.ADA FROM Stops JOIN StopDetails ON Stops.Stop_ID = StopDetails.Stop_ID JOIN Lines on StopDetails.Line_ID = Lines.Line_ID WHERE LOWER(Lines.Color) = ? AND LOWER(Stops.Direction) = ? ORDER BY Stops.Stop_Name"
-query_five_a = "SELECT Lines.Color, Stops.Direction, COUNT(*) AS Stops_Count FROM Lines JOIN StopDetails ON Lines.Line_ID = StopDetails.Line_ID JOIN Stops ON StopDetails.Stop_ID = Stops.Stop_ID GROUP BY Lines.Color, Stops.Direction ORDER BY Lines.Color ASC, Stops.Direction ASC;"
-query_five_b = "SELECT COUNT(*) FROM Stops;"
-query_six = "SELECT strftime('%Y',Ride_Date) AS Year, SUM(Num_Riders) AS Total_Riders FROM Stations JOIN Ridership ON Stations.Station_ID = Ridership.Station_ID WHERE Station_Name = ? GROUP BY Year ORDER BY Year;"
-query_seven = "SELECT strftime('%m',Ride_Date) AS Month,strftime('%m/%Y',Ride_Date) AS Date, SUM(Num_Riders) AS Total_Riders FROM Stations JOIN Ridership ON Stations.Station_ID = Ridership.Station_ID WHERE Station_Name = ? AND strftime('%Y', Ride_Date) = ? GROUP BY Month ORDER BY Month;"
-query_eight = "SELECT strftime('%Y-%m-%d',Ride_Date) AS Date, SUM(Num_Riders) AS Daily_Riders FROM Stations JOIN Ridership ON Stations.Station_ID = Ridership.Station_ID WHERE Station_Name = ? AND strftime('%Y', Ride_Date) = ? GROUP BY Date ORDER BY Date;"
-query_nine = "SELECT DISTINCT Stations.Station_Name, Latitude, Longitude FROM Stops JOIN Stations ON Stations.Station_ID = Stops.Station_ID  WHERE ? <= Latitude AND Latitude <= ? AND ? <= Longitude AND Longitude <= ? ORDER BY Station_Name"
+query_three_page = "SELECT Stations.Station_Name, SUM(Ridership.Num_Riders) AS Total_Riders FROM Stations JOIN Ridership ON Stations.Station_ID = Ridership.Station_ID WHERE Ridership.Type_Of_Day = 'W' GROUP BY Stations.Station_Name ORDER BY Total_Riders DESC, Stations.Station_Name ASC LIMIT ? OFFSET ?;"
+query_six = "SELECT strftime('%Y',Ride_Date) AS Year, SUM(Num_Riders) AS Total_Riders FROM Ridership WHERE Station_ID = ? GROUP BY Year ORDER BY Year;"
+query_seven = "SELECT strftime('%m',Ride_Date) AS Month,strftime('%m/%Y',Ride_Date) AS Date, SUM(Num_Riders) AS Total_Riders FROM Ridership WHERE Station_ID = ? AND Ride_Date >= ? AND Ride_Date < ? GROUP BY Month ORDER BY Month;"
+query_eight = "SELECT strftime('%Y-%m-%d',Ride_Date) AS Date, SUM(Num_Riders) AS Daily_Riders FROM Ridership WHERE Station_ID = ? AND Ride_Date >= ? AND Ride_Date < ? GROUP BY Date ORDER BY Date;"
+query_fifteen = "SELECT Stations.Station_ID, Stations.Station_Name, SUM(CASE WHEN Ridership.Type_Of_Day = 'W' THEN Num_Riders ELSE 0 END), SUM(CASE WHEN Ridership.Type_Of_Day = 'A' THEN Num_Riders ELSE 0 END), SUM(CASE WHEN Ridership.Type_Of_Day = 'U' THEN Num_Riders ELSE 0 END), SUM(Num_Riders) FROM Stations JOIN Ridership ON Ridership.Station_ID = Stations.Station_ID GROUP BY Stations.Station_ID ORDER BY Stations.Station_ID;"
+
+# same results read from the rollup table in rollups.py, used when it is current
+query_two_rollup = "SELECT SUM(CASE WHEN Ridership_Rollup.Type_Of_Day = 'W' THEN Num_Riders ELSE 0 END), SUM(CASE WHEN Ridership_Rollup.Type_Of_Day = 'A' THEN Num_Riders ELSE 0 END), SUM(CASE WHEN Ridership_Rollup.Type_Of_Day = 'U' THEN Num_Riders ELSE 0 END), SUM(Num_Riders) FROM Stations JOIN Ridership_Rollup ON Ridership_Rollup.Station_ID = Stations.Station_ID WHERE Station_Name = ?;"
+query_three_a_rollup = "SELECT Stations.Station_Name, SUM(Ridership_Rollup.Num_Riders) AS Total_Riders FROM Stations JOIN Ridership_Rollup ON Stations.Station_ID = Ridership_Rollup.Station_ID WHERE Ridership_Rollup.Type_Of_Day = 'W' GROUP BY Stations.Station_Name ORDER BY Total_Riders DESC;"
+query_three_b_rollup = "SELECT SUM(Num_Riders) AS Total_Riders FROM Ridership_Rollup WHERE Type_Of_Day = 'W';"
+query_three_page_rollup = "SELECT Stations.Station_Name, SUM(Ridership_Rollup.Num_Riders) AS Total_Riders FROM Stations JOIN Ridership_Rollup ON Stations.Station_ID = Ridership_Rollup.Station_ID WHERE Ridership_Rollup.Type_Of_Day = 'W' GROUP BY Stations.Station_Name ORDER BY Total_Riders DESC, Stations.Station_Name ASC LIMIT ? OFFSET ?;"
+query_six_rollup = "SELECT Year, SUM(Num_Riders) AS Total_Riders FROM Ridership_Rollup WHERE Station_ID = ? GROUP BY Year ORDER BY Year;"
+query_seven_rollup = "SELECT Month, Month || '/' || Year AS Date, SUM(Num_Riders) AS Total_Riders FROM Ridership_Rollup WHERE Station_ID = ? AND Year = ? GROUP BY Month ORDER BY Month;"
+query_fifteen_rollup = "SELECT Stations.Station_ID, Stations.Station_Name, SUM(CASE WHEN Ridership_Rollup.Type_Of_Day = 'W' THEN Num_Riders ELSE 0 END), SUM(CASE WHEN Ridership_Rollup.Type_Of_Day = 'A' THEN Num_Riders ELSE 0 END), SUM(CASE WHEN Ridership_Rollup.Type_Of_Day = 'U' THEN Num_Riders ELSE 0 END), SUM(Num_Riders) FROM Stations JOIN Ridership_Rollup ON Ridership_Rollup.Station_ID = Stations.Station_ID GROUP BY Stations.Station_ID ORDER BY Stations.Station_ID;"
+
+# rows fetched from a streamed query at a time
+FETCH_ROWS = 100
+
+# anomalies command 12 lists without --limit
+ANOMALY_ROWS = 25
+
+# stations command 16 lists as growing and as declining without --limit
+TREND_ROWS = 10
+
+# day_type_profile orderings -> the value rows are sorted on
+profile_sorts = {
+    "weekday": lambda row: profile_share(row, 2),
+    "saturday": lambda row: profile_share(row, 3),
+    "sunday": lambda row: profile_share(row, 4),
+    "total": lambda row: row[5],
+    "name": lambda row: row[1],
+}
+
+# background.QueryWorker running the interactive commands' queries, None
+# to run them on the command's own connection
+worker = None
+
+# how much of the listings of commands 1, 3 and 15 is shown: at most output_limit
+# rows (None for all) after skipping the first output_offset
+output_limit = None
+output_offset = 0
+
+##################################################################  
+#
+# input
+#
+# The prompts of the commands, timed as waiting for the user so that
+# time is not counted in the command's latency
+#
+def input(prompt=""):
+    with instrument.phase("input"):
+        return plotting.read_line(prompt)
+
+##################################################################  
+#
+# query
+#
+# Runs function(connection, *args), a query function below, on the
+# background worker when there is one, otherwise on dbConn
+#
+def query(dbConn, function, *args):
+    if worker is None:
+        return function(dbConn, *args)
+    return worker.run(function, *args)
+
+##################################################################  
+#
+# speculate
+#
+# Starts function(connection, *args) on the background worker, when there
+# is one, so a later query() of the same call finds it done or under way.
+# then(result) is called with its result
+#
+def speculate(function, *args, then=None):
+    if worker is not None:
+        worker.speculate(function, *args, then=then)
 
 ##################################################################  
 #
 # print_stats
 #
-# Given a connection to the CTA database, executes various
-# SQL queries to retrieve and output basic stats.
+# Given a connection to the CTA database, outputs basic stats.
+# The figures come from the maintained summary table in stats.py,
+# recompute forces a full rescan of the database
 #
-def print_stats(dbConn):
-    dbCursor = dbConn.cursor()
-    
+def print_stats(dbConn, recompute=False):
     print("General Statistics:")
 
-    # Executing the script for the number of stations
-    dbCursor.execute("Select count(*) From Stations;")
-    stations_result = dbCursor.fetchone();
+    # stations, stops, ride entries, earliest date, latest date, total riders
+    stations, stops, entries, earliest_date, latest_date, total = stats.load_stats(dbConn, recompute)
 
-    # Executing the script for the number of stops
-    dbCursor.execute("Select count(*) From Stops;")
-    stops_result = dbCursor.fetchone();
+    # Printing out all the data
+    print("  # of stations:", f"{stations:,}")
+    print("  # of stops:", f"{stops:,}")
+    print("  # of ride entries:", f"{entries:,}")
+    print("  date range:", f"{earliest_date} - {latest_date}")
+    print("  Total ridership:", f"{total:,}")
+    print()
 
-    # Executing the script for the number of ride entries
-    dbCursor.execute("Select count(*) From Ridership;")
-    ridership_result = dbCursor.fetchone();
+##################################################################  
+#
+# Query functions
+#
+# Each command's data as plain rows, shared by the interactive
+# commands below and by the batch mode in batch.py
+#
 
-    # Executing the script for the earliest date
-    dbCursor.execute("Select strftime('%Y-%m-%d', Ride_Date) As Date From Ridership Order by Ride_Date LIMIT 1;")
-    earliest_date = dbCursor.fetchone();
+##################################################################  
+#
+# find_stations
+#
+# Given a connection to the CTA database and a partial station name
+# (wildcards _ and %), returns (station id, station name) for every match
+#
+def find_stations(dbConn, pattern):
+    return resolver.get_resolver(dbConn).lookup(pattern)
 
-    # Executing the script for the latest date
-    dbCursor.execute("Select strftime('%Y-%m-%d', Ride_Date) As Date From Ridership Order by Ride_Date DESC LIMIT 1;")
-    latest_date = dbCursor.fetchone();
+##################################################################  
+#
+# iter_stations
+#
+# Given a connection to the CTA database, a partial station name and the
+# number of matches to return (None for all) after skipping offset, yields
+# (station id, station name) for those matches in name order
+#
+def iter_stations(dbConn, pattern, limit=None, offset=0):
+    return itertools.islice(find_stations(dbConn, pattern), offset, None if limit is None else offset + limit)
 
-    # Executing the script for the number of riders
-    dbCursor.execute("Select SUM(Num_Riders)  From Ridership;")
-    total_result = dbCursor.fetchone();
+##################################################################  
+#
+# day_type_totals
+#
+# Given a connection to the CTA database and a station name, returns the
+# (weekday, saturday, sunday/holiday, total) ridership at that station,
+# 0 for a type of day without rows and the total None if there is no data
+#
+def day_type_totals(dbConn, station_name):
+    # columnar engine, over every station with exactly this name
+    if engines.use_numpy():
+        return engines.snapshot(dbConn).day_type_totals(resolver.get_resolver(dbConn).ids_of(station_name))
 
+    # read the monthly rollups when they are up to date
+    rollup = rollups.rollups_current(dbConn)
 
-    # Printing out all the data
-    print("  # of stations:", f"{stations_result[0]:,}")
-    print("  # of stops:", f"{stops_result[0]:,}")
-    print("  # of ride entries:", f"{ridership_result[0]:,}")
-    print("  date range:", f"{earliest_date[0]} - {latest_date[0]}")
-    print("  Total ridership:", f"{total_result[0]:,}")
-    print()
+    # one pass over the station's rows, summing each type of day and the total
+    return resultcache.fetchone(dbConn, query_two_rollup if rollup else partitions.history(dbConn, query_two), (station_name,))
+
+##################################################################  
+#
+# day_type_profile
+#
+# Given a connection to the CTA database, returns (station id, station name,
+# weekday, saturday, sunday/holiday, total) ridership for every station with
+# data, or only the given station ids, ordered by profile_sorts[sort]:
+# shares and totals largest first, names A-Z, or the other way with reverse
+# The whole network is summed in one pass
+#
+def day_type_profile(dbConn, station_ids=None, sort="weekday", reverse=False):
+    if sort not in profile_sorts:
+        raise ValueError("sort must be one of %s" % ", ".join(profile_sorts))
+    return sort_profile(day_type_rows(dbConn, station_ids), sort, reverse)
+
+##################################################################  
+#
+# day_type_rows
+#
+# Given a connection to the CTA database, returns the day_type_profile rows
+# of every station with data, or only the given station ids, unsorted
+#
+def day_type_rows(dbConn, station_ids=None):
+    # columnar engine
+    if engines.use_numpy():
+        result = engines.snapshot(dbConn).day_type_profile(resolver.get_resolver(dbConn).names)
+    else:
+        # read the monthly rollups when they are up to date
+        rollup = rollups.rollups_current(dbConn)
+        result = resultcache.fetchall(dbConn, query_fifteen_rollup if rollup else partitions.history(dbConn, query_fifteen))
+
+    if station_ids is not None:
+        wanted = set(station_ids)
+        result = [row for row in result if row[0] in wanted]
+    return result
+
+##################################################################  
+#
+# sort_profile
+#
+# Given day_type_profile rows, returns them ordered by profile_sorts[sort],
+# reversed with reverse
+#
+def sort_profile(result, sort="weekday", reverse=False):
+    # ties are broken by name and id, the same way in either direction
+    key = profile_sorts[sort]
+    if sort != "name":
+        result = sorted(result, key=lambda row: (row[1], row[0]))
+        return sorted(result, key=key, reverse=not reverse)
+    return sorted(result, key=lambda row: (row[1], row[0]), reverse=reverse)
+
+##################################################################  
+#
+# profile_share
+#
+# Given a day_type_profile row and a position (2 weekday, 3 saturday,
+# 4 sunday/holiday), returns that type of day's percentage of the total
+#
+def profile_share(row, index):
+    return row[index] / row[5] * 100 if row[5] else 0.0
+
+##################################################################  
+#
+# weekday_ranking
+#
+# Given a connection to the CTA database, returns the (station name, riders)
+# weekday totals from busiest to quietest and the weekday total of all stations
+#
+def weekday_ranking(dbConn):
+    # columnar engine
+    if engines.use_numpy():
+        return engines.snapshot(dbConn).weekday_ranking(resolver.get_resolver(dbConn).names)
+
+    # read the monthly rollups when they are up to date
+    rollup = rollups.rollups_current(dbConn)
+
+    # sql query for total ridership on weekdays for each station
+    result = resultcache.fetchall(dbConn, query_three_a_rollup if rollup else partitions.history(dbConn, query_three_a))
+
+    # sql query for total ridership on weekdays for all stations
+    total = resultcache.fetchone(dbConn, query_three_b_rollup if rollup else partitions.history(dbConn, query_three_b))
+
+    return result, total[0]
+
+##################################################################  
+#
+# weekday_total
+#
+# Given a connection to the CTA database, returns the weekday total of all stations
+#
+def weekday_total(dbConn):
+    # columnar engine
+    if engines.use_numpy():
+        return weekday_ranking(dbConn)[1]
+
+    rollup = rollups.rollups_current(dbConn)
+    return resultcache.fetchone(dbConn, query_three_b_rollup if rollup else partitions.history(dbConn, query_three_b))[0]
+
+##################################################################  
+#
+# iter_weekday_ranking
+#
+# Given a connection to the CTA database, the number of stations to return
+# (None for all) and how many to skip, yields (station name, riders) weekday
+# totals from busiest to quietest as they are fetched
+# The limit and offset are part of the query, so a top-N only sorts out N rows
+#
+def iter_weekday_ranking(dbConn, limit=None, offset=0):
+    # columnar engine, ranked in memory
+    if engines.use_numpy():
+        return itertools.islice(weekday_ranking(dbConn)[0], offset, None if limit is None else offset + limit)
+
+    rollup = rollups.rollups_current(dbConn)
+    # LIMIT -1 is no limit
+    return resultcache.iterate(dbConn, query_three_page_rollup if rollup else partitions.history(dbConn, query_three_page), (-1 if limit is None else limit, offset), FETCH_ROWS)
+
+##################################################################  
+#
+# line_exists
+#
+# Given a connection to the CTA database and a line color, returns True if
+# there is a line of that color (ignoring case)
+#
+def line_exists(dbConn, color):
+    return topology.get_topology(dbConn).has_line(color)
+
+##################################################################  
+#
+# line_stops
+#
+# Given a connection to the CTA database, a line color and a direction,
+# returns (stop name, direction, ADA) for every stop of the line going
+# that way, ignoring case
+#
+def line_stops(dbConn, color, direction):
+    return topology.get_topology(dbConn).line_stops_going(color, direction)
+
+##################################################################  
+#
+# stops_by_color
+#
+# Given a connection to the CTA database, returns (color, direction, stops)
+# for every line and direction and the total number of stops
+#
+def stops_by_color(dbConn):
+    return topology.get_topology(dbConn).stops_by_color()
+
+##################################################################  
+#
+# shared_stations
+#
+# Given a connection to the CTA database and two line colors, returns
+# (station id, station name) for every station on both lines
+#
+def shared_stations(dbConn, color_one, color_two):
+    return topology.get_topology(dbConn).shared_stations(color_one, color_two)
+
+##################################################################  
+#
+# ada_by_line
+#
+# Given a connection to the CTA database, returns (color, ADA stops, stops)
+# for every line
+#
+def ada_by_line(dbConn):
+    return topology.get_topology(dbConn).ada_by_line()
+
+##################################################################  
+#
+# yearly_ridership
+#
+# Given a connection to the CTA database and a station id, returns
+# (year, riders) for every year, from the monthly rollups when they are up to date
+#
+def yearly_ridership(dbConn, station_id):
+    # columnar engine
+    if engines.use_numpy():
+        return engines.snapshot(dbConn).yearly_ridership(station_id)
+
+    rollup = rollups.rollups_current(dbConn)
+    return resultcache.fetchall(dbConn, query_six_rollup if rollup else partitions.history(dbConn, query_six),(station_id,))
+
+##################################################################  
+#
+# monthly_ridership
+#
+# Given a connection to the CTA database, a station id and a year, returns
+# (month, 'mm/yyyy', riders) for every month of that year
+# Reads the monthly rollups when they are up to date, otherwise the year
+# becomes a Ride_Date range so the index can be used, on the year's
+# partition when it has been rolled into one
+#
+def monthly_ridership(dbConn, station_id, year):
+    # columnar engine
+    if engines.use_numpy():
+        return engines.snapshot(dbConn).monthly_ridership(station_id, year)
+
+    if rollups.rollups_current(dbConn):
+        return resultcache.fetchall(dbConn, query_seven_rollup,(station_id,str(year).strip(),))
+    return partitions.fetchall(dbConn, query_seven, (station_id,), *dates.year_range(year), fetch=resultcache.fetchall)
+
+##################################################################  
+#
+# daily_ridership
+#
+# Given a connection to the CTA database, a station id and a year, returns
+# ('yyyy-mm-dd', riders) for every day of that year with data
+#
+def daily_ridership(dbConn, station_id, year):
+    # columnar engine
+    if engines.use_numpy():
+        return engines.snapshot(dbConn).daily_ridership(station_id, year)
+
+    return partitions.fetchall(dbConn, query_eight, (station_id,), *dates.year_range(year))
+
+##################################################################  
+#
+# stations_within
+#
+# Given a connection to the CTA database, a latitude, longitude and radius
+# in miles, returns (station name, latitude, longitude, distance) for every
+# station within the radius, listed by name
+#
+def stations_within(dbConn, lat, long, radius=1.0):
+    nearby = spatial.get_station_index(dbConn).within(float(lat), float(long), radius)
+    return sorted((row[1], row[2], row[3], row[0]) for row in nearby)
+
+##################################################################  
+#
+# nearest_stations
+#
+# Given a connection to the CTA database, a latitude, longitude and a count,
+# returns (distance, station name, latitude, longitude) for that many of the
+# closest stations, nearest first
+#
+def nearest_stations(dbConn, lat, long, count):
+    return spatial.get_station_index(dbConn).nearest(float(lat), float(long), int(count))
 
 ##################################################################  
 #
 # command_one
 #
-# Given a connection to the CTA database, executes one
-# SQL query based on the users input 
+# Given a connection to the CTA database, looks up the stations
+# matching the users input with the station resolver
 #
 def command_one(dbConn):
     # prompt for user input
     print()
     user = input("Enter partial station name (wildcards _ and %): ")
-    # excecute query
-    dbCursor = dbConn.cursor()
-    dbCursor.execute(query_one, (user,))
-    result = dbCursor.fetchall();
+    # print the matching stations as they are found
+    found = False
+    for row in iter_stations(dbConn, user, output_limit, output_offset):
+        print("%s : %s" %(row[0],row[1]))
+        found = True
 
     # check if empty
-    if not result:
+    if not found:
         print("**No stations found...")
         print()
 
-    # print all stations
-    for row in result:
-        print("%s : %s" %(row[0],row[1]))
-    
     print()
 
 ##################################################################  
 #
 # command_two
 #
-# Given a connection to the CTA database, executes four sql queries
-# SQL query based on the users input and displays some data ab the days of the week
-# and the number of riders s
+# Given a connection to the CTA database, finds the ridership of the station
+# the user inputs on weekdays, saturdays and sundays/holidays and displays
+# each as a percentage of the total
 #
 def command_two(dbConn):
-    dbCursor = dbConn.cursor()
     print()
     # prompt user
     user = input("Enter the name of the station you would like to analyze:")
 
-    # sql query #1 for weekday ridership
-    dbCursor.execute(query_two_a, (user,))
-    a = dbCursor.fetchone();
-
-    # sql query #2 for saturday ridership
-    dbCursor.execute(query_two_b, (user,))
-    b = dbCursor.fetchone();
-
-    # sql query #3 for sunday + holiday ridership
-    dbCursor.execute(query_two_c, (user,))
-    c = dbCursor.fetchone();
-
-    # sql query #4 for total ridership
-    dbCursor.execute(query_two_d, (user,))
-    d = dbCursor.fetchone();
+    # weekday, saturday, sunday/holiday and total ridership
+    a, b, c, d = query(dbConn, day_type_totals, user)
 
     # checking if the data set was empty
-    if not a[0]:
+    if not d:
         print(" **No data found...")
         print()
         return
     
     # getting the percentages
-    a_percent = a[0] / d[0]
-    b_percent = b[0] / d[0]
-    c_percent = c[0] / d[0]
+    a_percent = a / d
+    b_percent = b / d
+    c_percent = c / d
 
     # printing out the stats in correct format
     print(" Percentage of ridership for the %s station: " %(user))
-    print("  Weekday ridership:", f"{a[0]:,}","(%.2f%%)" %(a_percent * 100))
-    print("  Saturday ridership:", f"{b[0]:,}","(%.2f%%)" %(b_percent * 100) )
-    print("  Sunday/holiday ridership:", f"{c[0]:,}","(%.2f%%)" %(c_percent * 100))
-    print("  Total ridership:", f"{d[0]:,}")
+    print("  Weekday ridership:", f"{a:,}","(%.2f%%)" %(a_percent * 100))
+    print("  Saturday ridership:", f"{b:,}","(%.2f%%)" %(b_percent * 100) )
+    print("  Sunday/holiday ridership:", f"{c:,}","(%.2f%%)" %(c_percent * 100))
+    print("  Total ridership:", f"{d:,}")
     print()
 
 ##################################################################  
 #
 # command_three
-# Given a connection to the CTA database, executes two sql queries one
-# that finds the  percentage of riderships on the weekdays that are at each station
+# Given a connection to the CTA database, finds the percentage of
+# riderships on the weekdays that are at each station
 #
 def command_three(dbConn):
-    dbCursor = dbConn.cursor()
-
-    # sql query for total ridership on weekdays for each station
-    dbCursor.execute(query_three_a)
-    result = dbCursor.fetchall();
-
-    # sql query for total ridership on weekdays for all stations
-    dbCursor.execute(query_three_b)
-    total = dbCursor.fetchone();
+    # weekday ridership for all stations
+    total = weekday_total(dbConn)
 
-    # printing out data with its percentage
+    # printing out each station with its percentage as the rows arrive
     print("Ridership on Weekdays for Each Station")
-    for row in result:
-        percentage = row[1] / total[0]
+    for count, row in enumerate(iter_weekday_ranking(dbConn, output_limit, output_offset), 1):
+        percentage = row[1] / total
         print("%s : %s (%.2f%%)" % (row[0], f"{row[1]:,}", percentage * 100))
+        if count % FETCH_ROWS == 0:
+            sys.stdout.flush()
 
     print()
 
@@ -182,13 +506,8 @@ def command_four(dbConn):
     print()
     line = input("Enter a line color (e.g. Red or Yellow):").lower()
 
-    # sql query that finds the users inputted line
-    dbCursor = dbConn.cursor()
-    dbCursor.execute(query_four_a,(line,))
-    line_result = dbCursor.fetchone();
-
     # checking if none found
-    if not line_result:
+    if not line_exists(dbConn, line):
         print(" **No such line...")
         print()
         return
@@ -196,9 +515,8 @@ def command_four(dbConn):
     # prompting user for direction
     direction = input(" Enter a direction (N/S/W/E): ").lower()
 
-    # sql query #2 that finds all the stops in that direction and if they are accesible
-    dbCursor.execute(query_four_b,(line,direction))
-    direction_result = dbCursor.fetchall();
+    # finds all the stops in that direction and if they are accesible
+    direction_result = line_stops(dbConn, line, direction)
 
     # checkin if none found
     if not direction_result:
@@ -222,19 +540,13 @@ def command_four(dbConn):
 # 
 #
 def command_five(dbConn):
-    # sql query that finds stops for each color
-    dbCursor = dbConn.cursor()
-    dbCursor.execute(query_five_a)
-    stops = dbCursor.fetchall();
-
-    # second sql query to find total number of stops
-    dbCursor.execute(query_five_b)
-    total_stops = dbCursor.fetchone();
+    # stops for each color and the total number of stops
+    stops, total_stops = stops_by_color(dbConn)
 
     # printing out data
     print("Number of Stops For Each Color By Direction")
     for row in stops:
-        print("%s going %c : %d (%.2f%%)" %(row[0],row[1],row[2],row[2]/total_stops[0] * 100))
+        print("%s going %c : %d (%.2f%%)" %(row[0],row[1],row[2],row[2]/total_stops * 100))
 
 ##################################################################  
 #
@@ -252,10 +564,8 @@ def command_six(dbConn):
     print()
     user = input("Enter a station name (wildcards _ and %): ")
 
-    # sql query that checks if station exist 
-    dbCursor = dbConn.cursor()
-    dbCursor.execute(query_one, (user,))
-    result = dbCursor.fetchall();
+    # checking if station exist
+    result = find_stations(dbConn, user)
 
     # checking if no or too many stations
     if not result:
@@ -267,9 +577,8 @@ def command_six(dbConn):
         print()
         return
     
-    # executing second sql query
-    dbCursor.execute(query_six,(result[0][1],))
-    yearly = dbCursor.fetchall();
+    # ridership for every year at the station
+    yearly = query(dbConn, yearly_ridership, result[0][0])
 
     # printing out data
     print("Yearly Ridership at %s" %(result[0][1]))
@@ -285,11 +594,7 @@ def command_six(dbConn):
 
     # plotting graph
     if(plot == "y"):
-        plt.plot(years_list,totals_list)
-        plt.xlabel('Year')
-        plt.ylabel('Number of Riders')
-        plt.title('Yearly Ridership At %s Station' %(result[0][1],))
-        plt.show()
+        plotting.plot_yearly(result[0][1], years_list, totals_list)
     else:
         return
         
@@ -309,10 +614,8 @@ def command_seven(dbConn):
     # prompting user input
     station = input("Enter a station name (wildcards _ and %):")
     
-    # executing sql query to find the station 
-    dbCursor = dbConn.cursor()
-    dbCursor.execute(query_one, (station,))
-    result = dbCursor.fetchall();
+    # finding the station
+    result = find_stations(dbConn, station)
 
     # checking if no or too many stations
     if not result:
@@ -324,17 +627,20 @@ def command_seven(dbConn):
         print()
         return
     
-    # setting station name
+    # setting station id and name
+    station_id = result[0][0]
     station_name = result[0][1]
 
+    # while the year is typed, every year of the station is fetched
+    speculate(yearly_ridership, station_id, then=lambda yearly: [speculate(monthly_ridership, station_id, row[0]) for row in yearly])
+
     # prompting for year
     year = input(" Enter a year: ")
 
     print("Monthly Ridership at %s for %s" %(station_name,year))
 
-    # second sql query that gets the ridership for each month of the year at the certain station 
-    dbCursor.execute(query_seven,(station_name,year,))
-    monthly = dbCursor.fetchall();
+    # ridership for each month of the year at the certain station
+    monthly = query(dbConn, monthly_ridership, station_id, year)
 
     # printing data
     for row in monthly:
@@ -349,18 +655,14 @@ def command_seven(dbConn):
 
     # plotting graph
     if(plot == "y"):
-        plt.plot(month_list,totals_list)
-        plt.xlabel('Month')
-        plt.ylabel('Number of Riders')
-        plt.title('Monthly Ridership At %s Station (%s)' %(station_name,year))
-        plt.show()
+        plotting.plot_monthly(station_name, year, month_list, totals_list)
     else:
         return
 
 ##################################################################  
 #
 # command_eight
-# Given a connection to the CTA database, runs 3 sql queries to find the two station and
+# Given a connection to the CTA database, finds the two stations and
 # all the number of riders each day and compare and plot
 # Can be plotted
 #
@@ -369,7 +671,6 @@ def command_eight(dbConn):
     days = []
     station_one_riders = []
     station_two_riders = []
-    dbCursor = dbConn.cursor()
 
     # prompting user
     print()
@@ -378,8 +679,7 @@ def command_eight(dbConn):
     station_one = input("Enter station 1 (wildcards _ and %): ")
 
     # checking if the station exists
-    dbCursor.execute(query_one,(station_one,))
-    station_one_result = dbCursor.fetchall();
+    station_one_result = find_stations(dbConn, station_one)
 
     # checking if no station
     if not station_one_result:
@@ -401,8 +701,7 @@ def command_eight(dbConn):
     station_two = input("Enter station 2 (wildcards _ and %): ")
 
     # checking if second station exists
-    dbCursor.execute(query_one,(station_two,))
-    station_two_result = dbCursor.fetchall();
+    station_two_result = find_stations(dbConn, station_two)
 
     # checking no station
     if not station_two_result:
@@ -420,12 +719,11 @@ def command_eight(dbConn):
     station_two_name = station_two_result[0][1]
     station_two_id = station_two_result[0][0]
 
-    # retreiving each day from the user inputted year
-    dbCursor.execute(query_eight,(station_one_name,year,))
-    station_one_days = dbCursor.fetchall();
-
-    dbCursor.execute(query_eight,(station_two_name,year,))
-    station_two_days = dbCursor.fetchall();
+    # retreiving each day from the user inputted year, both stations aligned by
+    # date with None on the days a station has no data
+    year_days, (station_one_series, station_two_series) = query(dbConn, comparison.daily_matrix, [station_one_id, station_two_id], *dates.year_range(year))
+    station_one_days = [(day, riders) for day, riders in zip(year_days, station_one_series) if riders is not None]
+    station_two_days = [(day, riders) for day, riders in zip(year_days, station_two_series) if riders is not None]
 
     # print the first and last 5 days
     print("Station 1: %s %s" %(station_one_id,station_one_name))
@@ -442,13 +740,11 @@ def command_eight(dbConn):
             print("%s %s" %(row[0],row[1]))
     print()
 
-    # adding data to list for plot
-    for row in station_one_days:
-        days.append(len(days)+1)
-        station_one_riders.append(row[1])
-    for row in station_two_days:
-        station_two_riders.append(row[1])
-
+    # adding data to list for plot, day numbers of the year so missing days leave a gap
+    for day in range(len(year_days)):
+        days.append(day+1)
+        station_one_riders.append(station_one_series[day])
+        station_two_riders.append(station_two_series[day])
 
     # prompting plot
     plot = input("Plot? (y/n) ")
@@ -456,30 +752,18 @@ def command_eight(dbConn):
 
     # plotting the two stations
     if(plot == "y"):
-        plt.plot(days,station_one_riders, label = station_one_name, color = 'blue')
-        plt.plot(days,station_two_riders, label = station_two_name, color = 'orange')
-
-        plt.xlabel('Day')
-        plt.ylabel('Number of Riders')
-        plt.title("Ridership Each Day of %s" %(year))
-        plt.legend()
-        plt.show()
+        plotting.plot_daily(year, days, station_one_name, station_one_riders, station_two_name, station_two_riders)
     else:
         return
     
 ##################################################################  
 #
 # command_nine
-# Given a connection to the CTA database, it executes a sql query to find all the stations within a mile
-# of the users latitude and longitude inputted
+# Given a connection to the CTA database, it uses the station spatial index to find all the stations
+# within a mile (or the given radius in miles) of the users latitude and longitude inputted
 #
 #
-def command_nine(dbConn):
-    # vars
-    x = []
-    y = []
-    names = []
-
+def command_nine(dbConn, radius=1.0):
     #prompting the user for lat and long and checking if they are within the bounds of chicago
     print()
     lat = input("Enter a latitude: ")
@@ -494,16 +778,8 @@ def command_nine(dbConn):
         print()
         return
     
-    # calculating the bounds
-    lat_lower = round(float(lat) - (1 / 69),3)
-    lat_upper = round(float(lat) + (1 / 69),3)
-    long_upper = round(float(long) - (1/51),3)
-    long_lower = round(float(long) + (1/51),3)
-
-    # executing the sql query
-    dbCursor = dbConn.cursor()
-    dbCursor.execute(query_nine,(str(lat_lower),str(lat_upper),str(long_upper),str(long_lower)))
-    result = dbCursor.fetchall();
+    # looking up the stations by true distance, listed by name
+    result = stations_within(dbConn, lat, long, radius)
 
     # check if empty
     if not result:
@@ -512,7 +788,10 @@ def command_nine(dbConn):
         return
     
     print()
-    print("List of Stations Within a Mile")
+    if radius == 1:
+        print("List of Stations Within a Mile")
+    else:
+        print("List of Stations Within %g Miles" %(radius))
     # printing the stations within the mile and their coordinates
     for row in result:
         print(f"{row[0]} : ({float(row[1]):}, {float(row[2]):})".rstrip('0').rstrip('.'))
@@ -524,57 +803,433 @@ def command_nine(dbConn):
 
     # if user wants plot
     if(plot == "y"):
-        # set image and dimensions and labels 
-        image = plt.imread("chicago.png")
-        xydims = [-87.9277, -87.5569, 41.7012, 42.0868]
-        plt.imshow(image, extent=xydims)
-        plt.title("Stations Near You")
-        plt.plot(x, y)
-        # add the data to the graph
-        for row in result:
-            plt.annotate(row[0], (row[2], row[1]), textcoords="offset points", xytext=(0, 5), ha='center')
-        plt.xlim([-87.9277, -87.5569])
-        plt.ylim([41.7012, 42.0868])
-        plt.show()
+        plotting.plot_nearby(result)
 
 ##################################################################  
 #
-# main
+# command_ten
+# Given a connection to the CTA database, it uses the station spatial index to find the
+# closest stations to the users latitude and longitude inputted and how far away they are
 #
-print('** Welcome to CTA L analysis app **')
-print()
-
-dbConn = sqlite3.connect('CTA2_L_daily_ridership.db')
-
-print_stats(dbConn)
-
-command = input("Please enter a command (1-9, x to exit): ")
-
-# loop for the users input
-while(command != "x"):
-    if command == "1":
-        command_one(dbConn)
-    elif command == "2":
-        command_two(dbConn)
-    elif command == "3":
-        command_three(dbConn)
-    elif command == "4":
-        command_four(dbConn)
-    elif command == "5":
-        command_five(dbConn)
-    elif command == "6":
-        command_six(dbConn)
-    elif command == "7":
-        command_seven(dbConn)
-    elif command == "8":
-        command_eight(dbConn)
-    elif command == "9":
-        command_nine(dbConn)
-    else:
-        print("**Error, unknown command, try again...")
+def command_ten(dbConn):
+    #prompting the user for lat and long and checking if they are within the bounds of chicago
+    print()
+    lat = input("Enter a latitude: ")
+    if float(lat) < 40 or float(lat) > 43:
+        print("**Latitude entered is out of bounds...")
+        print()
+        return
+
+    long = input("Enter a longitude: ")
+    if float(long)< -88 or float(long ) > -87:
+        print("**Longitude entered is out of bounds...")
+        print()
+        return
+
+    # prompting for the number of stations
+    count = input("How many stations? ")
+    if not count.isdigit() or int(count) < 1:
+        print("**Number of stations must be a positive number...")
+        print()
+        return
+
+    # looking up the closest stations
+    result = nearest_stations(dbConn, lat, long, count)
+
+    # check if empty
+    if not result:
+        print("**No stations found...")
+        print()
+        return
+
+    print()
+    print("List of Nearest Stations")
+    # printing the stations, their coordinates and distance
+    for row in result:
+        print(f"{row[1]} : ({row[2]}, {row[3]}) %.2f miles" %(row[0]))
+    print()
+
+##################################################################  
+#
+# command_eleven
+# Given a connection to the CTA database, compares the daily ridership of any number
+# of stations (names, wildcards or whole lines) over a range of days, lined up by date
+# Can be plotted
+#
+def command_eleven(dbConn):
+    # prompting for the stations
+    print()
+    entries = input("Enter stations separated by commas (wildcards _ and %, or line:color): ")
+    stations, unmatched = comparison.select_stations(dbConn, entries.split(","))
+
+    # reporting entries that matched nothing
+    for entry in unmatched:
+        print("**No station found for %s..." %(entry))
+    if not stations:
+        print()
+        return
+
+    # prompting for the range of days
+    first = input("First day (yyyy-mm-dd, blank for the earliest): ")
+    last = input("Last day (yyyy-mm-dd, blank for the latest): ")
+    start, end = comparison.date_span(dbConn, first, last)
+    if not start:
+        print("**Invalid range of days...")
+        print()
+        return
+
+    # every day of the range, one column per station
+    days, columns = query(dbConn, comparison.daily_matrix, [row[0] for row in stations], start, end)
+
+    # printing each station's total and the days it has no data for
+    print()
+    print("Daily Ridership From %s To %s (%s days)" %(days[0], days[-1], f"{len(days):,}"))
+    for station, column in zip(stations, columns):
+        riders = [value for value in column if value is not None]
+        print("%s %s : %s riders, %d days missing" %(station[0], station[1], f"{sum(riders):,}", len(column) - len(riders)))
+
+    # prompting plot
+    print()
+    plot = input("Plot? (y/n) ")
+    print()
+
+    if(plot == "y"):
+        plotting.plot_compare(days, [row[1] for row in stations], columns)
+
+##################################################################  
+#
+# command_twelve
+#
+# Finds the days stations' ridership was unusually high or low across the
+# whole network, compared with the same type of day in the weeks before
+#
+def command_twelve(dbConn):
+    # vectorized over every station, needs NumPy
+    try:
+        import anomalies
+    except ImportError:
+        print("**NumPy is needed to look for anomalies...")
+        print()
+        return
+
+    # prompting for the range of days and how unusual a day has to be
+    print()
+    first = input("First day (yyyy-mm-dd, blank for the earliest): ")
+    last = input("Last day (yyyy-mm-dd, blank for the latest): ")
+    start, end = comparison.date_span(dbConn, first, last)
+    if not start:
+        print("**Invalid range of days...")
+        print()
+        return
+
+    # the network's days are loaded while the threshold is typed
+    if start:
+        speculate(engines.snapshot)
+
+    try:
+        threshold, percent = anomalies.parse_threshold(input("Threshold (3 for standard deviations, 50% for percent, blank for 3): "))
+    except ValueError:
+        print("**Invalid threshold...")
         print()
+        return
+
+    result = query(dbConn, anomalies.find_anomalies, start, end, threshold, percent)
+
+    # printing the most unusual days first
+    print()
+    print("Anomalous Days From %s To %s (%s found, %s)" %(start, dates.days_of(start, end)[-1], f"{len(result):,}",
+          "%g%% from normal" %(threshold) if percent else "%g standard deviations from normal" %(threshold)))
+    shown = result[:ANOMALY_ROWS if output_limit is None else output_limit]
+    for row in shown:
+        print("%s %s %s %s : %s riders, normal %s (z %+.1f, %+.1f%%)" %(row[0], row[3], row[1], row[2], f"{row[4]:,}", f"{round(row[5]):,}", row[6], row[7]))
+    if len(result) > len(shown):
+        print("... and %s more" %(f"{len(result) - len(shown):,}"))
+
+    print()
+
+##################################################################  
+#
+# command_thirteen
+#
+# Lists the stations two lines have in common
+#
+def command_thirteen(dbConn):
+    # prompting for both lines
+    print()
+    lines = []
+    for prompt in ["Enter a line color (e.g. Red or Yellow): ", "Enter another line color: "]:
+        color = input(prompt).strip()
+        if not line_exists(dbConn, color):
+            print("**No such line...")
+            print()
+            return
+        lines.append(color)
+
+    result = shared_stations(dbConn, lines[0], lines[1])
+
+    # printing the stations on both lines
+    if not result:
+        print("**The lines share no stations...")
+    for row in result:
+        print("%s : %s" %(row[0],row[1]))
+    print()
+
+##################################################################  
+#
+# command_fourteen
+#
+# Outputs how many of each line's stops are handicap accessible
+#
+def command_fourteen(dbConn):
+    print("Handicap Accessible Stops For Each Line")
+    for row in ada_by_line(dbConn):
+        print("%s : %d of %d (%.2f%%)" %(row[0],row[1],row[2],row[1]/row[2] * 100 if row[2] else 0))
+    print()
+
+##################################################################  
+#
+# command_fifteen
+#
+# Outputs how each station's ridership splits over weekdays, saturdays and
+# sundays/holidays, for the whole network or the stations the user picks,
+# sorted by any share, and can write the table to a CSV file
+#
+def command_fifteen(dbConn):
+    # prompting for the stations, blank for all of them
+    print()
+    entries = input("Enter stations separated by commas (wildcards _ and %, or line:color, blank for every station): ")
+    station_ids = None
+    if entries.strip():
+        stations, unmatched = comparison.select_stations(dbConn, entries.split(","))
+        for entry in unmatched:
+            print("**No station found for %s..." %(entry))
+        if not stations:
+            print()
+            return
+        station_ids = [row[0] for row in stations]
+
+    # summed while the order is typed, any order reads the same totals
+    speculate(day_type_rows, station_ids)
+
+    # prompting for the order, a leading - flips it
+    sort = input("Sort by (%s; a leading - reverses, blank for weekday): " %(", ".join(profile_sorts))).strip().lower() or "weekday"
+    reverse = sort.startswith("-")
+    sort = sort.lstrip("-")
+    if sort not in profile_sorts:
+        print("**Unknown sort order...")
+        print()
+        return
+
+    result = sort_profile(query(dbConn, day_type_rows, station_ids), sort, reverse)
+    if not result:
+        print("**No data found...")
+        print()
+        return
+
+    # printing the shares of each station
+    print()
+    print("Ridership by Type of Day (%s stations, by %s)" %(f"{len(result):,}", sort))
+    shown = itertools.islice(result, output_offset, None if output_limit is None else output_offset + output_limit)
+    for row in shown:
+        print("%s %s : weekday %.2f%%, saturday %.2f%%, sunday/holiday %.2f%% of %s" %(row[0], row[1], profile_share(row, 2), profile_share(row, 3), profile_share(row, 4), f"{row[5]:,}"))
+
+    # prompting export
+    print()
+    path = input("Export to CSV file (blank for none): ").strip()
+    if path:
+        try:
+            with open(path, "w", newline="") as out:
+                write_profile(result, out)
+            print("Wrote %s stations to %s" %(f"{len(result):,}", path))
+        except OSError as error:
+            print("**Could not write %s: %s..." %(path, error.strerror))
+    print()
+
+##################################################################  
+#
+# write_profile
+#
+# Given day_type_profile rows and an output stream, writes them as CSV with
+# the riders and share of every type of day
+#
+def write_profile(result, out):
+    writer = csv.writer(out)
+    writer.writerow(["station_id", "station", "weekday", "saturday", "sunday_holiday", "total", "weekday_percent", "saturday_percent", "sunday_holiday_percent"])
+    for row in result:
+        writer.writerow(list(row) + ["%.2f" % profile_share(row, index) for index in (2, 3, 4)])
+
+##################################################################  
+#
+# command_sixteen
+#
+# Ranks the stations by how fast their ridership is growing or declining,
+# with each one's monthly and yearly change, trailing averages and recovery
+#
+def command_sixteen(dbConn):
+    # prompting for the day, the baseline year and the ranking
+    print()
+    as_of = input("As of (yyyy-mm-dd, blank for the latest day): ")
+    speculate(trends.station_trends, as_of, trends.BASELINE_YEAR)
+    baseline = input("Baseline year for the recovery (blank for %s): " %(trends.BASELINE_YEAR)).strip() or trends.BASELINE_YEAR
+    key = input("Rank by (%s; blank for yoy): " %(", ".join(trends.rank_keys))).strip().lower() or "yoy"
+
+    try:
+        result = query(dbConn, trends.station_trends, as_of, baseline)
+        growing, declining = trends.rank(result, key)
+    except ValueError as error:
+        print("**%s..." %(str(error).capitalize()))
+        print()
+        return
+
+    if not growing:
+        print("**No data found...")
+        print()
+        return
+
+    # the fastest growing and the fastest declining stations
+    rows = TREND_ROWS if output_limit is None else output_limit
+    print()
+    print("Station Trends For %s (%s stations, baseline %s)" %(result[0].month, f"{len(growing):,}", baseline))
+    for title, ranked in [("Fastest Growing", growing), ("Fastest Declining", declining)]:
+        print("%s by %s:" %(title, key))
+        for row in ranked[output_offset:output_offset + rows]:
+            print(trend_line(row))
+        print()
+
+##################################################################  
+#
+# trend_line
+#
+# Given a trends.Trend row, returns it as one line of command 16
+#
+def trend_line(row):
+    def percent(value):
+        return "n/a" if value is None else "%+.1f%%" %(value)
+
+    def average(value):
+        return "n/a" if value is None else f"{round(value):,}"
+
+    return "%s %s : yoy %s, mom %s, month yoy %s, avg 7/28/365 %s/%s/%s, recovery %s" %(row.station_id, row.station,
+           percent(row.yoy), percent(row.mom), percent(row.month_yoy), average(row.avg_7), average(row.avg_28), average(row.avg_365),
+           "n/a" if row.recovery is None else "%.2f" %(row.recovery))
+
+# command number -> interactive command
+commands = {
+    "1": command_one,
+    "2": command_two,
+    "3": command_three,
+    "4": command_four,
+    "5": command_five,
+    "6": command_six,
+    "7": command_seven,
+    "8": command_eight,
+    "9": command_nine,
+    "10": command_ten,
+    "11": command_eleven,
+    "12": command_twelve,
+    "13": command_thirteen,
+    "14": command_fourteen,
+    "15": command_fifteen,
+    "16": command_sixteen,
+}
+
+##################################################################  
+#
+# main
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CTA L analysis app")
+    parser.add_argument("--db", default="CTA2_L_daily_ridership.db", help="path to the CTA database")
+    parser.add_argument("--recompute-stats", action="store_true", help="rescan the database for the general statistics")
+    parser.add_argument("--rebuild-rollups", action="store_true", help="rebuild every month of the ridership rollups")
+    parser.add_argument("--batch", metavar="FILE", help="run the commands in FILE (- for stdin) instead of prompting")
+    parser.add_argument("--format", choices=["jsonl", "csv"], default="jsonl", help="batch output format")
+    parser.add_argument("--output", metavar="FILE", help="write batch results to FILE instead of stdout")
+    parser.add_argument("--plot-dir", default=".", help="directory batch plots are written to")
+    parser.add_argument("--engine", choices=engines.names, default="sqlite", help="backend the ridership aggregations run on")
+    parser.add_argument("--slow-log", metavar="FILE", help="append statements slower than --slow-ms to FILE, with their plans")
+    parser.add_argument("--slow-ms", type=float, default=100.0, help="slow-query threshold in milliseconds")
+    parser.add_argument("--stats-json", metavar="FILE", help="write the query and command timings to FILE as JSON on exit")
+    parser.add_argument("--cache-mb", type=float, default=32, help="memory for cached query results, 0 turns the cache off")
+    parser.add_argument("--persist-cache", action="store_true", help="keep cached results in <db>.cache for the next session")
+    parser.add_argument("--plot-points", type=int, help="most points drawn per daily series (default the chart's width in pixels, 0 draws every point)")
+    parser.add_argument("--no-background", action="store_true", help="run the interactive queries in the foreground, with no prefetching")
+    parser.add_argument("--limit", type=int, help="show at most this many rows of the station lists (commands 1, 3 and 15)")
+    parser.add_argument("--offset", type=int, default=0, help="skip this many rows of the station lists first, for paging")
+    args = parser.parse_args()
+
+    if (args.limit is not None and args.limit < 0) or args.offset < 0:
+        parser.error("--limit and --offset cannot be negative")
+    if args.plot_points is not None and args.plot_points < 0:
+        parser.error("--plot-points cannot be negative")
+    output_limit = args.limit
+    output_offset = args.offset
+
+    engines.set_engine(args.engine)
+    instrument.configure(args.slow_ms, args.slow_log)
+    resultcache.configure(args.cache_mb * 1024 * 1024, args.persist_cache)
+    plotting.configure(args.plot_points)
+    dbConn = sqlite3.connect(args.db, uri=True, factory=instrument.InstrumentedConnection)
+
+    # bring the ridership rollups up to date, read only databases use the raw tables
+    try:
+        rollups.refresh_rollups(dbConn, rebuild=args.rebuild_rollups)
+    except sqlite3.OperationalError:
+        pass
+
+    # batch mode, no prompts
+    if args.batch:
+        import batch
+        lines = sys.stdin if args.batch == "-" else open(args.batch)
+        out = open(args.output, "w", newline="") if args.output else sys.stdout
+        failed = batch.run_batch(dbConn, lines, out, args.format, args.plot_dir)
+        out.flush()
+        if lines is not sys.stdin:
+            lines.close()
+        if out is not sys.stdout:
+            out.close()
+        if args.stats_json:
+            instrument.dump(args.stats_json)
+        resultcache.save(dbConn)
+        sys.exit(1 if failed else 0)
+
+    # queries run on a worker of their own, files only, a second connection
+    # to an in-memory database would open another, empty one
+    if not args.no_background and isinstance(dbutil.database_key(dbConn), str):
+        worker = background.QueryWorker(args.db, instrument.InstrumentedConnection)
+
+    print('** Welcome to CTA L analysis app **')
+    print()
+
+    print_stats(dbConn, args.recompute_stats)
+
+    command = input("Please enter a command (1-16, x to exit): ")
+
+    # loop for the users input
+    while(command != "x"):
+        if command in commands:
+            # timed, with the time split into sql, plotting, input and python
+            # a partition file that went missing or cannot be read
+            try:
+                with instrument.command(command):
+                    commands[command](dbConn)
+            except partitions.PartitionError as error:
+                print("**%s..." %(str(error).capitalize()))
+                print()
+        elif command == "stats":
+            instrument.print_report()
+            resultcache.print_report()
+        else:
+            print("**Error, unknown command, try again...")
+            print()
+
+        command = input("Please enter a command (1-16, x to exit): ")
 
-    command = input("Please enter a command (1-9, x to exit): ")
+    if worker is not None:
+        worker.close()
+    if args.stats_json:
+        instrument.dump(args.stats_json)
+    resultcache.save(dbConn)
 
 #
 # done
@@ -0,0 +1,132 @@
+# Overview: Schema migrations for the CTA database
+# Applies the numbered migrations that have not run yet (tracked in PRAGMA user_version)
+# and prints the EXPLAIN QUERY PLAN of the main command queries before and after,
+# so the switch from full scans to index range scans can be checked
+#
+# Usage: python migrate.py [--db CTA2_L_daily_ridership.db]
+
+import sqlite3
+import argparse
+
+import main
+import dates
+
+# numbered migrations, each one runs once in order
+# 1: covering indexes for the per station date range queries (6, 7, 8), the
+#    type of day totals (2, 3), station name lookups and date range refreshes
+# 2: tables the bulk ingest in ingest.py keeps its deferred indexes/triggers and runs in
+# 3: the years partitions.py has rolled out of Ridership into files of their own
+migrations = [
+    (1, "covering indexes for Ridership", """
+CREATE INDEX IF NOT EXISTS Ridership_Station_Date ON Ridership (Station_ID, Ride_Date, Num_Riders);
+CREATE INDEX IF NOT EXISTS Ridership_Type_Station ON Ridership (Type_Of_Day, Station_ID, Num_Riders);
+CREATE INDEX IF NOT EXISTS Ridership_Date ON Ridership (Ride_Date);
+CREATE INDEX IF NOT EXISTS Stations_Name ON Stations (Station_Name, Station_ID);
+ANALYZE;
+"""),
+    (2, "bookkeeping for the bulk ingest", """
+CREATE TABLE IF NOT EXISTS Ingest_Deferred (
+    Name TEXT PRIMARY KEY,
+    Sql TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS Ingest_Runs (
+    Run_ID INTEGER PRIMARY KEY,
+    Finished TEXT NOT NULL,
+    Source TEXT NOT NULL,
+    Rows_Inserted INTEGER NOT NULL,
+    Rows_Updated INTEGER NOT NULL
+);
+"""),
+    (3, "list of the Ridership year partitions", """
+CREATE TABLE IF NOT EXISTS Ridership_Partitions (
+    Year TEXT PRIMARY KEY,
+    File TEXT NOT NULL,
+    Rows INTEGER NOT NULL,
+    Riders INTEGER NOT NULL,
+    First_Date TEXT NOT NULL,
+    Last_Date TEXT NOT NULL
+);
+"""),
+]
+
+##################################################################
+#
+# sample_queries
+#
+# Given a connection to the CTA database, returns (label, sql, parameters)
+# for the command queries whose plans are shown, using the first station
+# and year in the database as parameters
+#
+def sample_queries(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("SELECT Station_ID, Station_Name FROM Stations ORDER BY Station_ID LIMIT 1;")
+    station = dbCursor.fetchone() or (0, "")
+    dbCursor.execute("SELECT strftime('%Y', MIN(Ride_Date)) FROM Ridership;")
+    year = dbCursor.fetchone()[0] or "2001"
+
+    return [
+        ("command 2 (day types)", main.query_two, (station[1],)),
+        ("command 3 (weekday ranking)", main.query_three_a, ()),
+        ("command 6 (yearly)", main.query_six, (station[0],)),
+        ("command 7 (monthly)", main.query_seven, (station[0],) + dates.year_range(year)),
+        ("command 8 (daily)", main.query_eight, (station[0],) + dates.year_range(year)),
+    ]
+
+##################################################################
+#
+# print_plans
+#
+# Given a connection to the CTA database, prints the EXPLAIN QUERY PLAN
+# of every sample query
+#
+def print_plans(dbConn):
+    dbCursor = dbConn.cursor()
+    for label, sql, params in sample_queries(dbConn):
+        print(" %s" % label)
+        dbCursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+        for row in dbCursor.fetchall():
+            print("   %s" % row[3])
+
+##################################################################
+#
+# migrate
+#
+# Given a connection to the CTA database, applies every migration newer than
+# the database's user_version and returns how many were applied
+#
+def migrate(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("PRAGMA user_version;")
+    version = dbCursor.fetchone()[0]
+    applied = 0
+
+    for number, description, script in migrations:
+        if number <= version:
+            continue
+        print("Applying migration %d: %s" % (number, description))
+        dbConn.executescript("BEGIN;" + script + "PRAGMA user_version = %d; COMMIT;" % number)
+        applied += 1
+
+    return applied
+
+##################################################################
+#
+# main
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply schema migrations to the CTA database")
+    parser.add_argument("--db", default="CTA2_L_daily_ridership.db", help="path to the CTA database")
+    args = parser.parse_args()
+
+    dbConn = sqlite3.connect(args.db, uri=True)
+
+    print("Query plans before:")
+    print_plans(dbConn)
+    print()
+
+    if not migrate(dbConn):
+        print("Database is already up to date")
+    print()
+
+    print("Query plans after:")
+    print_plans(dbConn)
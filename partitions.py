@@ -0,0 +1,460 @@
+# Overview: Year partitions of the Ridership table
+# A finished year can be rolled out of the main database into a file of its own
+# (<database>.ridership-YYYY.db) holding that year's Ridership rows and indexes, listed in
+# Ridership_Partitions. Rolled years are sealed: they are attached read-only and immutable,
+# so SQLite skips locking them and the OS keeps them cached, and the main file only holds
+# the years still changing. The rollups and the stats summary keep every year, so the
+# commands that read them do not change.
+# Queries over a range of days are routed: each year of the range goes to its partition or
+# to the main table, and the results are joined in date order. Partitions are attached when
+# a query needs them, at most as many at a time as SQLite allows (10 by default). Queries
+# over the whole history read the Ridership_History view, a UNION ALL of the main table and
+# every partition, which needs them all attached at once, and queries whose window functions
+# look across the years of a range read the Ridership_Span view of the partitions in that range
+#
+# Usage: python partitions.py --db CTA2_L_daily_ridership.db list
+#        python partitions.py --db CTA2_L_daily_ridership.db roll 2019 [--vacuum]
+#        python partitions.py --db CTA2_L_daily_ridership.db roll --before 2020
+#        python partitions.py --db CTA2_L_daily_ridership.db unroll 2019
+
+import os
+import re
+import sqlite3
+import argparse
+
+import stats
+import dates
+import dbutil
+import migrate
+import rollups
+
+# SQL queries as global constants so that they are not changed
+query_partition_list = "SELECT Year, File FROM Ridership_Partitions ORDER BY Year;"
+query_partition_details = "SELECT Year, File, Rows, Riders, strftime('%Y-%m-%d', First_Date), strftime('%Y-%m-%d', Last_Date) FROM Ridership_Partitions ORDER BY Year;"
+query_partition_add = "INSERT INTO Ridership_Partitions (Year, File, Rows, Riders, First_Date, Last_Date) VALUES (?, ?, ?, ?, ?, ?);"
+query_partition_drop = "DELETE FROM Ridership_Partitions WHERE Year = ?;"
+query_ridership_schema = "SELECT type, sql FROM sqlite_master WHERE tbl_name = 'Ridership' AND type IN ('table', 'index') AND sql IS NOT NULL ORDER BY type DESC;"
+query_year_summary = "SELECT count(*), SUM(Num_Riders), MIN(Ride_Date), MAX(Ride_Date) FROM Ridership WHERE Ride_Date >= ? AND Ride_Date < ?;"
+query_year_years = "SELECT DISTINCT strftime('%Y', Ride_Date) FROM Ridership WHERE Ride_Date < ? ORDER BY 1;"
+query_year_copy = "INSERT INTO part_new.Ridership SELECT * FROM main.Ridership WHERE Ride_Date >= ? AND Ride_Date < ? ORDER BY Station_ID, Ride_Date;"
+query_year_restore = "INSERT INTO main.Ridership SELECT * FROM part_old.Ridership;"
+query_year_delete = "DELETE FROM main.Ridership WHERE Ride_Date >= ? AND Ride_Date < ?;"
+query_stats_save = "SELECT Num_Entries, Earliest_Date, Latest_Date, Total_Riders, Dirty FROM Stats_Summary WHERE Id = 1;"
+query_stats_restore = "UPDATE Stats_Summary SET Num_Entries = ?, Earliest_Date = ?, Latest_Date = ?, Total_Riders = ?, Dirty = ? WHERE Id = 1;"
+query_stale_clear = "DELETE FROM Rollup_Stale WHERE substr(Month, 1, 4) = ?;"
+
+# attached partitions are named this and their year
+SCHEMA_PREFIX = "part_"
+
+# view over the main table and every partition
+HISTORY_VIEW = "Ridership_History"
+
+# view over the main table and the partitions of one range of days
+SPAN_VIEW = "Ridership_Span"
+
+# the Ridership table as it is named in the queries
+table_name = re.compile(r"\bRidership\b")
+
+##################################################################
+#
+# PartitionError
+#
+# A partition that cannot be rolled, unrolled or read, a ValueError so
+# that the commands report it as they do a bad input
+#
+class PartitionError(ValueError):
+    pass
+
+##################################################################
+#
+# partition_file
+#
+# Given the path of the main database and a year, returns the file that
+# year's partition is kept in
+#
+def partition_file(path, year):
+    return "%s.ridership-%s.db" % (os.path.splitext(path)[0], year)
+
+##################################################################
+#
+# partition_files
+#
+# Given a connection to the CTA database, returns year -> file of every
+# rolled year, empty for a database that has no partitions
+#
+def partition_files(dbConn):
+    try:
+        dbCursor = dbConn.cursor()
+        dbCursor.execute(query_partition_list)
+        rows = dbCursor.fetchall()
+    except sqlite3.OperationalError:
+        # the partition list has not been created
+        return {}
+    if not rows:
+        return {}
+
+    # files are kept relative to the main database
+    folder = os.path.dirname(dbutil.database_key(dbConn))
+    return {year: os.path.join(folder, path) for year, path in rows}
+
+##################################################################
+#
+# attach
+#
+# Given a connection, the years whose partitions a query needs and their
+# files, attaches the ones not attached yet (read-only and immutable) and
+# returns year -> schema name. Attached partitions the query does not need
+# are detached first when SQLite's limit on attached databases would be passed
+# The partitions are attached as file: URIs, which SQLite only reads as such
+# on connections opened with uri=True
+#
+def attach(dbConn, years, files):
+    schemas = {year: SCHEMA_PREFIX + year for year in years}
+
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("PRAGMA database_list;")
+    names = [row[1] for row in dbCursor.fetchall()]
+    missing = [year for year in years if schemas[year] not in names]
+    if not missing:
+        return schemas
+
+    # main and temp do not count towards the limit
+    attached = [name for name in names if name.startswith(SCHEMA_PREFIX)]
+    room = dbConn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED) - sum(1 for name in names if name not in ("main", "temp") and name not in attached)
+    if len(schemas) > room:
+        raise PartitionError("%d partitions are needed at once, SQLite can only attach %d" % (len(schemas), room))
+
+    spare = [name for name in attached if name not in schemas.values()]
+    while len(attached) + len(missing) > room:
+        name = spare.pop()
+        dbCursor.execute("DETACH DATABASE %s;" % name)
+        attached.remove(name)
+
+    for year in missing:
+        if not os.path.exists(files[year]):
+            raise PartitionError("the %s partition %s is missing" % (year, files[year]))
+        uri = "file:%s?mode=ro&immutable=1" % os.path.abspath(files[year]).replace("%", "%25").replace("?", "%3f").replace("#", "%23")
+        dbCursor.execute("ATTACH DATABASE ? AS %s;" % schemas[year], (uri,))
+    return schemas
+
+##################################################################
+#
+# plan
+#
+# Given a connection and a half-open range of days, returns the pieces of
+# the range in date order as (year, start, end), year being the partition
+# that piece is read from or None for the main table
+#
+def plan(dbConn, start, end, files=None):
+    files = partition_files(dbConn) if files is None else files
+    if not files or not start or start >= end:
+        return [(None, start, end)]
+
+    pieces = []
+    last = int(end[0:4]) - (1 if end[5:10] == "01-01" else 0)
+    for year in range(int(start[0:4]), last + 1):
+        year_start, year_end = dates.year_range(year)
+        piece = (str(year) if str(year) in files else None, max(start, year_start), min(end, year_end))
+
+        # years in the main table are read together
+        if piece[0] is None and pieces and pieces[-1][0] is None:
+            pieces[-1] = (None, pieces[-1][1], piece[2])
+        else:
+            pieces.append(piece)
+    return pieces
+
+##################################################################
+#
+# segments
+#
+# Given a connection, a query over Ridership taking a range of days as its
+# last two parameters and that range, yields (query, start, end) for every
+# piece of the range, the query rewritten to read the piece's partition.
+# Each partition is attached when its piece comes up, so a range can cover
+# more partitions than can be attached at once as long as every piece is
+# read before the next one is asked for
+#
+def segments(dbConn, sql, start, end):
+    files = partition_files(dbConn)
+    for year, piece_start, piece_end in plan(dbConn, start, end, files):
+        if year:
+            schemas = attach(dbConn, [year], files)
+            yield table_name.sub(schemas[year] + ".Ridership", sql), piece_start, piece_end
+        else:
+            yield sql, piece_start, piece_end
+
+##################################################################
+#
+# fetchall
+#
+# Given a connection, a query over a range of days, the parameters before
+# the range and the range, returns the rows of every piece of the range
+# joined in date order. fetch(dbConn, sql, parameters) runs each piece,
+# e.g. resultcache.fetchall, by default a plain cursor
+#
+def fetchall(dbConn, sql, parameters, start, end, fetch=None):
+    rows = []
+    for piece_sql, piece_start, piece_end in segments(dbConn, sql, start, end):
+        if fetch:
+            rows += fetch(dbConn, piece_sql, tuple(parameters) + (piece_start, piece_end))
+        else:
+            dbCursor = dbConn.cursor()
+            dbCursor.execute(piece_sql, tuple(parameters) + (piece_start, piece_end))
+            rows += dbCursor.fetchall()
+    return rows
+
+##################################################################
+#
+# each_partition
+#
+# Given a connection and a query over Ridership, yields (year, query) with
+# the query rewritten to read each partition in turn, oldest first, each one
+# attached when its turn comes
+#
+def each_partition(dbConn, sql):
+    files = partition_files(dbConn)
+    for year in sorted(files):
+        schemas = attach(dbConn, [year], files)
+        yield year, table_name.sub(schemas[year] + ".Ridership", sql)
+
+##################################################################
+#
+# history
+#
+# Given a connection and a query over Ridership, returns the query reading
+# the whole history: unchanged without partitions, otherwise rewritten to
+# the Ridership_History view of the main table and every partition
+#
+def history(dbConn, sql):
+    files = partition_files(dbConn)
+    if not files:
+        return sql
+
+    try:
+        schemas = attach(dbConn, sorted(files), files)
+    except PartitionError as error:
+        raise PartitionError("%s, the whole history can only be read from the rollups (refresh them)" % error)
+    return table_name.sub(union_view(dbConn, HISTORY_VIEW, schemas), sql)
+
+##################################################################
+#
+# span
+#
+# Given a connection, a query over Ridership and the half-open range of days
+# it reads, returns the query reading the Ridership_Span view of the main
+# table and the partitions of that range, unchanged when the range has none.
+# Unlike segments, the whole range is read by one query, for queries whose
+# window functions look across the years
+#
+def span(dbConn, sql, start, end):
+    files = partition_files(dbConn)
+    years = [year for year, piece_start, piece_end in plan(dbConn, start, end, files) if year]
+    if not years:
+        return sql
+    return table_name.sub(union_view(dbConn, SPAN_VIEW, attach(dbConn, years, files)), sql)
+
+##################################################################
+#
+# union_view
+#
+# Given a connection, a view name and year -> schema of attached partitions,
+# makes the view a TEMP UNION ALL of the main table and those partitions and
+# returns its name. The view is only replaced when the partitions change
+#
+def union_view(dbConn, name, schemas):
+    view = "CREATE TEMP VIEW %s AS SELECT * FROM main.Ridership" % name
+    view += "".join(" UNION ALL SELECT * FROM %s.Ridership" % schemas[year] for year in sorted(schemas))
+
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("SELECT sql FROM temp.sqlite_master WHERE name = ?;", (name,))
+    current = dbCursor.fetchone()
+    if not current or current[0] != view:
+        dbCursor.execute("DROP VIEW IF EXISTS temp.%s;" % name)
+        dbCursor.execute(view + ";")
+    return name
+
+##################################################################
+#
+# detach_all
+#
+# Given a connection, detaches every partition and drops the history view,
+# before partitions are rolled or unrolled
+#
+def detach_all(dbConn):
+    dbCursor = dbConn.cursor()
+    for view in [HISTORY_VIEW, SPAN_VIEW]:
+        dbCursor.execute("DROP VIEW IF EXISTS temp.%s;" % view)
+    dbCursor.execute("PRAGMA database_list;")
+    for name in [row[1] for row in dbCursor.fetchall() if row[1].startswith(SCHEMA_PREFIX)]:
+        dbCursor.execute("DETACH DATABASE %s;" % name)
+
+##################################################################
+#
+# keep_summaries
+#
+# Given a cursor inside the transaction moving a year's rows, the year and
+# the stats saved before, puts back the stats and drops the rollup months
+# the move queued: the rows only changed file, so both still hold
+#
+def keep_summaries(dbCursor, year, saved):
+    if saved:
+        dbCursor.execute(query_stats_restore, saved)
+    dbCursor.execute(query_stale_clear, (year,))
+
+##################################################################
+#
+# roll_year
+#
+# Given a connection to the CTA database and a finished year, moves that
+# year's Ridership rows into a partition file of their own and returns how
+# many rows were moved. VACUUM afterwards gives the space back to the disk
+#
+def roll_year(dbConn, year, vacuum=False):
+    path = dbutil.database_key(dbConn)
+    if not isinstance(path, str):
+        raise PartitionError("an in-memory database cannot be partitioned")
+    year = str(year).strip()
+    start, end = dates.year_range(year)
+    if not start:
+        raise PartitionError("%s is not a year" % year)
+
+    migrate.migrate(dbConn)
+    if year in partition_files(dbConn):
+        raise PartitionError("%s is already rolled" % year)
+
+    # the latest year is still getting new days
+    latest = stats.load_stats(dbConn)[4]
+    if latest and year >= latest[0:4]:
+        raise PartitionError("%s is not finished yet, only years before %s can be rolled" % (year, latest[0:4]))
+
+    # the rollups must hold the year before its rows leave the main table
+    rollups.refresh_rollups(dbConn)
+
+    dbCursor = dbConn.cursor()
+    dbCursor.execute(query_year_summary, (start, end))
+    rows, riders, first, last = dbCursor.fetchone()
+    if not rows:
+        raise PartitionError("there is no ridership in %s" % year)
+
+    # build the partition next to its final name, with the main table's schema
+    detach_all(dbConn)
+    target = partition_file(path, year)
+    building = target + ".tmp"
+    if os.path.exists(building):
+        os.remove(building)
+    dbCursor.execute(query_ridership_schema)
+    schema = dbCursor.fetchall()
+    partConn = sqlite3.connect(building)
+    with partConn:
+        for kind, sql in schema:
+            partConn.execute(sql)
+    partConn.close()
+
+    dbCursor.execute("ATTACH DATABASE ? AS part_new;", (building,))
+    try:
+        with dbConn:
+            dbCursor.execute(query_year_copy, (start, end))
+    finally:
+        dbCursor.execute("DETACH DATABASE part_new;")
+
+    partConn = sqlite3.connect(building)
+    partConn.execute("ANALYZE;")
+    partConn.commit()
+    partConn.close()
+    os.replace(building, target)
+
+    # listing it and taking its rows out of the main table is one transaction
+    with dbConn:
+        dbCursor.execute(query_stats_save)
+        saved = dbCursor.fetchone()
+        dbCursor.execute(query_partition_add, (year, os.path.basename(target), rows, riders, first, last))
+        dbCursor.execute(query_year_delete, (start, end))
+        keep_summaries(dbCursor, year, saved)
+
+    if vacuum:
+        dbCursor.execute("VACUUM;")
+    return rows
+
+##################################################################
+#
+# unroll_year
+#
+# Given a connection to the CTA database and a rolled year, moves its rows
+# back into the main table, e.g. to correct them, and deletes the partition
+# Returns how many rows were moved
+#
+def unroll_year(dbConn, year):
+    year = str(year).strip()
+    files = partition_files(dbConn)
+    if year not in files:
+        raise PartitionError("%s is not rolled" % year)
+
+    detach_all(dbConn)
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("ATTACH DATABASE ? AS part_old;", (files[year],))
+    try:
+        with dbConn:
+            dbCursor.execute(query_stats_save)
+            saved = dbCursor.fetchone()
+            dbCursor.execute(query_year_restore)
+            rows = dbCursor.rowcount
+            dbCursor.execute(query_partition_drop, (year,))
+            keep_summaries(dbCursor, year, saved)
+    finally:
+        dbCursor.execute("DETACH DATABASE part_old;")
+
+    os.remove(files[year])
+    return rows
+
+##################################################################
+#
+# main
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Roll finished years of Ridership into partition files")
+    parser.add_argument("--db", default="CTA2_L_daily_ridership.db", help="path to the CTA database")
+    parser.add_argument("action", choices=["list", "roll", "unroll"], help="list the partitions, roll years into them or move a year back")
+    parser.add_argument("years", nargs="*", help="years to roll or unroll")
+    parser.add_argument("--before", type=int, help="roll every year before this one that is still in the main table")
+    parser.add_argument("--vacuum", action="store_true", help="shrink the main database file after rolling")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        parser.error("no database at %s" % args.db)
+    dbConn = sqlite3.connect(args.db, uri=True)
+    years = list(args.years)
+
+    try:
+        if args.action == "roll" and args.before:
+            dbCursor = dbConn.cursor()
+            dbCursor.execute(query_year_years, (dates.year_range(args.before)[0],))
+            years += [row[0] for row in dbCursor.fetchall()]
+        if args.action != "list" and not years:
+            parser.error("give the years to %s" % args.action)
+
+        for year in years:
+            if args.action == "roll":
+                rows = roll_year(dbConn, year)
+                print("Rolled %s ridership rows of %s into %s" % (f"{rows:,}", year, os.path.basename(partition_file(args.db, year))))
+            elif args.action == "unroll":
+                rows = unroll_year(dbConn, year)
+                print("Moved %s ridership rows of %s back to the main table" % (f"{rows:,}", year))
+
+        if args.action == "roll" and args.vacuum:
+            dbConn.execute("VACUUM;")
+    except PartitionError as error:
+        print("**%s" % error)
+        raise SystemExit(1)
+
+    print("Ridership Partitions")
+    details = []
+    try:
+        dbCursor = dbConn.cursor()
+        dbCursor.execute(query_partition_details)
+        details = dbCursor.fetchall()
+    except sqlite3.OperationalError:
+        pass
+    if not details:
+        print("  none, every year is in the main table")
+    for year, path, rows, riders, first, last in details:
+        print("  %s : %s rows, %s riders, %s - %s (%s)" % (year, f"{rows:,}", f"{riders:,}", first, last, path))
@@ -0,0 +1,334 @@
+# Overview: Renders the charts of commands 6-9 and the station comparison
+# matplotlib is only imported the first time something is plotted. Charts saved to a
+# file are drawn on one reusable Figure with the Agg canvas, so batch runs never touch
+# pyplot; charts shown on screen go through pyplot, which is switched to the
+# non-interactive Agg backend when there is no display to show them on.
+# Windows on screen do not block: the prompt comes back as soon as the chart is drawn, the
+# window stays open until the user closes it, and read_line keeps open windows responsive
+# while the interactive prompts wait for a line.
+# Daily series longer than the chart is wide are downsampled before drawing: the days
+# are split into buckets and only each bucket's lowest and highest day are kept, so
+# peaks and dips survive while the points drawn stay around the width in pixels
+
+import os
+import sys
+import math
+import builtins
+
+import instrument
+
+# extent of the map of Chicago used by plot_nearby
+map_file = "chicago.png"
+map_extent = [-87.9277, -87.5569, 41.7012, 42.0868]
+
+# most lines a chart labels in its legend
+LEGEND_LINES = 12
+
+# most points drawn per daily series, None for the chart's width in pixels,
+# 0 to draw every point
+max_points = None
+
+# seconds the open windows' events are handled for between checks of the keyboard
+EVENT_SECONDS = 0.05
+
+# loaded on first use
+_pyplot = None
+_figure = None
+_map_image = None
+
+##################################################################
+#
+# configure
+#
+# Sets the most points drawn per daily series: None for the chart's width
+# in pixels, 0 to turn downsampling off
+#
+def configure(points=None):
+    global max_points
+    max_points = points
+
+##################################################################
+#
+# has_display
+#
+# Returns True if windows can be opened, i.e. not on a headless server
+#
+def has_display():
+    if sys.platform in ("win32", "darwin"):
+        return True
+    return bool(os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"))
+
+##################################################################
+#
+# pyplot
+#
+# Returns matplotlib.pyplot, importing it the first time
+# Without a display (and no MPLBACKEND chosen) it uses the Agg backend
+#
+def pyplot():
+    global _pyplot
+    if _pyplot is None:
+        import matplotlib
+        if not has_display() and not os.environ.get("MPLBACKEND"):
+            matplotlib.use("Agg")
+        import matplotlib.pyplot
+        _pyplot = matplotlib.pyplot
+    return _pyplot
+
+##################################################################
+#
+# file_figure
+#
+# Returns the Figure reused for every chart saved to a file, cleared
+#
+def file_figure():
+    global _figure
+    if _figure is None:
+        from matplotlib.figure import Figure
+        _figure = Figure()
+    _figure.clear()
+    return _figure
+
+##################################################################
+#
+# map_image
+#
+# Returns the map of Chicago, read from disk the first time
+#
+def map_image():
+    global _map_image
+    if _map_image is None:
+        import matplotlib.image
+        _map_image = matplotlib.image.imread(map_file)
+    return _map_image
+
+##################################################################
+#
+# gaps
+#
+# Returns the values with None (no data that day) as NaN, which
+# matplotlib leaves a gap for
+#
+def gaps(values):
+    return [math.nan if value is None else value for value in values]
+
+##################################################################
+#
+# minmax_indices
+#
+# Given a NumPy array of values (NaN for no data) and the most points to
+# keep, returns the sorted positions of the lowest and highest value in each
+# of points // 2 equal buckets. A bucket without data keeps its first
+# position so the gap stays visible
+#
+def minmax_indices(values, points):
+    import numpy as np
+
+    buckets = max(1, points // 2)
+    size = -(-len(values) // buckets)
+    buckets = -(-len(values) // size)
+    padded = np.full(buckets * size, np.nan)
+    padded[:len(values)] = values
+    padded = padded.reshape(buckets, size)
+
+    # NaN never wins, an empty bucket gives position 0 for both
+    missing = np.isnan(padded)
+    lowest = np.argmin(np.where(missing, np.inf, padded), axis=1)
+    highest = np.argmax(np.where(missing, -np.inf, padded), axis=1)
+
+    # both in day order, the second only when it is another day
+    pairs = np.sort(np.stack([lowest, highest], axis=1), axis=1) + (np.arange(buckets) * size)[:, None]
+    keep = np.ones(pairs.shape, bool)
+    keep[:, 1] = pairs[:, 1] != pairs[:, 0]
+    return pairs[keep]
+
+##################################################################
+#
+# downsample
+#
+# Given the axes a daily series is drawn on, its x values and its values
+# (None for no data), returns the x values and values to draw: all of them
+# when the series fits in max_points (or the axes' width in pixels),
+# otherwise the min/max of each bucket, with None as NaN
+#
+def downsample(axes, xs, values):
+    points = max_points if max_points is not None else int(axes.bbox.width)
+    if not points or len(values) <= points:
+        return xs, gaps(values)
+
+    import numpy as np
+
+    values = np.array(gaps(values), np.float64)
+    kept = minmax_indices(values, points)
+    return np.asarray(xs)[kept], values[kept]
+
+##################################################################
+#
+# begin
+#
+# Returns the axes to draw a new chart on, the shared file figure when
+# the chart goes to filename, otherwise a fresh pyplot figure in a window
+# of its own, next to the ones still open
+#
+def begin(filename=None):
+    if filename:
+        return file_figure().add_subplot()
+
+    return pyplot().figure().add_subplot()
+
+##################################################################
+#
+# finish
+#
+# Saves the chart to filename (the format follows its extension),
+# or shows it on screen without waiting for its window to be closed
+#
+def finish(axes, filename=None):
+    if filename:
+        axes.figure.savefig(filename)
+        return
+
+    plt = pyplot()
+    if plt.get_backend().lower() == "agg":
+        plt.close(axes.figure)
+        print("**No display to show the plot on...")
+        print()
+        return
+    plt.show(block=False)
+    axes.figure.canvas.draw_idle()
+    handle_events(0.001)
+
+##################################################################
+#
+# windows_open
+#
+# Returns True if a chart window is open on screen
+#
+def windows_open():
+    return _pyplot is not None and bool(_pyplot.get_fignums())
+
+##################################################################
+#
+# handle_events
+#
+# Lets the open chart windows redraw, resize and close for the given
+# seconds. Returns False when no window is open
+#
+def handle_events(seconds):
+    if not windows_open():
+        return False
+    _pyplot.gcf().canvas.start_event_loop(seconds)
+    return True
+
+##################################################################
+#
+# read_line
+#
+# Shows the prompt and returns the line typed, like input(), handling the
+# open chart windows' events while waiting so they stay responsive
+# Only a terminal can be watched for a line this way, anything else (and
+# a terminal with no window open) is read with input()
+#
+def read_line(prompt=""):
+    if not windows_open() or sys.platform == "win32" or not sys.stdin.isatty():
+        return builtins.input(prompt)
+
+    import select
+
+    sys.stdout.write(prompt)
+    sys.stdout.flush()
+    while not select.select([sys.stdin], [], [], 0)[0]:
+        if not handle_events(EVENT_SECONDS):
+            break
+
+    line = sys.stdin.readline()
+    if not line:
+        raise EOFError
+    return line.rstrip("\n")
+
+##################################################################
+#
+# plot_yearly
+#
+# Plots the yearly ridership of a station
+#
+@instrument.timed("plot")
+def plot_yearly(station_name, years_list, totals_list, filename=None):
+    axes = begin(filename)
+    axes.plot(years_list,totals_list)
+    axes.set_xlabel('Year')
+    axes.set_ylabel('Number of Riders')
+    axes.set_title('Yearly Ridership At %s Station' %(station_name,))
+    finish(axes, filename)
+
+##################################################################
+#
+# plot_monthly
+#
+# Plots the monthly ridership of a station for one year
+#
+@instrument.timed("plot")
+def plot_monthly(station_name, year, month_list, totals_list, filename=None):
+    axes = begin(filename)
+    axes.plot(month_list,totals_list)
+    axes.set_xlabel('Month')
+    axes.set_ylabel('Number of Riders')
+    axes.set_title('Monthly Ridership At %s Station (%s)' %(station_name,year))
+    finish(axes, filename)
+
+##################################################################
+#
+# plot_daily
+#
+# Plots the daily ridership of two stations over one year, aligned by day
+#
+@instrument.timed("plot")
+def plot_daily(year, days, station_one_name, station_one_riders, station_two_name, station_two_riders, filename=None):
+    axes = begin(filename)
+    axes.plot(*downsample(axes, days, station_one_riders), label = station_one_name, color = 'blue')
+    axes.plot(*downsample(axes, days, station_two_riders), label = station_two_name, color = 'orange')
+
+    axes.set_xlabel('Day')
+    axes.set_ylabel('Number of Riders')
+    axes.set_title("Ridership Each Day of %s" %(year))
+    axes.legend()
+    finish(axes, filename)
+
+##################################################################
+#
+# plot_compare
+#
+# Plots the daily ridership of any number of stations, one line each,
+# None values leaving a gap
+#
+@instrument.timed("plot")
+def plot_compare(days, names, columns, filename=None):
+    axes = begin(filename)
+    for name, column in zip(names, columns):
+        axes.plot(*downsample(axes, range(1, len(days) + 1), column), label = name)
+
+    axes.set_xlabel('Day')
+    axes.set_ylabel('Number of Riders')
+    axes.set_title("Ridership Each Day From %s To %s" %(days[0], days[-1]))
+    # a legend for more than a dozen lines would cover the chart
+    if len(names) <= LEGEND_LINES:
+        axes.legend()
+    finish(axes, filename)
+
+##################################################################
+#
+# plot_nearby
+#
+# Plots (station name, latitude, longitude) rows on the map of Chicago
+#
+@instrument.timed("plot")
+def plot_nearby(result, filename=None):
+    axes = begin(filename)
+    axes.imshow(map_image(), extent=map_extent)
+    axes.set_title("Stations Near You")
+    # add the data to the graph
+    for row in result:
+        axes.annotate(row[0], (row[2], row[1]), textcoords="offset points", xytext=(0, 5), ha='center')
+    axes.set_xlim(map_extent[0:2])
+    axes.set_ylim(map_extent[2:4])
+    finish(axes, filename)
@@ -0,0 +1,251 @@
+# Overview: Yearly and monthly ridership reports for many stations at once
+# The reports of commands 6 and 7 are split into a work list, one yearly report per station
+# and one monthly report per (station, year), and handed out to a pool of worker processes.
+# Every worker opens its own read-only connection, so the workers never wait on each other,
+# and renders the tables (and plots, when asked for) itself. The parent brings the rollups
+# and the columnar snapshot up to date once before starting, then writes the reports in
+# work list order, so the output is the same for any number of workers
+#
+# Usage: python reports.py --db CTA2_L_daily_ridership.db [--stations "Clark%" "line:Red"] [--years 2019-2020]
+#                          [--workers 8] [--plot png --plot-dir reports] [--output report.txt]
+
+import os
+import sys
+import time
+import pathlib
+import sqlite3
+import argparse
+import multiprocessing
+
+import main
+import stats
+import engines
+import rollups
+import plotting
+import resultcache
+import comparison
+
+# SQL queries as global constants so that they are not changed
+query_all_stations = "SELECT Station_ID, Station_Name FROM Stations ORDER BY Station_Name ASC, Station_ID ASC;"
+
+# plot formats that can be asked for with --plot
+plot_formats = ["png", "svg"]
+
+# reports handed to a worker at a time
+CHUNK_REPORTS = 8
+
+# the worker's connection and settings, set up by start_worker
+_dbConn = None
+_plot = None
+_plot_dir = "."
+
+##################################################################
+#
+# ReportError
+#
+# Reports that cannot be made, e.g. a year range that is not valid
+#
+class ReportError(Exception):
+    pass
+
+##################################################################
+#
+# read_only_uri
+#
+# Returns the URI opening the database at path read-only
+#
+def read_only_uri(path):
+    return pathlib.Path(path).resolve().as_uri() + "?mode=ro"
+
+##################################################################
+#
+# parse_years
+#
+# Given a connection and a year range ("2019", "2015-2019" or blank for
+# every year with data), returns the years as a list of strings
+#
+def parse_years(dbConn, text=""):
+    text = str(text or "").strip()
+    if not text:
+        earliest, latest = stats.load_stats(dbConn)[3:5]
+        if not earliest:
+            return []
+        first, last = earliest[:4], latest[:4]
+    else:
+        first, _, last = text.partition("-")
+        last = last or first
+
+    try:
+        first, last = int(first), int(last)
+    except ValueError:
+        raise ReportError("years must be a year or a range like 2015-2019")
+    if first > last:
+        raise ReportError("the first year comes after the last")
+    return [str(year) for year in range(first, last + 1)]
+
+##################################################################
+#
+# work_list
+#
+# Given a connection, station entries (names, patterns or line:color, none
+# for every station) and years, returns the reports to make in output order:
+# (station id, station name, None) for a yearly report followed by
+# (station id, station name, year) for each monthly report
+#
+def work_list(dbConn, entries, years):
+    if entries:
+        stations, unmatched = comparison.select_stations(dbConn, entries)
+        if unmatched:
+            raise ReportError("no stations found for %s" % ", ".join(unmatched))
+    else:
+        dbCursor = dbConn.cursor()
+        dbCursor.execute(query_all_stations)
+        stations = dbCursor.fetchall()
+
+    tasks = []
+    for station_id, station_name in stations:
+        tasks.append((station_id, station_name, None))
+        tasks += [(station_id, station_name, year) for year in years]
+    return tasks
+
+##################################################################
+#
+# start_worker
+#
+# Runs once in every worker process: opens its read-only connection and
+# takes on the parent's engine and plot settings
+#
+def start_worker(db_path, engine, plot, plot_dir):
+    global _dbConn, _plot, _plot_dir
+    engines.set_engine(engine)
+    # every report is read once, caching them would only use memory
+    resultcache.configure(0)
+    _dbConn = sqlite3.connect(read_only_uri(db_path), uri=True)
+    _plot = plot
+    _plot_dir = plot_dir
+
+##################################################################
+#
+# plot_file
+#
+# Returns the file a report's plot is written to, or None without --plot
+#
+def plot_file(station_id, station_name, year):
+    if not _plot:
+        return None
+    slug = "".join(c if c.isalnum() else "-" for c in station_name).strip("-")
+    return os.path.join(_plot_dir, "%s-%s-%s.%s" % (station_id, slug, year or "yearly", _plot))
+
+##################################################################
+#
+# render
+#
+# Makes one report on the worker's connection and returns its text, the
+# same table command 6 or 7 prints, or None for a year without data
+#
+def render(task):
+    station_id, station_name, year = task
+    plot = plot_file(station_id, station_name, year)
+
+    if year is None:
+        yearly = main.yearly_ridership(_dbConn, station_id)
+        lines = ["Yearly Ridership at %s" % station_name]
+        lines += ["%s : %s" % (row[0], f"{row[1]:,}") for row in yearly]
+        if plot and yearly:
+            plotting.plot_yearly(station_name, [row[0] for row in yearly], [row[1] for row in yearly], plot)
+        return "\n".join(lines)
+
+    monthly = main.monthly_ridership(_dbConn, station_id, year)
+    if not monthly:
+        return None
+    lines = ["Monthly Ridership at %s for %s" % (station_name, year)]
+    lines += ["%s : %s" % (row[1], f"{row[2]:,}") for row in monthly]
+    if plot:
+        plotting.plot_monthly(station_name, year, [row[0] for row in monthly], [row[2] for row in monthly], plot)
+    return "\n".join(lines)
+
+##################################################################
+#
+# prepare
+#
+# Given a writable connection, brings the rollups (and the columnar snapshot
+# for the numpy engine) up to date, so the workers only ever read
+#
+def prepare(dbConn):
+    try:
+        rollups.refresh_rollups(dbConn)
+    except sqlite3.OperationalError:
+        # read only database, the reports use the raw tables
+        pass
+    if engines.use_numpy():
+        engines.snapshot(dbConn)
+
+##################################################################
+#
+# run_reports
+#
+# Given the database path, the work list, the number of worker processes
+# and an output stream, makes every report and writes them in work list
+# order. progress(done, total) is called as reports come back
+# Returns the number of reports written
+#
+def run_reports(db_path, tasks, out, workers=None, plot=None, plot_dir=".", progress=None):
+    workers = max(1, min(workers or os.cpu_count() or 1, len(tasks) or 1))
+    settings = (db_path, engines.current, plot, plot_dir)
+    if plot:
+        os.makedirs(plot_dir, exist_ok=True)
+
+    written = 0
+    with multiprocessing.Pool(workers, initializer=start_worker, initargs=settings) as pool:
+        # imap hands back the reports in the order of the work list
+        for done, text in enumerate(pool.imap(render, tasks, CHUNK_REPORTS), 1):
+            if text is not None:
+                out.write(text + "\n\n")
+                written += 1
+            if progress:
+                progress(done, len(tasks))
+
+    return written
+
+##################################################################
+#
+# main
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Yearly and monthly ridership reports for many stations, in parallel")
+    parser.add_argument("--db", default="CTA2_L_daily_ridership.db", help="path to the CTA database")
+    parser.add_argument("--stations", nargs="*", default=[], help="station names, wildcard patterns or line:color (default every station)")
+    parser.add_argument("--years", default="", help="year or range of years of the monthly reports, e.g. 2015-2019 (default every year)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes, each with its own read-only connection")
+    parser.add_argument("--engine", choices=engines.names, default="sqlite", help="backend the ridership aggregations run on")
+    parser.add_argument("--plot", choices=plot_formats, help="also plot every report to a file of this format")
+    parser.add_argument("--plot-dir", default=".", help="directory the plots are written to")
+    parser.add_argument("--output", metavar="FILE", help="write the reports to FILE instead of stdout")
+    args = parser.parse_args()
+
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if not os.path.exists(args.db):
+        parser.error("no database at %s" % args.db)
+
+    engines.set_engine(args.engine)
+    dbConn = sqlite3.connect(args.db, uri=True)
+    prepare(dbConn)
+    try:
+        tasks = work_list(dbConn, args.stations, parse_years(dbConn, args.years))
+    except ReportError as error:
+        print("**%s" % error, file=sys.stderr)
+        raise SystemExit(1)
+    dbConn.close()
+
+    def report(done, total):
+        if done == total or done % 100 == 0:
+            print("\r  %s of %s reports" % (f"{done:,}", f"{total:,}"), end="", file=sys.stderr, flush=True)
+
+    out = open(args.output, "w") if args.output else sys.stdout
+    start = time.perf_counter()
+    written = run_reports(args.db, tasks, out, args.workers, args.plot, args.plot_dir, report)
+    out.flush()
+
+    print(file=sys.stderr)
+    print("Wrote %s reports in %.1f seconds" % (f"{written:,}", time.perf_counter() - start), file=sys.stderr)
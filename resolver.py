@@ -0,0 +1,135 @@
+# Overview: In-memory station name resolver
+# Station names are loaded once per database and kept sorted, so the partial names
+# users type (with the SQL LIKE wildcards _ and %) are answered without a query:
+# exact names through a dictionary, prefixes through a binary search and any other
+# pattern through a regular expression. Recent answers are kept in an LRU
+
+import re
+import bisect
+import threading
+import collections
+
+import dbutil
+
+# SQL queries as global constants so that they are not changed
+query_station_names = "SELECT DISTINCT Station_ID, Station_Name FROM Stations ORDER BY Station_Name ASC, Station_ID ASC;"
+
+# number of recent lookups remembered
+LRU_SIZE = 256
+
+# LIKE only ignores the case of ASCII letters
+ascii_lower = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+# one resolver per database file
+_resolvers = {}
+
+##################################################################
+#
+# fold
+#
+# Given a name or pattern, returns it with ASCII letters lowercased the
+# way SQLite's LIKE compares them
+#
+def fold(text):
+    return text.translate(ascii_lower)
+
+##################################################################
+#
+# StationResolver
+#
+# Sorted (station id, station name) pairs answering LIKE style lookups,
+# plus the id <-> name mapping
+#
+class StationResolver:
+    def __init__(self, rows):
+        # stations in Station_Name order, the order results are returned in
+        self.stations = sorted(rows, key=lambda row: (row[1], row[0]))
+        self.names = {}
+        self.ids = {}
+        self.exact = {}
+        for row in self.stations:
+            self.names[row[0]] = row[1]
+            self.ids.setdefault(row[1], []).append(row[0])
+            self.exact.setdefault(fold(row[1]), []).append(row)
+
+        # folded names sorted for prefix searches, with the stations they belong to
+        folded = sorted((fold(row[1]), position) for position, row in enumerate(self.stations))
+        self.folded_names = [item[0] for item in folded]
+        self.folded_positions = [item[1] for item in folded]
+
+        self.recent = collections.OrderedDict()
+        self.recent_lock = threading.Lock()
+
+    ##################################################################
+    #
+    # lookup
+    #
+    # Given a station name pattern with the wildcards _ and %, returns a
+    # tuple of (station id, station name) for every match in name order,
+    # the same rows a LIKE query over Stations would give
+    #
+    def lookup(self, pattern):
+        # recently answered
+        with self.recent_lock:
+            if pattern in self.recent:
+                self.recent.move_to_end(pattern)
+                return self.recent[pattern]
+
+        key = fold(pattern)
+        stem = key.rstrip("%")
+
+        # no wildcards, exact match
+        if "%" not in key and "_" not in key:
+            result = tuple(self.exact.get(key, ()))
+        # only trailing %, prefix match
+        elif "%" not in stem and "_" not in stem:
+            low = bisect.bisect_left(self.folded_names, stem)
+            high = low
+            while high < len(self.folded_names) and self.folded_names[high].startswith(stem):
+                high += 1
+            result = tuple(self.stations[position] for position in sorted(self.folded_positions[low:high]))
+        # general pattern
+        else:
+            regex = re.compile("".join(".*" if c == "%" else "." if c == "_" else re.escape(c) for c in key), re.DOTALL)
+            result = tuple(row for row in self.stations if regex.fullmatch(fold(row[1])))
+
+        # remember the answer, dropping the least recently used
+        with self.recent_lock:
+            self.recent[pattern] = result
+            if len(self.recent) > LRU_SIZE:
+                self.recent.popitem(last=False)
+
+        return result
+
+    # station name for a station id, or None
+    def name_of(self, station_id):
+        return self.names.get(station_id)
+
+    # station ids with exactly this name
+    def ids_of(self, station_name):
+        return list(self.ids.get(station_name, ()))
+
+##################################################################
+#
+# get_resolver
+#
+# Given a connection to the CTA database, returns its station resolver,
+# loading the station names the first time it is asked for
+#
+def get_resolver(dbConn):
+    key = dbutil.database_key(dbConn)
+    if key not in _resolvers:
+        dbCursor = dbConn.cursor()
+        dbCursor.execute(query_station_names)
+        _resolvers[key] = StationResolver(dbCursor.fetchall())
+    return _resolvers[key]
+
+##################################################################
+#
+# forget_resolver
+#
+# Given a connection to the CTA database, drops its loaded station names
+# so the next lookup reloads them, used after Stations changes
+#
+def forget_resolver(dbConn):
+    _resolvers.pop(dbutil.database_key(dbConn), None)
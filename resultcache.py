@@ -0,0 +1,319 @@
+# Overview: Cache of query results between the command functions and SQLite
+# Results are kept per database file, keyed on the statement (whitespace collapsed) and its
+# parameters, and only served while the database is unchanged: for a file, the same
+# modification time and size (of it and its -wal file) and ingest generation (the last
+# Ingest_Runs row); for an in-memory database, the same PRAGMA data_version and changes.
+# When the version moves on every entry is dropped. Entries are evicted least recently used
+# first to stay under a byte budget, and the cache can be saved to a JSON sidecar file
+# (<database>.cache) so a later session starts warm
+
+import os
+import json
+import sqlite3
+import threading
+import collections
+
+import dbutil
+
+# SQL queries as global constants so that they are not changed
+query_generation = "SELECT MAX(Run_ID) FROM Ingest_Runs;"
+
+# bytes of results kept per database, 0 turns the cache off
+budget = 32 * 1024 * 1024
+
+# save to and load from <database>.cache
+persist = False
+
+# bytes counted for each row and value on top of its text
+ROW_OVERHEAD = 56
+VALUE_OVERHEAD = 16
+
+# one cache per database file
+_caches = {}
+_caches_lock = threading.Lock()
+
+##################################################################
+#
+# configure
+#
+# Sets the byte budget of every cache and whether they are saved to disk
+#
+def configure(budget_bytes, save=False):
+    global budget, persist
+    budget = int(budget_bytes)
+    persist = save
+
+##################################################################
+#
+# normalize
+#
+# Returns a statement with its whitespace collapsed and no trailing ;
+# so the same query written twice shares an entry
+#
+def normalize(sql):
+    return " ".join(sql.split()).rstrip(";").rstrip()
+
+##################################################################
+#
+# result_bytes
+#
+# Returns the approximate memory taken by a list of result rows
+#
+def result_bytes(rows):
+    size = 0
+    for row in rows:
+        size += ROW_OVERHEAD
+        for value in row:
+            size += VALUE_OVERHEAD + (len(value) if isinstance(value, str) else 8)
+    return size
+
+##################################################################
+#
+# database_version
+#
+# Given a connection, returns what identifies the current contents of its
+# database, the file's and -wal file's modification time and size plus
+# the ingest generation, or the data version for in-memory databases
+#
+def database_version(dbConn, key):
+    dbCursor = dbConn.cursor()
+    if not isinstance(key, str):
+        dbCursor.execute("PRAGMA data_version;")
+        return [dbCursor.fetchone()[0], dbConn.total_changes]
+
+    version = []
+    for path in [key, key + "-wal"]:
+        try:
+            stat = os.stat(path)
+            version += [stat.st_mtime_ns, stat.st_size]
+        except OSError:
+            version += [0, 0]
+
+    try:
+        dbCursor.execute(query_generation)
+        version.append(dbCursor.fetchone()[0] or 0)
+    except sqlite3.OperationalError:
+        # no ingest has run on this database
+        version.append(0)
+    return version
+
+##################################################################
+#
+# ResultCache
+#
+# LRU of (statement, parameters) -> rows for one database version,
+# kept under budget bytes and optionally saved to the file at path
+#
+class ResultCache:
+    def __init__(self, path=None):
+        self.path = path
+        self.version = None
+        self.entries = collections.OrderedDict()
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        if self.path and os.path.exists(self.path):
+            self.load()
+
+    ##################################################################
+    #
+    # check_version
+    #
+    # Drops every entry if they belong to another version of the database
+    #
+    def check_version(self, version):
+        if version != self.version:
+            self.entries.clear()
+            self.used = 0
+            self.version = version
+
+    ##################################################################
+    #
+    # lookup
+    #
+    # Returns the cached rows of a key for this version, or None
+    #
+    def lookup(self, key, version):
+        with self.lock:
+            self.check_version(version)
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    ##################################################################
+    #
+    # store
+    #
+    # Adds the rows of a key, evicting the least recently used entries
+    # until they fit the budget (results bigger than the budget are not kept)
+    #
+    def store(self, key, version, rows):
+        size = result_bytes(rows)
+        if size > budget:
+            return
+
+        with self.lock:
+            self.check_version(version)
+            if key in self.entries:
+                self.used -= self.entries.pop(key)[1]
+            self.entries[key] = (rows, size)
+            self.used += size
+            while self.used > budget:
+                self.used -= self.entries.popitem(last=False)[1][1]
+
+    ##################################################################
+    #
+    # load
+    #
+    # Reads the entries saved by an earlier session, least recently used first
+    # A file that cannot be read is ignored, the cache just starts cold
+    #
+    def load(self):
+        try:
+            with open(self.path) as cache_file:
+                saved = json.load(cache_file)
+            for sql, parameters, rows in saved["entries"]:
+                key = (sql, tuple(parameters))
+                rows = [tuple(row) for row in rows]
+                self.entries[key] = (rows, result_bytes(rows))
+                self.used += self.entries[key][1]
+            self.version = saved["version"]
+        except (OSError, ValueError, KeyError, TypeError):
+            self.entries.clear()
+            self.used = 0
+            self.version = None
+
+    ##################################################################
+    #
+    # save
+    #
+    # Writes the entries and their version to the file, replacing it in one
+    # step so a crash never leaves half a file
+    #
+    def save(self):
+        with self.lock:
+            saved = {"version": self.version, "entries": [[key[0], list(key[1]), rows] for key, (rows, size) in self.entries.items()]}
+        with open(self.path + ".tmp", "w") as cache_file:
+            json.dump(saved, cache_file)
+        os.replace(self.path + ".tmp", self.path)
+
+##################################################################
+#
+# get_cache
+#
+# Given the key of a database, returns its cache, creating it (and loading
+# its sidecar file when caches are saved) the first time
+#
+def get_cache(key):
+    with _caches_lock:
+        if key not in _caches:
+            path = key + ".cache" if persist and isinstance(key, str) else None
+            _caches[key] = ResultCache(path)
+        return _caches[key]
+
+##################################################################
+#
+# fetchall
+#
+# Given a connection, a statement and its parameters, returns all the rows
+# it gives, from the cache when this version of the database has run it before
+# Statements inside an open transaction always run, they may see uncommitted changes
+#
+def fetchall(dbConn, sql, parameters=()):
+    if budget <= 0 or dbConn.in_transaction:
+        dbCursor = dbConn.cursor()
+        dbCursor.execute(sql, parameters)
+        return dbCursor.fetchall()
+
+    database = dbutil.database_key(dbConn)
+    cache = get_cache(database)
+    version = database_version(dbConn, database)
+    key = (normalize(sql), tuple(parameters))
+
+    rows = cache.lookup(key, version)
+    if rows is None:
+        dbCursor = dbConn.cursor()
+        dbCursor.execute(sql, parameters)
+        rows = dbCursor.fetchall()
+        cache.store(key, version, rows)
+
+    # a copy, so a caller changing its list cannot change the cache
+    return list(rows)
+
+##################################################################
+#
+# iterate
+#
+# Like fetchall, but yields the rows as they are fetched, size at a time,
+# so the first rows can be used before the query is done. A result read to
+# the end is added to the cache, one the caller stopped early is not
+#
+def iterate(dbConn, sql, parameters=(), size=100):
+    caching = budget > 0 and not dbConn.in_transaction
+    if caching:
+        database = dbutil.database_key(dbConn)
+        cache = get_cache(database)
+        version = database_version(dbConn, database)
+        key = (normalize(sql), tuple(parameters))
+        rows = cache.lookup(key, version)
+        if rows is not None:
+            yield from rows
+            return
+
+    dbCursor = dbConn.cursor()
+    dbCursor.execute(sql, parameters)
+    collected = []
+    rows = dbCursor.fetchmany(size)
+    while rows:
+        yield from rows
+        if caching:
+            collected.extend(rows)
+        rows = dbCursor.fetchmany(size)
+
+    if caching:
+        cache.store(key, version, collected)
+
+##################################################################
+#
+# fetchone
+#
+# Like fetchall, returning the first row or None
+#
+def fetchone(dbConn, sql, parameters=()):
+    rows = fetchall(dbConn, sql, parameters)
+    return rows[0] if rows else None
+
+##################################################################
+#
+# save
+#
+# Given a connection, saves its database's cache to the sidecar file
+# when caches are persisted
+#
+def save(dbConn):
+    cache = _caches.get(dbutil.database_key(dbConn))
+    if cache is not None and cache.path:
+        cache.save()
+
+##################################################################
+#
+# print_report
+#
+# Outputs the hits, misses and memory of every cache
+#
+def print_report():
+    print("Result Cache")
+    with _caches_lock:
+        caches = list(_caches.items())
+    if not caches:
+        print("  nothing cached yet")
+    for key, cache in caches:
+        print("  %s : %d hits, %d misses, %d entries, %s of %s bytes" % (key if isinstance(key, str) else "in-memory", cache.hits, cache.misses,
+              len(cache.entries), f"{cache.used:,}", f"{budget:,}"))
+    print()
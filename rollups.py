@@ -0,0 +1,153 @@
+# Overview: Pre-aggregated ridership at station x year x month x type of day grain
+# Commands that do not need daily rows read these rollups instead of re-aggregating
+# the raw Ridership table. Triggers record which months changed so a refresh only
+# rebuilds those months. Years rolled into partition files keep the rows they have
+
+import json
+import sqlite3
+import datetime
+
+import dates
+
+# SQL queries as global constants so that they are not changed
+query_rollup_current = "SELECT NOT EXISTS (SELECT 1 FROM Rollup_Stale);"
+query_rollup_stale = "SELECT Month FROM Rollup_Stale ORDER BY Month;"
+query_rollup_clear = "DELETE FROM Ridership_Rollup WHERE Year = ? AND Month = ?;"
+query_rollup_fill = "INSERT INTO Ridership_Rollup (Station_ID, Year, Month, Type_Of_Day, Num_Riders, Num_Days) SELECT Station_ID, strftime('%Y', Ride_Date), strftime('%m', Ride_Date), Type_Of_Day, SUM(Num_Riders), COUNT(*) FROM Ridership WHERE Ride_Date >= ? AND Ride_Date < ? GROUP BY Station_ID, strftime('%Y', Ride_Date), strftime('%m', Ride_Date), Type_Of_Day;"
+query_rollup_fill_all = "INSERT INTO Ridership_Rollup (Station_ID, Year, Month, Type_Of_Day, Num_Riders, Num_Days) SELECT Station_ID, strftime('%Y', Ride_Date), strftime('%m', Ride_Date), Type_Of_Day, SUM(Num_Riders), COUNT(*) FROM Ridership GROUP BY Station_ID, strftime('%Y', Ride_Date), strftime('%m', Ride_Date), Type_Of_Day;"
+query_rollup_clear_unsealed = "DELETE FROM Ridership_Rollup WHERE Year NOT IN (SELECT value FROM json_each(?));"
+query_rollup_sealed = "SELECT Year FROM Ridership_Partitions;"
+query_rollup_mark = "INSERT OR IGNORE INTO Rollup_Stale (Month) VALUES (?);"
+
+# the rollup table, the list of months waiting to be rebuilt and the triggers
+# that fill that list whenever Ridership changes
+rollup_schema = """
+CREATE TABLE IF NOT EXISTS Ridership_Rollup (
+    Station_ID INTEGER NOT NULL,
+    Year TEXT NOT NULL,
+    Month TEXT NOT NULL,
+    Type_Of_Day TEXT NOT NULL,
+    Num_Riders INTEGER NOT NULL,
+    Num_Days INTEGER NOT NULL,
+    PRIMARY KEY (Station_ID, Year, Month, Type_Of_Day)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS Ridership_Rollup_Type ON Ridership_Rollup (Type_Of_Day, Station_ID, Num_Riders);
+
+CREATE TABLE IF NOT EXISTS Rollup_Stale (
+    Month TEXT PRIMARY KEY
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS Rollup_Ridership_Insert AFTER INSERT ON Ridership
+BEGIN
+    INSERT OR IGNORE INTO Rollup_Stale (Month) VALUES (strftime('%Y-%m', NEW.Ride_Date));
+END;
+
+CREATE TRIGGER IF NOT EXISTS Rollup_Ridership_Delete AFTER DELETE ON Ridership
+BEGIN
+    INSERT OR IGNORE INTO Rollup_Stale (Month) VALUES (strftime('%Y-%m', OLD.Ride_Date));
+END;
+
+CREATE TRIGGER IF NOT EXISTS Rollup_Ridership_Update AFTER UPDATE ON Ridership
+BEGIN
+    INSERT OR IGNORE INTO Rollup_Stale (Month) VALUES (strftime('%Y-%m', OLD.Ride_Date));
+    INSERT OR IGNORE INTO Rollup_Stale (Month) VALUES (strftime('%Y-%m', NEW.Ride_Date));
+END;
+"""
+
+##################################################################
+#
+# month_keys
+#
+# Given a half-open date range as 'YYYY-MM-DD' strings, returns every
+# 'YYYY-MM' month the range touches
+#
+def month_keys(start, end):
+    current = datetime.date(int(start[0:4]), int(start[5:7]), 1)
+    last = datetime.date.fromisoformat(end[0:10]) - datetime.timedelta(days=1)
+    months = []
+
+    # walk forward one month at a time until the last day of the range
+    while current <= last:
+        months.append(current.strftime("%Y-%m"))
+        current = (current + datetime.timedelta(days=31)).replace(day=1)
+
+    return months
+
+##################################################################
+#
+# sealed_years
+#
+# Given a connection to the CTA database, returns the years rolled out of
+# Ridership into partition files (partitions.py). Their rollup rows were
+# built before the rows left and are never rebuilt
+#
+def sealed_years(dbConn):
+    try:
+        dbCursor = dbConn.cursor()
+        dbCursor.execute(query_rollup_sealed)
+        return {row[0] for row in dbCursor.fetchall()}
+    except sqlite3.OperationalError:
+        # no partition list
+        return set()
+
+##################################################################
+#
+# rollups_current
+#
+# Given a connection to the CTA database, returns True if the rollup table
+# exists and no month is waiting to be rebuilt
+#
+def rollups_current(dbConn):
+    try:
+        dbCursor = dbConn.cursor()
+        dbCursor.execute(query_rollup_current)
+        return bool(dbCursor.fetchone()[0])
+    except sqlite3.OperationalError:
+        # rollup tables have not been created
+        return False
+
+##################################################################
+#
+# refresh_rollups
+#
+# Given a connection to the CTA database, rebuilds the rollup rows for every
+# month Ridership has changed in since the last refresh
+# A half-open date range [start, end) can be given to also rebuild those months,
+# and rebuild=True recomputes every month from scratch
+# Creates the tables and triggers the first time it runs
+#
+def refresh_rollups(dbConn, start=None, end=None, rebuild=False):
+    with dbConn:
+        dbCursor = dbConn.cursor()
+
+        # first run builds every month
+        dbCursor.execute("SELECT count(*) FROM sqlite_master WHERE name = 'Ridership_Rollup';")
+        if not dbCursor.fetchone()[0]:
+            rebuild = True
+        dbCursor.executescript(rollup_schema)
+
+        # full rebuild in one grouped pass, partitioned years keep their rows
+        sealed = sealed_years(dbConn)
+        if rebuild:
+            dbCursor.execute(query_rollup_clear_unsealed, (json.dumps(sorted(sealed)),))
+            dbCursor.execute(query_rollup_fill_all)
+            dbCursor.execute("DELETE FROM Rollup_Stale;")
+            return
+
+        # queue the requested months
+        if start and end:
+            dbCursor.executemany(query_rollup_mark, [(month,) for month in month_keys(start, end)])
+
+        # rebuild only the queued months, each one as a Ride_Date range
+        dbCursor.execute(query_rollup_stale)
+        stale = dbCursor.fetchall()
+        for (month,) in stale:
+            if month[0:4] in sealed:
+                continue
+            dbCursor.execute(query_rollup_clear, (month[0:4], month[5:7]))
+            dbCursor.execute(query_rollup_fill, dates.month_range(month[0:4], month[5:7]))
+
+        # clearing an empty queue still rewrites the file, leave it untouched
+        if stale:
+            dbCursor.execute("DELETE FROM Rollup_Stale;")
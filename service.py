@@ -0,0 +1,232 @@
+# Overview: Local HTTP/JSON query service for commands 1-10
+# A fixed set of worker threads answers requests, each worker with its own read-only
+# (mode=ro) connection whose statement cache keeps the prepared queries between requests.
+# The number of requests queued or running is capped (more are turned away with 503),
+# every request is timed and a query running past the timeout is interrupted
+#
+# Usage: python service.py [--db FILE] [--port 8341] [--workers 8]
+#
+#     GET /6?arg=Clark/Lake            same arguments as the batch mode, in prompt order
+#     GET /9?arg=41.88&arg=-87.63&radius=2
+#     GET /stats                       request counts and timings per endpoint
+#     GET /stats/queries               per-command latencies and per-statement timings and plans
+#
+# Responses are the batch mode's JSON result for the command
+
+import json
+import time
+import pathlib
+import sqlite3
+import argparse
+import threading
+import http.server
+import urllib.parse
+import concurrent.futures
+
+import batch
+import engines
+import instrument
+import resultcache
+
+# prepared statements kept per connection
+STATEMENT_CACHE_SIZE = 256
+
+# SQLite virtual machine steps between timeout checks
+PROGRESS_STEPS = 10000
+
+##################################################################
+#
+# QueryError
+#
+# A request that cannot be answered, with the HTTP status to send
+#
+class QueryError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+##################################################################
+#
+# QueryService
+#
+# HTTP server handing each request to a fixed pool of worker threads
+# Holds the settings and timings shared by the request handlers
+#
+class QueryService(http.server.HTTPServer):
+    def __init__(self, address, db_path, workers=8, max_inflight=64, timeout=10.0):
+        super().__init__(address, QueryHandler)
+        self.db_uri = pathlib.Path(db_path).resolve().as_uri() + "?mode=ro"
+        self.timeout_seconds = timeout
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="query")
+        self.inflight = threading.BoundedSemaphore(max_inflight)
+        self.local = threading.local()
+        self.timings = {}
+        self.timings_lock = threading.Lock()
+
+    # hand the request to a worker instead of answering it on the accept thread,
+    # or turn it away when too many are already waiting
+    def process_request(self, request, client_address):
+        if not self.inflight.acquire(blocking=False):
+            try:
+                request.sendall(b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.inflight.release()
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False)
+
+    ##################################################################
+    #
+    # connection
+    #
+    # Returns the calling worker's read-only connection, opening it the first time
+    #
+    def connection(self):
+        dbConn = getattr(self.local, "dbConn", None)
+        if dbConn is None:
+            dbConn = sqlite3.connect(self.db_uri, uri=True, cached_statements=STATEMENT_CACHE_SIZE, factory=instrument.InstrumentedConnection)
+            self.local.dbConn = dbConn
+        return dbConn
+
+    ##################################################################
+    #
+    # record
+    #
+    # Adds one request's time in milliseconds to its endpoint's timings
+    #
+    def record(self, endpoint, milliseconds, ok):
+        with self.timings_lock:
+            timing = self.timings.setdefault(endpoint, {"requests": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+            timing["requests"] += 1
+            timing["errors"] += 0 if ok else 1
+            timing["total_ms"] += milliseconds
+            timing["max_ms"] = max(timing["max_ms"], milliseconds)
+
+    ##################################################################
+    #
+    # run
+    #
+    # Runs a command on the calling worker's connection and returns the
+    # batch mode's result dictionary, interrupting it after the timeout
+    #
+    def run(self, command, args, options):
+        if command not in batch.runners:
+            raise QueryError(404, "unknown command")
+        if "plot" in options:
+            raise QueryError(400, "plots are not available from the service")
+
+        dbConn = self.connection()
+        deadline = time.monotonic() + self.timeout_seconds
+        dbConn.set_progress_handler(lambda: time.monotonic() > deadline, PROGRESS_STEPS)
+        result = {"command": command, "args": args, "options": options}
+
+        try:
+            with instrument.command(command):
+                result["rows"] = batch.runners[command](dbConn, args, options, None)
+            result["ok"] = True
+            return result
+        except (batch.BatchError, ValueError) as error:
+            return dict(result, ok=False, error=str(error))
+        except sqlite3.OperationalError as error:
+            if "interrupted" in str(error):
+                raise QueryError(504, "query timed out")
+            raise QueryError(500, str(error))
+        finally:
+            dbConn.set_progress_handler(None, 0)
+
+##################################################################
+#
+# QueryHandler
+#
+# Answers GET requests with JSON
+#
+class QueryHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    # seconds an idle keep-alive connection may hold a worker, short so that
+    # clients that keep their connections open do not starve the others
+    timeout = 0.5
+
+    def do_GET(self):
+        start = time.perf_counter()
+        url = urllib.parse.urlsplit(self.path)
+        endpoint = url.path.strip("/")
+        status = 200
+
+        try:
+            if endpoint == "stats":
+                with self.server.timings_lock:
+                    body = {key: dict(timing) for key, timing in self.server.timings.items()}
+            elif endpoint == "stats/queries":
+                body = instrument.report()
+            else:
+                # repeated arg= are the positional arguments, anything else an option
+                query = urllib.parse.parse_qs(url.query, keep_blank_values=True)
+                args = query.pop("arg", [])
+                options = {key: values[-1] for key, values in query.items()}
+                body = self.server.run(endpoint, args, options)
+        except QueryError as error:
+            status = error.status
+            body = {"ok": False, "error": str(error)}
+        except Exception as error:
+            # anything else still gets an answer, not a dropped connection
+            status = 500
+            body = {"ok": False, "error": "%s: %s" % (type(error).__name__, error)}
+
+        milliseconds = (time.perf_counter() - start) * 1000
+        self.server.record(endpoint, milliseconds, status == 200 and body.get("ok", True))
+
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("X-Response-Time", "%.2fms" % milliseconds)
+        self.end_headers()
+        self.wfile.write(data)
+
+    # keep the console quiet, timings are available from /stats
+    def log_message(self, format, *args):
+        pass
+
+##################################################################
+#
+# main
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the CTA commands as JSON over HTTP")
+    parser.add_argument("--db", default="CTA2_L_daily_ridership.db", help="path to the CTA database")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8341, help="port to listen on")
+    parser.add_argument("--workers", type=int, default=8, help="worker threads, each with its own connection")
+    parser.add_argument("--max-inflight", type=int, default=64, help="requests allowed to be queued or running at once")
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds before a query is interrupted")
+    parser.add_argument("--engine", choices=engines.names, default="sqlite", help="backend the ridership aggregations run on")
+    parser.add_argument("--slow-log", metavar="FILE", help="append statements slower than --slow-ms to FILE, with their plans")
+    parser.add_argument("--slow-ms", type=float, default=100.0, help="slow-query threshold in milliseconds")
+    parser.add_argument("--cache-mb", type=float, default=32, help="memory for cached query results, shared by the workers, 0 turns it off")
+    args = parser.parse_args()
+
+    engines.set_engine(args.engine)
+    instrument.configure(args.slow_ms, args.slow_log)
+    resultcache.configure(args.cache_mb * 1024 * 1024)
+
+    server = QueryService((args.host, args.port), args.db, args.workers, args.max_inflight, args.timeout)
+    print("Serving %s on http://%s:%d" % (args.db, args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
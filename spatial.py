@@ -0,0 +1,177 @@
+# Overview: In-memory spatial index over the station coordinates in Stops
+# Stations are bucketed into a lat/long grid built once per database, radius queries
+# only visit the grid cells that can hold a match and then filter on the true
+# haversine distance, and k-nearest queries widen the radius until k stations fit, each
+# station once at its closest stop
+
+import math
+
+import dbutil
+
+# SQL queries as global constants so that they are not changed
+query_station_points = "SELECT DISTINCT Stations.Station_Name, Latitude, Longitude, Stations.Station_ID FROM Stops JOIN Stations ON Stations.Station_ID = Stops.Station_ID;"
+
+# mean radius of the earth and miles per degree of latitude
+EARTH_RADIUS_MILES = 3958.8
+MILES_PER_DEGREE = EARTH_RADIUS_MILES * math.pi / 180
+
+# grid cell size in degrees, roughly 0.7 miles north to south
+CELL_SIZE = 0.01
+
+# one index per database file
+_indexes = {}
+
+##################################################################
+#
+# haversine
+#
+# Given two points as latitude and longitude in degrees, returns the
+# great-circle distance between them in miles
+#
+def haversine(lat1, long1, lat2, long2):
+    lat1 = math.radians(lat1)
+    lat2 = math.radians(lat2)
+    dlat = lat2 - lat1
+    dlong = math.radians(long2 - long1)
+
+    a = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlong / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(min(1.0, math.sqrt(a)))
+
+##################################################################
+#
+# StationIndex
+#
+# Grid of (station name, latitude, longitude, station id) points, one per
+# stop location, answering radius and k-nearest queries with exact distances
+#
+class StationIndex:
+    def __init__(self, points):
+        self.points = list(points)
+        self.stations = len(set(point[3] for point in self.points))
+        self.cells = {}
+
+        # bucket every point into its grid cell
+        for point in self.points:
+            self.cells.setdefault(self.cell(point[1], point[2]), []).append(point)
+
+    # grid cell holding a latitude and longitude
+    def cell(self, lat, long):
+        return (math.floor(lat / CELL_SIZE), math.floor(long / CELL_SIZE))
+
+    ##################################################################
+    #
+    # within
+    #
+    # Given a latitude, longitude and radius in miles, returns
+    # (distance, station name, latitude, longitude) for every station
+    # location within the radius, nearest first
+    #
+    def within(self, lat, long, radius):
+        return sorted(set((distance, point[0], point[1], point[2]) for distance, point in self.search(lat, long, radius)))
+
+    ##################################################################
+    #
+    # search
+    #
+    # Given a latitude, longitude and radius in miles, returns (distance,
+    # point) for every point within the radius, nearest first
+    #
+    def search(self, lat, long, radius):
+        # bounding box of the circle, in grid cells
+        dlat = radius / MILES_PER_DEGREE
+        dlong = radius / (MILES_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6))
+        low = self.cell(lat - dlat, long - dlong)
+        high = self.cell(lat + dlat, long + dlong)
+
+        # a huge radius covers more cells than are filled, check every point instead
+        if (high[0] - low[0] + 1) * (high[1] - low[1] + 1) > len(self.cells):
+            candidates = self.points
+        else:
+            candidates = []
+            for i in range(low[0], high[0] + 1):
+                for j in range(low[1], high[1] + 1):
+                    candidates.extend(self.cells.get((i, j), ()))
+
+        # exact distance filter
+        result = []
+        for point in candidates:
+            distance = haversine(lat, long, point[1], point[2])
+            if distance <= radius:
+                result.append((distance, point))
+
+        result.sort()
+        return result
+
+    ##################################################################
+    #
+    # nearest
+    #
+    # Given a latitude, longitude and a count k, returns
+    # (distance, station name, latitude, longitude) for the k nearest
+    # stations, nearest first, each at its closest stop
+    #
+    def nearest(self, lat, long, k):
+        k = min(k, self.stations)
+        if k <= 0:
+            return []
+
+        # widen the search until it holds k stations, a circle is exact so
+        # the k closest inside it are the k closest overall
+        radius = CELL_SIZE * MILES_PER_DEGREE
+        result = self.closest_stops(self.search(lat, long, radius))
+        while len(result) < k:
+            radius *= 2
+            result = self.closest_stops(self.search(lat, long, radius))
+
+        return result[:k]
+
+    ##################################################################
+    #
+    # closest_stops
+    #
+    # Given search() results, returns (distance, station name, latitude,
+    # longitude) of the closest point of each station, nearest first
+    #
+    def closest_stops(self, found):
+        result = []
+        seen = set()
+        for distance, point in found:
+            if point[3] not in seen:
+                seen.add(point[3])
+                result.append((distance, point[0], point[1], point[2]))
+        return result
+
+    ##################################################################
+    #
+    # nearest_many
+    #
+    # Given a list of (latitude, longitude) points and a count k, returns
+    # the k nearest stations for every point, in the same order
+    #
+    def nearest_many(self, points, k=1):
+        return [self.nearest(lat, long, k) for lat, long in points]
+
+##################################################################
+#
+# get_station_index
+#
+# Given a connection to the CTA database, returns its station index,
+# loading the station coordinates the first time it is asked for
+#
+def get_station_index(dbConn):
+    key = dbutil.database_key(dbConn)
+    if key not in _indexes:
+        dbCursor = dbConn.cursor()
+        dbCursor.execute(query_station_points)
+        _indexes[key] = StationIndex((row[0], float(row[1]), float(row[2]), row[3]) for row in dbCursor.fetchall())
+    return _indexes[key]
+
+##################################################################
+#
+# forget_station_index
+#
+# Given a connection to the CTA database, drops its loaded station index
+# so the next lookup reloads it, used after Stops changes
+#
+def forget_station_index(dbConn):
+    _indexes.pop(dbutil.database_key(dbConn), None)
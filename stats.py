@@ -0,0 +1,152 @@
+# Overview: Keeps the general statistics shown at startup in a one-row summary table
+# that is maintained by triggers, so launching the app is a single-row lookup instead
+# of several scans over Ridership
+
+import sqlite3
+
+# SQL queries as global constants so that they are not changed
+# computes all six figures, the Ridership ones in one aggregate pass
+query_stats_compute = "SELECT (SELECT count(*) FROM Stations), (SELECT count(*) FROM Stops), count(*), MIN(Ride_Date), MAX(Ride_Date), SUM(Num_Riders) FROM Ridership;"
+query_stats_partitions = "SELECT COALESCE(SUM(Rows), 0), MIN(First_Date), MAX(Last_Date), COALESCE(SUM(Riders), 0) FROM Ridership_Partitions;"
+query_stats_lookup = "SELECT Num_Stations, Num_Stops, Num_Entries, strftime('%Y-%m-%d', Earliest_Date), strftime('%Y-%m-%d', Latest_Date), Total_Riders, Dirty FROM Stats_Summary WHERE Id = 1;"
+query_stats_store = "INSERT OR REPLACE INTO Stats_Summary (Id, Num_Stations, Num_Stops, Num_Entries, Earliest_Date, Latest_Date, Total_Riders, Dirty) VALUES (1, ?, ?, ?, ?, ?, ?, 0);"
+
+# the summary table and the triggers that keep it current, every statement is
+# idempotent so the script can be run on each launch
+stats_schema = """
+CREATE TABLE IF NOT EXISTS Stats_Summary (
+    Id INTEGER PRIMARY KEY CHECK (Id = 1),
+    Num_Stations INTEGER NOT NULL,
+    Num_Stops INTEGER NOT NULL,
+    Num_Entries INTEGER NOT NULL,
+    Earliest_Date TEXT,
+    Latest_Date TEXT,
+    Total_Riders INTEGER,
+    Dirty INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TRIGGER IF NOT EXISTS Stats_Stations_Insert AFTER INSERT ON Stations
+BEGIN
+    UPDATE Stats_Summary SET Num_Stations = Num_Stations + 1 WHERE Id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS Stats_Stations_Delete AFTER DELETE ON Stations
+BEGIN
+    UPDATE Stats_Summary SET Num_Stations = Num_Stations - 1 WHERE Id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS Stats_Stops_Insert AFTER INSERT ON Stops
+BEGIN
+    UPDATE Stats_Summary SET Num_Stops = Num_Stops + 1 WHERE Id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS Stats_Stops_Delete AFTER DELETE ON Stops
+BEGIN
+    UPDATE Stats_Summary SET Num_Stops = Num_Stops - 1 WHERE Id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS Stats_Ridership_Insert AFTER INSERT ON Ridership
+BEGIN
+    UPDATE Stats_Summary SET
+        Num_Entries = Num_Entries + 1,
+        Total_Riders = COALESCE(Total_Riders, 0) + COALESCE(NEW.Num_Riders, 0),
+        Earliest_Date = CASE WHEN Earliest_Date IS NULL OR NEW.Ride_Date < Earliest_Date THEN NEW.Ride_Date ELSE Earliest_Date END,
+        Latest_Date = CASE WHEN Latest_Date IS NULL OR NEW.Ride_Date > Latest_Date THEN NEW.Ride_Date ELSE Latest_Date END
+    WHERE Id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS Stats_Ridership_Delete AFTER DELETE ON Ridership
+BEGIN
+    UPDATE Stats_Summary SET
+        Num_Entries = Num_Entries - 1,
+        Total_Riders = Total_Riders - COALESCE(OLD.Num_Riders, 0),
+        Dirty = CASE WHEN OLD.Ride_Date = Earliest_Date OR OLD.Ride_Date = Latest_Date THEN 1 ELSE Dirty END
+    WHERE Id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS Stats_Ridership_Update AFTER UPDATE OF Ride_Date, Num_Riders ON Ridership
+BEGIN
+    UPDATE Stats_Summary SET
+        Total_Riders = Total_Riders - COALESCE(OLD.Num_Riders, 0) + COALESCE(NEW.Num_Riders, 0),
+        Dirty = CASE WHEN OLD.Ride_Date <> NEW.Ride_Date AND (OLD.Ride_Date = Earliest_Date OR OLD.Ride_Date = Latest_Date) THEN 1 ELSE Dirty END,
+        Earliest_Date = CASE WHEN NEW.Ride_Date < Earliest_Date THEN NEW.Ride_Date ELSE Earliest_Date END,
+        Latest_Date = CASE WHEN NEW.Ride_Date > Latest_Date THEN NEW.Ride_Date ELSE Latest_Date END
+    WHERE Id = 1;
+END;
+"""
+
+##################################################################
+#
+# compute_stats
+#
+# Given a connection to the CTA database, works out the station, stop and
+# ride entry counts, the raw date range and the total ridership in one pass
+# Years rolled into partition files (partitions.py) are added from their list
+#
+def compute_stats(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute(query_stats_compute)
+    result = dbCursor.fetchone()
+
+    try:
+        dbCursor.execute(query_stats_partitions)
+        rows, first, last, riders = dbCursor.fetchone()
+    except sqlite3.OperationalError:
+        # no partition list, every year is in Ridership
+        return result
+    if not first:
+        return result
+
+    stations, stops, entries, earliest, latest, total = result
+    return (stations, stops, entries + rows, min(date for date in [earliest, first] if date),
+            max(date for date in [latest, last] if date), (total or 0) + riders)
+
+##################################################################
+#
+# refresh_stats
+#
+# Given a connection to the CTA database, makes sure the summary table and its
+# triggers exist and rescans the database to store fresh figures
+#
+def refresh_stats(dbConn):
+    with dbConn:
+        dbConn.executescript(stats_schema)
+        dbConn.execute(query_stats_store, compute_stats(dbConn))
+
+##################################################################
+#
+# load_stats
+#
+# Given a connection to the CTA database, returns the startup statistics as
+# (stations, stops, ride entries, earliest date, latest date, total riders)
+# Reads the summary row, rebuilding it when it is missing, when a deleted row
+# may have moved the date range, or when recompute is requested
+# Falls back to a single aggregate pass if the database is read only
+#
+def load_stats(dbConn, recompute=False):
+    dbCursor = dbConn.cursor()
+    row = None
+
+    try:
+        if not recompute:
+            dbCursor.execute(query_stats_lookup)
+            row = dbCursor.fetchone()
+    except sqlite3.OperationalError:
+        # summary table has not been created yet
+        row = None
+
+    # summary is current
+    if row and not row[6]:
+        return row[:6]
+
+    try:
+        refresh_stats(dbConn)
+    except sqlite3.OperationalError:
+        # cannot write to this database, compute without storing
+        result = compute_stats(dbConn)
+        dbCursor.execute("SELECT strftime('%Y-%m-%d', ?), strftime('%Y-%m-%d', ?);", (result[3], result[4]))
+        dates = dbCursor.fetchone()
+        return result[:3] + dates + result[5:]
+
+    dbCursor.execute(query_stats_lookup)
+    return dbCursor.fetchone()[:6]
@@ -0,0 +1,39 @@
+# Overview: Fixtures shared by the tests
+# Every test gets a small synthetic database of its own, from generate_db.py, with the
+# result cache off and the per-database caches and the engine reset around it
+
+import os
+import sys
+import sqlite3
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bench
+import engines
+import generate_db
+import resultcache
+
+##################################################################
+#
+# cta_db
+#
+# A connection to a fresh database of 6 stations and 2 years of ridership
+# (station 40000 is Clark)
+#
+@pytest.fixture
+def cta_db(tmp_path):
+    path = str(tmp_path / "cta.db")
+    generate_db.generate(path, stations=6, years=2)
+    budget = resultcache.budget
+    resultcache.configure(0)
+    bench.reset_caches()
+
+    dbConn = sqlite3.connect(path)
+    yield dbConn
+    dbConn.close()
+
+    engines.set_engine("sqlite")
+    resultcache.configure(budget)
+    bench.reset_caches()
@@ -0,0 +1,48 @@
+# Overview: The columnar snapshot of the numpy engine after Ridership changes under it
+
+import main
+import engines
+
+##################################################################
+#
+# yearly
+#
+# Returns a station's yearly ridership on each engine
+#
+def yearly(dbConn, station_id):
+    results = {}
+    for engine in engines.names:
+        engines.set_engine(engine)
+        results[engine] = main.yearly_ridership(dbConn, station_id)
+    return results
+
+##################################################################
+#
+# a row moved to another station is moved in the snapshot too, rows
+# added or removed stay the same
+#
+def test_update_station_id(cta_db):
+    engines.set_engine("numpy")
+    engines.snapshot(cta_db)
+
+    cta_db.execute("UPDATE Ridership SET Station_ID = 40010 WHERE Station_ID = 40000 AND Ride_Date < '2002-01-01';")
+    cta_db.commit()
+
+    results = yearly(cta_db, 40000)
+    assert [row[0] for row in results["sqlite"]] == ["2002"]
+    assert results["numpy"] == results["sqlite"]
+    assert yearly(cta_db, 40010)["numpy"] == yearly(cta_db, 40010)["sqlite"]
+
+##################################################################
+#
+# deleted rows leave the snapshot, with no stats summary to tell
+#
+def test_delete_without_summary(cta_db):
+    engines.set_engine("numpy")
+    engines.snapshot(cta_db)
+
+    cta_db.execute("DELETE FROM Ridership WHERE Station_ID = 40000 AND Ride_Date >= '2002-06-01' AND Ride_Date < '2002-07-01';")
+    cta_db.commit()
+
+    results = yearly(cta_db, 40000)
+    assert results["numpy"] == results["sqlite"]
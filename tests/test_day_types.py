@@ -0,0 +1,34 @@
+# Overview: Ridership by type of day (command 2) for a station missing a type of day
+
+import batch
+import main
+import engines
+import rollups
+
+##################################################################
+#
+# day_type_totals of a station without sunday/holiday rows, on every
+# engine and from the rollups: 0 for that type of day, not None
+#
+def test_station_without_sunday_rows(cta_db):
+    cta_db.execute("DELETE FROM Ridership WHERE Station_ID = 40000 AND Type_Of_Day = 'U';")
+    cta_db.commit()
+
+    results = {}
+    for engine in engines.names:
+        engines.set_engine(engine)
+        results[engine] = main.day_type_totals(cta_db, "Clark")
+    engines.set_engine("sqlite")
+    rollups.refresh_rollups(cta_db)
+    assert rollups.rollups_current(cta_db)
+    results["rollup"] = main.day_type_totals(cta_db, "Clark")
+
+    weekday, saturday, sunday, total = results["sqlite"]
+    assert sunday == 0
+    assert weekday + saturday == total
+    assert results["numpy"] == results["sqlite"]
+    assert results["rollup"] == results["sqlite"]
+
+    result = batch.run_line(cta_db, 1, "2 Clark")
+    assert result["ok"]
+    assert [row["riders"] for row in result["rows"]] == [weekday, saturday, 0, total]
@@ -0,0 +1,25 @@
+# Overview: k-nearest queries of the station index (command 10)
+
+import spatial
+
+##################################################################
+#
+# a station with several stops near the point counts once, at its
+# closest stop, so k stations are k different stations
+#
+def test_nearest_distinct_stations():
+    index = spatial.StationIndex([
+        ("Clark/Lake", 41.8857, -87.6309, 40380),
+        ("Clark/Lake", 41.8858, -87.6312, 40380),
+        ("Clark/Lake", 41.8856, -87.6307, 40380),
+        ("State/Lake", 41.8858, -87.6278, 40260),
+        ("Washington", 41.8834, -87.6297, 40370),
+    ])
+
+    result = index.nearest(41.8857, -87.6310, 2)
+    assert [row[1] for row in result] == ["Clark/Lake", "State/Lake"]
+    assert (result[0][2], result[0][3]) == (41.8857, -87.6309)
+    assert len(index.nearest(41.8857, -87.6310, 10)) == 3
+
+    # a radius query still lists every stop location
+    assert len(index.within(41.8857, -87.6310, 1)) == 5
@@ -0,0 +1,187 @@
+# Overview: In-memory model of the L network (Lines, Stops and StopDetails)
+# The topology is small and rarely changes, so it is loaded once per database and kept as
+# adjacency maps: line -> stops, stop -> lines and station -> stops, with each stop's name,
+# direction and ADA flag. The line and direction lookups of commands 4 and 5 and questions
+# like "which stations do two lines share" or "how many ADA stops does each line have" are
+# answered from the maps without a query. Colors and directions are compared ignoring the
+# case of ASCII letters, like SQLite's LOWER()
+
+import collections
+
+import dbutil
+import resolver
+
+# SQL queries as global constants so that they are not changed
+query_lines = "SELECT Line_ID, Color FROM Lines;"
+query_stops = "SELECT Stop_ID, Station_ID, Stop_Name, Direction, ADA FROM Stops ORDER BY Stop_ID;"
+query_stop_lines = "SELECT Stop_ID, Line_ID FROM StopDetails;"
+query_station_names = "SELECT Station_ID, Station_Name FROM Stations;"
+
+# one topology per database file
+_topologies = {}
+
+##################################################################
+#
+# fold
+#
+# Given a color or direction, returns it lowercased the way SQLite's LOWER()
+# does (ASCII letters only), None stays None
+#
+def fold(text):
+    return None if text is None else resolver.fold(str(text))
+
+##################################################################
+#
+# sort_key
+#
+# Orders values the way SQLite sorts a text column, NULL first
+#
+def sort_key(value):
+    return (value is not None, value if value is not None else "")
+
+##################################################################
+#
+# Stop
+#
+# One row of Stops
+#
+Stop = collections.namedtuple("Stop", ["stop_id", "station_id", "name", "direction", "ada"])
+
+##################################################################
+#
+# Topology
+#
+# The lines, stops and stations of one database and how they connect
+#
+class Topology:
+    def __init__(self, lines, stops, stop_lines, stations):
+        self.colors = dict(lines)
+        self.stops = {row[0]: Stop(*row) for row in stops}
+        self.station_names = dict(stations)
+
+        # folded color -> line ids, a color can be on more than one Line_ID
+        self.lines_of_color = {}
+        for line_id, color in self.colors.items():
+            self.lines_of_color.setdefault(fold(color), []).append(line_id)
+
+        # adjacency, in Stop_ID order, keeping every StopDetails row like a join would
+        self.line_stops = {line_id: [] for line_id in self.colors}
+        self.stop_lines = {stop_id: [] for stop_id in self.stops}
+        for stop_id, line_id in sorted(stop_lines, key=lambda row: sort_key(row[0])):
+            if stop_id in self.stops and line_id in self.line_stops:
+                self.line_stops[line_id].append(stop_id)
+                self.stop_lines[stop_id].append(line_id)
+
+        self.station_stops = {}
+        for stop in self.stops.values():
+            self.station_stops.setdefault(stop.station_id, []).append(stop.stop_id)
+
+    ##################################################################
+    #
+    # has_line
+    #
+    # Returns True if a line has this color
+    #
+    def has_line(self, color):
+        return fold(color) in self.lines_of_color
+
+    ##################################################################
+    #
+    # stops_of_color
+    #
+    # Returns the stops of every line with this color
+    #
+    def stops_of_color(self, color):
+        return [self.stops[stop_id] for line_id in self.lines_of_color.get(fold(color), ()) for stop_id in self.line_stops[line_id]]
+
+    ##################################################################
+    #
+    # line_stops_going
+    #
+    # Given a line color and a direction, returns (stop name, direction, ADA)
+    # for every stop of the line going that way, by stop name
+    #
+    def line_stops_going(self, color, direction):
+        direction = fold(direction)
+        stops = [stop for stop in self.stops_of_color(color) if fold(stop.direction) == direction]
+        stops.sort(key=lambda stop: sort_key(stop.name))
+        return [(stop.name, stop.direction, stop.ada) for stop in stops]
+
+    ##################################################################
+    #
+    # stops_by_color
+    #
+    # Returns (color, direction, stops) for every line color and direction,
+    # by color and direction, and the total number of stops
+    #
+    def stops_by_color(self):
+        counts = collections.Counter()
+        for line_id, stop_ids in self.line_stops.items():
+            for stop_id in stop_ids:
+                counts[(self.colors[line_id], self.stops[stop_id].direction)] += 1
+
+        keys = sorted(counts, key=lambda key: (sort_key(key[0]), sort_key(key[1])))
+        return [(color, direction, counts[(color, direction)]) for color, direction in keys], len(self.stops)
+
+    ##################################################################
+    #
+    # stations_of_color
+    #
+    # Returns the ids of the stations with a stop on a line of this color
+    #
+    def stations_of_color(self, color):
+        return {stop.station_id for stop in self.stops_of_color(color)}
+
+    ##################################################################
+    #
+    # shared_stations
+    #
+    # Given two line colors, returns (station id, station name) for every
+    # station with stops on both, by station name
+    #
+    def shared_stations(self, color_one, color_two):
+        shared = self.stations_of_color(color_one) & self.stations_of_color(color_two)
+        return sorted(((station_id, self.station_names.get(station_id, "")) for station_id in shared),
+                      key=lambda row: (sort_key(row[1]), row[0]))
+
+    ##################################################################
+    #
+    # ada_by_line
+    #
+    # Returns (color, ADA stops, stops) for every line color, by color
+    #
+    def ada_by_line(self):
+        colors = sorted({color for color in self.colors.values()}, key=sort_key)
+        result = []
+        for color in colors:
+            stops = {stop.stop_id: stop for stop in self.stops_of_color(color)}
+            result.append((color, sum(1 for stop in stops.values() if stop.ada == 1), len(stops)))
+        return result
+
+##################################################################
+#
+# get_topology
+#
+# Given a connection to the CTA database, returns its network topology,
+# loading it the first time it is asked for
+#
+def get_topology(dbConn):
+    key = dbutil.database_key(dbConn)
+    if key not in _topologies:
+        tables = []
+        for query in [query_lines, query_stops, query_stop_lines, query_station_names]:
+            dbCursor = dbConn.cursor()
+            dbCursor.execute(query)
+            tables.append(dbCursor.fetchall())
+        _topologies[key] = Topology(*tables)
+    return _topologies[key]
+
+##################################################################
+#
+# forget_topology
+#
+# Given a connection to the CTA database, drops its loaded topology so
+# the next lookup reloads it, used after the stops or lines change
+#
+def forget_topology(dbConn):
+    _topologies.pop(dbutil.database_key(dbConn), None)
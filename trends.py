@@ -0,0 +1,210 @@
+# Overview: Growth and moving averages of every station's ridership
+# The trends are computed by SQLite's window functions, one windowed query per grain for
+# every station at once: over the monthly totals for the month-over-month and
+# year-over-year changes and the trailing twelve months, and over the daily rows of the
+# last year for the trailing 7, 28 and 365 day averages. A station's recovery is its
+# trailing 365 day average over its average day in a baseline year. The monthly totals
+# come from the rollups when they are up to date, the daily rows from Ridership and the
+# partitions of the last year
+
+import datetime
+import collections
+
+import stats
+import dates
+import rollups
+import resolver
+import partitions
+import resultcache
+
+# SQL queries as global constants so that they are not changed
+# months are numbered year * 12 + month - 1, so a RANGE frame of 12 PRECEDING is the same
+# month a year before even when a station has months without data
+query_trend_monthly_rollup = """
+WITH Monthly AS (
+    SELECT Station_ID, CAST(Year AS INTEGER) * 12 + CAST(Month AS INTEGER) - 1 AS Month_Index, SUM(Num_Riders) AS Riders
+    FROM Ridership_Rollup WHERE Year >= ? AND Year <= ? GROUP BY Station_ID, Year, Month
+), Changes AS (
+    SELECT Station_ID, Month_Index, Riders,
+        SUM(Riders) OVER (PARTITION BY Station_ID ORDER BY Month_Index RANGE BETWEEN 1 PRECEDING AND 1 PRECEDING) AS Last_Month,
+        SUM(Riders) OVER (PARTITION BY Station_ID ORDER BY Month_Index RANGE BETWEEN 12 PRECEDING AND 12 PRECEDING) AS Last_Year,
+        SUM(Riders) OVER (PARTITION BY Station_ID ORDER BY Month_Index RANGE BETWEEN 11 PRECEDING AND CURRENT ROW) AS Year_Riders,
+        SUM(Riders) OVER (PARTITION BY Station_ID ORDER BY Month_Index RANGE BETWEEN 23 PRECEDING AND 12 PRECEDING) AS Prior_Year_Riders
+    FROM Monthly
+)
+SELECT Station_ID, Riders, Last_Month, Last_Year, Year_Riders, Prior_Year_Riders FROM Changes WHERE Month_Index = ?;
+"""
+query_trend_monthly = """
+WITH Monthly AS (
+    SELECT Station_ID, CAST(strftime('%Y', Ride_Date) AS INTEGER) * 12 + CAST(strftime('%m', Ride_Date) AS INTEGER) - 1 AS Month_Index, SUM(Num_Riders) AS Riders
+    FROM Ridership WHERE Ride_Date >= ? AND Ride_Date < ? GROUP BY Station_ID, Month_Index
+), Changes AS (
+    SELECT Station_ID, Month_Index, Riders,
+        SUM(Riders) OVER (PARTITION BY Station_ID ORDER BY Month_Index RANGE BETWEEN 1 PRECEDING AND 1 PRECEDING) AS Last_Month,
+        SUM(Riders) OVER (PARTITION BY Station_ID ORDER BY Month_Index RANGE BETWEEN 12 PRECEDING AND 12 PRECEDING) AS Last_Year,
+        SUM(Riders) OVER (PARTITION BY Station_ID ORDER BY Month_Index RANGE BETWEEN 11 PRECEDING AND CURRENT ROW) AS Year_Riders,
+        SUM(Riders) OVER (PARTITION BY Station_ID ORDER BY Month_Index RANGE BETWEEN 23 PRECEDING AND 12 PRECEDING) AS Prior_Year_Riders
+    FROM Monthly
+)
+SELECT Station_ID, Riders, Last_Month, Last_Year, Year_Riders, Prior_Year_Riders FROM Changes WHERE Month_Index = ?;
+"""
+query_trend_daily = """
+WITH Daily AS (
+    SELECT Station_ID, CAST(julianday(Ride_Date) AS INTEGER) AS Day, Num_Riders
+    FROM Ridership WHERE Ride_Date >= ? AND Ride_Date < ?
+), Averages AS (
+    SELECT Station_ID, Day,
+        AVG(Num_Riders) OVER (PARTITION BY Station_ID ORDER BY Day RANGE BETWEEN 6 PRECEDING AND CURRENT ROW) AS Average_7,
+        AVG(Num_Riders) OVER (PARTITION BY Station_ID ORDER BY Day RANGE BETWEEN 27 PRECEDING AND CURRENT ROW) AS Average_28,
+        AVG(Num_Riders) OVER (PARTITION BY Station_ID ORDER BY Day RANGE BETWEEN 364 PRECEDING AND CURRENT ROW) AS Average_365
+    FROM Daily
+)
+SELECT Station_ID, Average_7, Average_28, Average_365 FROM Averages WHERE Day = CAST(julianday(?) AS INTEGER);
+"""
+query_trend_baseline_rollup = "SELECT Station_ID, SUM(Num_Riders) * 1.0 / SUM(Num_Days) FROM Ridership_Rollup WHERE Year = ? GROUP BY Station_ID;"
+query_trend_baseline = "SELECT Station_ID, AVG(Num_Riders) FROM Ridership WHERE Ride_Date >= ? AND Ride_Date < ? GROUP BY Station_ID;"
+
+# year a station's recovery is measured against, the last year before the pandemic
+BASELINE_YEAR = "2019"
+
+# what the trends can be ranked by
+rank_keys = ["yoy", "mom", "month_yoy", "recovery", "avg_7", "avg_28", "avg_365"]
+
+##################################################################
+#
+# Trend
+#
+# The trends of one station: the last complete month's riders and their
+# change from the month before (mom) and the same month a year before
+# (month_yoy), the riders of the twelve months up to it and their change
+# from the twelve before (yoy), the trailing averages on the as-of day and
+# the trailing 365 day average over the baseline year's (recovery).
+# Changes are in percent, None when there is nothing to compare with
+#
+Trend = collections.namedtuple("Trend", ["station_id", "station", "month", "month_riders", "mom", "month_yoy",
+                                         "year_riders", "yoy", "avg_7", "avg_28", "avg_365", "recovery"])
+
+##################################################################
+#
+# change
+#
+# Returns the percent change from before to now, None without a before
+#
+def change(now, before):
+    if now is None or not before:
+        return None
+    return (now - before) / before * 100
+
+##################################################################
+#
+# last_month
+#
+# Given the as-of day 'YYYY-MM-DD', returns the index (year * 12 + month - 1)
+# of the last month complete on that day
+#
+def last_month(as_of):
+    day = datetime.date.fromisoformat(as_of)
+    index = day.year * 12 + day.month - 1
+    if (day + datetime.timedelta(days=1)).month == day.month:
+        index -= 1
+    return index
+
+##################################################################
+#
+# month_start
+#
+# Given a month index, returns its first day 'YYYY-MM-01'
+#
+def month_start(index):
+    return "%04d-%02d-01" % (index // 12, index % 12 + 1)
+
+##################################################################
+#
+# monthly_changes
+#
+# Given a connection and a month index, returns station id -> (riders,
+# last month's, the same month last year's, twelve months', the twelve
+# before's) from one windowed pass over the two years up to that month
+#
+def monthly_changes(dbConn, month):
+    if rollups.rollups_current(dbConn):
+        parameters = (str((month - 23) // 12), str(month // 12), month)
+        rows = resultcache.fetchall(dbConn, query_trend_monthly_rollup, parameters)
+    else:
+        start, end = month_start(month - 23), month_start(month + 1)
+        rows = resultcache.fetchall(dbConn, partitions.span(dbConn, query_trend_monthly, start, end), (start, end, month))
+    return {row[0]: row[1:] for row in rows}
+
+##################################################################
+#
+# trailing_averages
+#
+# Given a connection and the as-of day, returns station id -> (7, 28, 365
+# day average) for the stations with data that day, from one windowed
+# pass over the year up to it
+#
+def trailing_averages(dbConn, as_of):
+    end = (datetime.date.fromisoformat(as_of) + datetime.timedelta(days=1)).isoformat()
+    start = (datetime.date.fromisoformat(as_of) - datetime.timedelta(days=364)).isoformat()
+    rows = resultcache.fetchall(dbConn, partitions.span(dbConn, query_trend_daily, start, end), (start, end, as_of))
+    return {row[0]: row[1:] for row in rows}
+
+##################################################################
+#
+# baseline_averages
+#
+# Given a connection and a year, returns station id -> riders on an
+# average day of that year
+#
+def baseline_averages(dbConn, year):
+    if rollups.rollups_current(dbConn):
+        rows = resultcache.fetchall(dbConn, query_trend_baseline_rollup, (year,))
+    else:
+        rows = partitions.fetchall(dbConn, query_trend_baseline, (), *dates.year_range(year), fetch=resultcache.fetchall)
+    return {row[0]: row[1] for row in rows}
+
+##################################################################
+#
+# station_trends
+#
+# Given a connection, the as-of day 'YYYY-MM-DD' (blank for the latest day
+# with data) and the baseline year, returns the Trend of every station with
+# data in the twelve months up to the as-of day, by station id
+# Raises ValueError for a day or year that is not valid
+#
+def station_trends(dbConn, as_of="", baseline=BASELINE_YEAR):
+    as_of = str(as_of or "").strip() or (stats.load_stats(dbConn)[4] or "")[0:10]
+    if not dates.day_range(as_of, as_of)[0]:
+        raise ValueError("the as-of day must be a date like 2019-12-31")
+    if not dates.year_range(baseline)[0]:
+        raise ValueError("the baseline must be a year like %s" % BASELINE_YEAR)
+
+    month = last_month(as_of[0:10])
+    monthly = monthly_changes(dbConn, month)
+    averages = trailing_averages(dbConn, as_of[0:10])
+    base = baseline_averages(dbConn, str(baseline).strip())
+    names = resolver.get_resolver(dbConn).names
+
+    result = []
+    for station_id in sorted(set(monthly) | set(averages)):
+        riders, last_month_riders, last_year, year_riders, prior_year = monthly.get(station_id, (None,) * 5)
+        avg_7, avg_28, avg_365 = averages.get(station_id, (None,) * 3)
+        recovery = avg_365 / base[station_id] if avg_365 is not None and base.get(station_id) else None
+        result.append(Trend(station_id, names.get(station_id, ""), month_start(month)[0:7], riders, change(riders, last_month_riders),
+                            change(riders, last_year), year_riders, change(year_riders, prior_year), avg_7, avg_28, avg_365, recovery))
+    return result
+
+##################################################################
+#
+# rank
+#
+# Given Trend rows and one of rank_keys, returns (growing, declining): the
+# stations with that value from the highest and from the lowest, ties by name
+#
+def rank(trends, key="yoy"):
+    if key not in rank_keys:
+        raise ValueError("rank must be one of %s" % ", ".join(rank_keys))
+    ranked = sorted((row for row in trends if getattr(row, key) is not None), key=lambda row: (row.station, row.station_id))
+    growing = sorted(ranked, key=lambda row: getattr(row, key), reverse=True)
+    declining = sorted(ranked, key=lambda row: getattr(row, key))
+    return growing, declining